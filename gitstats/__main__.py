@@ -1,19 +1,53 @@
 import argparse
 import logging
+import signal
 
 from .config import Config
-from .gitstats import GitStats
+from .daemon import Daemon
+from .gitstats import STAGES, GitStats
+from .utils import lower_priority
 
 log_format = '[%(levelname)s] %(asctime)s %(filename)s:%(lineno)d %(message)s'
 
 
+def comma_list(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def stage_list(value):
+    stages = comma_list(value)
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(
+            f'unknown stage {", ".join(unknown)}, choose from '
+            f'{", ".join(STAGES)}'
+        )
+    return stages
+
+
 def parse_command_args(argv=None):
     parser = argparse.ArgumentParser(__doc__)
     parser.add_argument('-v', '--verbose', action='store_true')
-    parser.add_argument('-f', '--force', action='store_true')
+    parser.add_argument('-f', '--force', action='store_true',
+                        help='recompute the stages from scratch, the '
+                        'selected ones only with --stage')
     parser.add_argument('-c', '--config-path')
+    parser.add_argument('--profile', action='store_true',
+                        help='dump cProfile stats of every stage into the '
+                        'profile folder of the data directory')
+    parser.add_argument('-d', '--daemon', action='store_true',
+                        help='keep running, update the changed repos at '
+                        'their refresh interval')
+    parser.add_argument('-r', '--repo', type=comma_list, action='extend',
+                        help='update only these repos, comma separated')
+    parser.add_argument('-s', '--stage', type=stage_list, action='extend',
+                        help='run only these stages, comma separated, and '
+                        'the stages they depend on if their outputs are '
+                        'missing')
 
     args = parser.parse_args(argv)
+    if args.daemon and (args.repo or args.stage):
+        parser.error('--repo and --stage cannot be used with --daemon')
 
     if args.verbose:
         logging.basicConfig(level=logging.DEBUG, format=log_format)
@@ -23,10 +57,20 @@ def parse_command_args(argv=None):
 
 def main(argv=None):
     args = parse_command_args(argv)
+    lower_priority()
 
     config = Config(**vars(args))
     stats = GitStats(config)
-    stats.run()
+    if not args.daemon:
+        stats.run(args.repo, args.stage)
+        return
+
+    daemon = Daemon(stats)
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        daemon.stop()
 
 
 if __name__ == '__main__':  # pragma: no cover
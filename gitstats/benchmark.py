@@ -0,0 +1,338 @@
+"""
+Benchmark the collectors and full runs against synthetic repositories
+
+    $ python3 -m gitstats.benchmark --commits 5000 -o bench.json
+    $ python3 -m gitstats.benchmark --commits 5000 --compare bench.json
+"""
+import argparse
+import json
+import logging
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+from tempfile import TemporaryDirectory
+
+from . import collectors, utils
+from .config import Config
+from .gitstats import GitStats
+
+logger = logging.getLogger(__name__)
+
+START_DATE = 1262304000  # 2010-01-01
+
+
+def _data(text):
+    data = text.encode()
+    return b'data %d\n%s\n' % (len(data), data)
+
+
+def generate_repo(path, commits=1000, authors=10, files=100, tags=10,
+                  branches=3, file_size=50, seed=0, append=False):
+    """
+    Build a deterministic synthetic repository with `git fast-import`
+
+    Every commit on master modifies, adds or deletes a few files. Tags are
+    annotated and spread evenly over the new commits, branches fork off
+    master and carry a few commits of their own.
+
+    :param path: the repository path, created if needed
+    :param commits: number of commits on master
+    :param authors: number of distinct authors
+    :param files: number of distinct file paths the commits touch
+    :param tags: number of tags
+    :param branches: number of branches besides master
+    :param file_size: average number of lines of a file
+    :param seed: seed of the generator, the same arguments and seed always
+        give the same repository
+    :param append: add the commits on top of the current master of an
+        existing repository instead, e.g. to benchmark incremental runs
+    """
+    rnd = random.Random(seed)
+    stream = []
+
+    if append:
+        head = utils.git(path, '', 'rev-parse', 'master')
+        offset = int(utils.git(path, '', 'rev-list', '--count', 'master'))
+        last = int(utils.git(path, '', 'log', '-n1', '--format=%ct'))
+        content = {}
+        for line in utils.git(path, '', 'ls-tree', '-r', '-z', '--name-only',
+                              'master').split('\0'):
+            if line:
+                content[line] = utils.git(path, '', 'show',
+                                          f'master:{line}').splitlines()
+    else:
+        os.makedirs(path, exist_ok=True)
+        utils.git(path, '', 'init', '--quiet')
+        head, offset, last, content = None, 0, START_DATE, {}
+
+    names = [f'Author {i}' for i in range(authors)]
+    paths = [f'src/module{i % 10}/file{i}.py' for i in range(files)]
+    tag_every = max(1, commits // tags) if tags else 0
+    fork_every = max(1, commits // (branches + 1)) if branches else 0
+    timestamp = last
+
+    def commit(ref, mark, parent, message, changes):
+        nonlocal timestamp
+        timestamp += rnd.randint(60, 2 * 86400)
+        name = rnd.choice(names)
+        ident = f'{name} <{name.lower().replace(" ", ".")}@example.com>'
+        stream.append(f'commit {ref}\nmark :{mark}\n'
+                      f'author {ident} {timestamp} +0000\n'
+                      f'committer {ident} {timestamp} +0000\n'.encode())
+        stream.append(_data(message))
+        if parent:
+            stream.append(f'from {parent}\n'.encode())
+        stream.extend(changes)
+
+    def changes(state):
+        result = []
+        for _ in range(rnd.randint(1, 4)):
+            fname = rnd.choice(paths)
+            lines = state.get(fname)
+            if lines and rnd.random() < 0.05:
+                del state[fname]
+                result.append(f'D {fname}\n'.encode())
+                continue
+            if not lines:
+                lines = [f'# {fname}']
+            keep = rnd.randint(0, len(lines))
+            lines = lines[:keep] + [
+                f'value_{rnd.randint(0, 10 ** 6)} = {keep + i}'
+                for i in range(rnd.randint(1, max(1, file_size // 5)))
+            ] + lines[keep:][:file_size * 2]
+            state[fname] = lines
+            result.append(f'M 100644 inline {fname}\n'.encode())
+            result.append(_data('\n'.join(lines) + '\n'))
+        return result
+
+    parent = head
+    for i in range(1, commits + 1):
+        number = offset + i
+        commit('refs/heads/master', i, parent, f'Commit {number}',
+               changes(content))
+        parent = f':{i}'
+
+        if tag_every and i % tag_every == 0 and i // tag_every <= tags:
+            stream.append(f'tag v{number}\nfrom :{i}\n'
+                          f'tagger Release <release@example.com> '
+                          f'{timestamp} +0000\n'.encode())
+            stream.append(_data(f'Release {number}'))
+
+        if fork_every and i % fork_every == 0 and i // fork_every <= branches:
+            branch = f'refs/heads/branch-{number}'
+            state = dict(content)
+            fork = f':{i}'
+            for j in range(rnd.randint(1, 5)):
+                mark = commits + i * 10 + j + 1
+                commit(branch, mark, fork, f'Branch {number} commit {j}',
+                       changes(state))
+                fork = f':{mark}'
+
+    utils.execute(['git', 'fast-import', '--quiet'], path,
+                  input=b''.join(stream), text=False)
+    utils.git(path, '', 'symbolic-ref', 'HEAD', 'refs/heads/master')
+    return path
+
+
+def _timed(func, *args, repeat=1):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return {
+        'min': min(times),
+        'median': statistics.median(times),
+        'runs': repeat,
+    }
+
+
+def bench_collectors(workdir, repo, repeat=3):
+    """
+    Time every collector against a cloned repository inside the workdir
+
+    :return: dict of collector name to its min and median time in seconds
+    """
+    def blame():
+        for fname in utils.git(workdir, repo, 'ls-tree', '-r', '-z',
+                               '--name-only', 'HEAD').split('\0'):
+            if fname:
+                collectors.get_blame(workdir, repo, False, fname)
+
+    def files_history():
+        collectors.files_history(workdir, (repo, None, {}))
+
+    def timestamps():
+        for tag in collectors.get_tags(workdir, repo)['tags']:
+            collectors.get_timestamp(workdir, repo, tag['revision'])
+
+    def num_files():
+        collectors.num_files(workdir, repo,
+                             {'revision': 'HEAD', 'timestamp': 0})
+
+    benches = {
+        'summary': (collectors.summary, workdir, repo),
+        'count_lines': (collectors.count_lines, workdir, repo),
+        'activity': (collectors.activity, workdir, repo),
+        'files_history': (files_history,),
+        'num_files': (num_files,),
+        'get_tags': (collectors.get_tags, workdir, repo),
+        'get_branches': (collectors.get_branches, workdir, repo),
+        'get_timestamp': (timestamps,),
+        'get_blame': (blame,),
+    }
+
+    results = {}
+    for name, (func, *args) in benches.items():
+        logger.info(f'benchmarking {name}')
+        results[name] = _timed(func, *args, repeat=repeat)
+    return results
+
+
+def bench_run(root, source, config_path, extra_commits, seed):
+    """
+    Time a full GitStats run from scratch and an incremental run after
+    adding commits to the source repository
+
+    :return: dict with the wall time and stage metrics of both runs
+    """
+    results = {}
+    for kind in ('cold', 'incremental'):
+        if kind == 'incremental':
+            generate_repo(source, commits=extra_commits, tags=1, branches=0,
+                          seed=seed + 1, append=True)
+
+        stats = GitStats(Config(config_path=config_path))
+        start = time.perf_counter()
+        stats.run()
+        results[kind] = {
+            'wall': time.perf_counter() - start,
+            'stages': {
+                name: {k: v for k, v in stage.items() if k != 'repos'}
+                for name, stage in stats.metrics.stages.items()
+            },
+        }
+    return results
+
+
+def benchmark(commits=1000, authors=10, files=100, tags=10, branches=3,
+              file_size=50, seed=0, repeat=3, extra_commits=10):
+    """
+    Generate a synthetic repository and benchmark the collectors and full
+    runs against it
+
+    :return: the machine readable benchmark results
+    """
+    params = {
+        'commits': commits, 'authors': authors, 'files': files,
+        'tags': tags, 'branches': branches, 'file_size': file_size,
+        'seed': seed, 'repeat': repeat, 'extra_commits': extra_commits,
+    }
+
+    with TemporaryDirectory(prefix='gitstats-bench') as root:
+        source = os.path.join(root, 'source', 'synthetic')
+        start = time.perf_counter()
+        generate_repo(source, commits=commits, authors=authors, files=files,
+                      tags=tags, branches=branches, file_size=file_size,
+                      seed=seed)
+        generate = time.perf_counter() - start
+
+        config_path = os.path.join(root, 'config.ini')
+        with open(config_path, 'w') as fh:
+            fh.write(f'[GLOBAL]\nworkdir = {os.path.join(root, "work")}\n\n'
+                     f'[REPOSITORIES]\nsynthetic = clone: {source}\n')
+
+        bench_workdir = os.path.join(root, 'bench')
+        os.makedirs(bench_workdir)
+        collectors.clone(bench_workdir, 'synthetic', source)
+        collector_results = bench_collectors(bench_workdir, 'synthetic',
+                                             repeat=repeat)
+        utils.close_cat_files()
+
+        run_results = bench_run(root, source, config_path, extra_commits,
+                                seed)
+
+    try:
+        revision = utils.git(utils.PROJECT_DIR, '', 'rev-parse', 'HEAD')
+    except Exception:
+        revision = None
+
+    return {
+        'revision': revision,
+        'date': datetime.utcnow().isoformat(),
+        'params': params,
+        'generate': generate,
+        'collectors': collector_results,
+        'run': run_results,
+    }
+
+
+def compare(old, new):
+    """
+    :return: lines of a table comparing the median times of two results
+    """
+    rows = [('collectors', 'old', 'new', 'ratio')]
+    for name, result in new['collectors'].items():
+        prev = old.get('collectors', {}).get(name, {}).get('median')
+        rows.append((name, prev, result['median']))
+    for kind, result in new['run'].items():
+        prev = old.get('run', {}).get(kind, {}).get('wall')
+        rows.append((f'run {kind}', prev, result['wall']))
+
+    lines = []
+    for name, prev, curr, *ratio in rows:
+        if not ratio:
+            ratio = [f'{curr / prev:.2f}x' if prev else '-']
+            prev = f'{prev:.3f}' if prev is not None else '-'
+            curr = f'{curr:.3f}'
+        lines.append(f'{name:<20} {prev:>10} {curr:>10} {ratio[0]:>8}')
+    return lines
+
+
+def parse_command_args(argv=None):
+    parser = argparse.ArgumentParser(__doc__)
+    parser.add_argument('-v', '--verbose', action='store_true')
+    parser.add_argument('--commits', type=int, default=1000)
+    parser.add_argument('--authors', type=int, default=10)
+    parser.add_argument('--files', type=int, default=100)
+    parser.add_argument('--tags', type=int, default=10)
+    parser.add_argument('--branches', type=int, default=3)
+    parser.add_argument('--file-size', type=int, default=50,
+                        help='average number of lines of a file')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='number of times every collector is timed')
+    parser.add_argument('--extra-commits', type=int, default=10,
+                        help='commits added before the incremental run')
+    parser.add_argument('-o', '--output', default='benchmark.json')
+    parser.add_argument('--compare', help='a previous benchmark output')
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_command_args(argv)
+    utils.lower_priority()
+    if args.verbose:
+        logging.basicConfig(level=logging.INFO)
+
+    old = None
+    if args.compare:
+        with open(args.compare) as fh:
+            old = json.load(fh)
+
+    options = {k: v for k, v in vars(args).items()
+               if k not in ('verbose', 'output', 'compare')}
+    results = benchmark(**options)
+
+    with open(args.output, 'w') as fh:
+        json.dump(results, fh, indent=2)
+
+    if old is not None:
+        print('\n'.join(compare(old, results)), file=sys.stdout)
+
+
+if __name__ == '__main__':  # pragma: no cover
+    main()
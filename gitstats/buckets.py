@@ -0,0 +1,301 @@
+"""
+Aggregate commits into the time buckets of activity.json from columns of
+commit data, with NumPy if available and in pure Python otherwise. Both give
+the same data, down to the order of the keys.
+"""
+import math
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+DAY = 24 * 60 * 60
+EPOCH = date(1970, 1, 1)
+METRICS = ('commits', 'insertions', 'deletions')
+PERIODS = ('yearly', 'monthly', 'daily', 'weekly')
+
+
+def aggregate(timestamps, authors, names, insertions, deletions):
+    """
+    :param timestamps: author timestamps of the commits, newest first
+    :param authors: index of the author in `names` of every commit
+    :param names: the author names
+    :param insertions: inserted lines of every commit, -1 if none
+    :param deletions: deleted lines of every commit, -1 if none
+    :return: activity data with `by_time`, `hour_of_week`, `by_authors` and
+        `authors_age`, the buckets are in local time
+    """
+    if np is not None:
+        return _aggregate_numpy(timestamps, authors, names, insertions,
+                                deletions)
+    return _aggregate_python(timestamps, authors, names, insertions,
+                             deletions)
+
+
+def _date_keys(day):
+    # as strftime() with %Y-%m-%d, %Y-%m and %Y-%V formats them
+    daily = day.isoformat()
+    return (
+        ('yearly', day.year),
+        ('monthly', daily[:7]),
+        ('daily', daily),
+        ('weekly', f'{daily[:4]}-{day.isocalendar()[1]:02d}'),
+    )
+
+
+def _aggregate_python(timestamps, authors, names, insertions, deletions):
+    hour_of_week = defaultdict(lambda: defaultdict(int))
+    by_time = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
+    by_authors = defaultdict(
+        lambda: defaultdict(
+            lambda: defaultdict(
+                lambda: defaultdict(int)
+            )
+        )
+    )
+    authors_age = defaultdict(lambda: defaultdict(int))
+
+    # the same day shows up for many commits, format its keys only once
+    date_keys = {}
+
+    for timestamp, author, inserted, deleted in zip(
+        timestamps, authors, insertions, deletions
+    ):
+        author = names[author]
+        date = datetime.fromtimestamp(timestamp)
+        day = date.date()
+        if day not in date_keys:
+            date_keys[day] = _date_keys(day)
+        keys = date_keys[day] + (('at_hour', date.hour),)
+
+        hour_of_week[date.weekday()][date.hour] += 1
+
+        if (
+            authors_age[author]['first_commit'] == 0 or
+            authors_age[author]['first_commit'] > timestamp
+        ):
+            authors_age[author]['first_commit'] = timestamp
+
+        if authors_age[author]['last_commit'] < timestamp:
+            authors_age[author]['last_commit'] = timestamp
+
+        data = [('commits', 1)]
+        if inserted >= 0:
+            data.append(('insertions', inserted))
+        if deleted >= 0:
+            data.append(('deletions', deleted))
+
+        author_data = by_authors[author]
+        for ktype, kvalue in keys:
+            for key, value in data:
+                by_time[ktype][key][kvalue] += value
+                author_data[ktype][key][kvalue] += value
+
+    for author in authors_age:
+        authors_age[author]['days'] = math.ceil((
+            authors_age[author]['last_commit'] -
+            authors_age[author]['first_commit']
+        ) / 60 / 60 / 24)
+
+    return {
+        'by_time': {k: dict(v) for k, v in by_time.items()},
+        'hour_of_week': {k: dict(v) for k, v in hour_of_week.items()},
+        'by_authors': {k: {kk: dict(vv) for kk, vv in v.items()}
+                       for k, v in by_authors.items()},
+        'authors_age': {k: dict(v) for k, v in authors_age.items()},
+    }
+
+
+def _utc_offsets(timestamps):
+    """
+    The local UTC offset at every timestamp, looked up once per UTC day
+    unless the offset changes within that day
+    """
+    def offset(timestamp):
+        local = datetime.fromtimestamp(timestamp) - datetime(1970, 1, 1)
+        return local // timedelta(seconds=1) - timestamp
+
+    days, inverse = np.unique(timestamps // DAY, return_inverse=True)
+    starts = np.array([offset(int(day) * DAY) for day in days],
+                      dtype=np.int64)
+    offsets = starts[inverse]
+    for i, day in enumerate(days):
+        if offset(int(day) * DAY + DAY - 1) != starts[i]:
+            changed = np.flatnonzero(inverse == i)
+            offsets[changed] = [offset(int(t)) for t in timestamps[changed]]
+    return offsets
+
+
+class _Pairs:
+    """
+    The distinct (group, bucket) pairs of the commits, counted directly if
+    the pairs are few enough and found by sorting otherwise
+    """
+    def __init__(self, groups, buckets, size):
+        self.size = size
+        keys = groups * size + buckets
+        if keys.max() < 4 * len(keys) + 1024:
+            self.keys = np.flatnonzero(np.bincount(keys))
+            lookup = np.zeros(self.keys[-1] + 1, dtype=np.int64)
+            lookup[self.keys] = np.arange(len(self.keys))
+            self.inverse = lookup[keys]
+        else:
+            self.keys, self.inverse = np.unique(keys, return_inverse=True)
+
+    def sums(self, weights=None, mask=None, grouped=False):
+        """
+        Sum the weights of the selected commits by pair
+
+        :param grouped: order the pairs by group first
+        :return: arrays of the groups, buckets and sums of the pairs in the
+            order they are first seen
+        """
+        count = len(self.keys)
+        if mask is None:
+            selected = np.arange(len(self.inverse))
+            inverse = self.inverse
+        else:
+            selected = np.flatnonzero(mask)
+            inverse = self.inverse[selected]
+            weights = None if weights is None else weights[selected]
+
+        sums = np.bincount(inverse, weights=weights, minlength=count)
+        firsts = np.full(count, len(self.inverse), dtype=np.int64)
+        np.minimum.at(firsts, inverse, selected)
+        pairs = np.flatnonzero(firsts < len(self.inverse))
+        groups = self.keys[pairs] // self.size
+        if grouped:
+            pairs = pairs[np.lexsort((firsts[pairs], groups))]
+        else:
+            pairs = pairs[np.argsort(firsts[pairs], kind='stable')]
+        keys = self.keys[pairs]
+        sums = sums[pairs].astype(np.int64)
+        return keys // self.size, keys % self.size, sums
+
+    def update(self, dicts, names, weights=None, mask=None):
+        """
+        Add the sums of every group to its dict, keyed by the bucket names in
+        the order first seen
+
+        :param dicts: list of the dict of every group
+        """
+        groups, buckets, sums = self.sums(weights, mask, grouped=True)
+        names = np.array(names, dtype=object)
+        keys, sums = names[buckets].tolist(), sums.tolist()
+        bounds = np.flatnonzero(np.diff(groups)) + 1
+        for start, end in zip([0, *bounds.tolist()],
+                              [*bounds.tolist(), len(keys)]):
+            dicts[groups[start]].update(zip(keys[start:end],
+                                            sums[start:end]))
+
+
+def _firsts(groups, count, mask):
+    """
+    :return: the position of the first selected commit of every group, the
+        number of commits if none
+    """
+    firsts = np.full(count, len(groups), dtype=np.int64)
+    selected = np.flatnonzero(mask)
+    np.minimum.at(firsts, groups[selected], selected)
+    return firsts
+
+
+def _aggregate_numpy(timestamps, authors, names, insertions, deletions):
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    authors = np.asarray(authors, dtype=np.int64)
+    insertions = np.asarray(insertions, dtype=np.int64)
+    deletions = np.asarray(deletions, dtype=np.int64)
+    data = {'by_time': {}, 'hour_of_week': {}, 'by_authors': {},
+            'authors_age': {}}
+    if not len(timestamps):
+        return data
+
+    local = timestamps + _utc_offsets(timestamps)
+    days = local // DAY
+    hours = (local - days * DAY) // 3600
+    weekdays = (days + 3) % 7  # 1970-01-01 was a Thursday
+
+    # the buckets of every period are formatted once per day
+    unique_days, day_inverse = np.unique(days, return_inverse=True)
+    day_keys = [_date_keys(EPOCH + timedelta(days=int(day)))
+                for day in unique_days]
+    buckets = {}
+    for i, period in enumerate(PERIODS):
+        ids = {}
+        of_day = np.array([ids.setdefault(keys[i][1], len(ids))
+                           for keys in day_keys], dtype=np.int64)
+        buckets[period] = (of_day[day_inverse], list(ids))
+    buckets['at_hour'] = (hours, list(range(24)))
+
+    # the metrics are counted for commits having them, in the order seen
+    every = np.ones(len(timestamps), dtype=bool)
+    masks = {'commits': None, 'insertions': insertions >= 0,
+             'deletions': deletions >= 0}
+    weights = {'commits': None, 'insertions': insertions,
+               'deletions': deletions}
+
+    def metric_order(firsts):
+        return [metric for _, _, metric in sorted(
+            (first, i, metric) for i, (metric, first) in
+            enumerate(zip(METRICS, firsts)) if first < len(timestamps)
+        )]
+
+    nobody = np.zeros(len(timestamps), dtype=np.int64)
+    order = metric_order([
+        _firsts(nobody, 1, every if masks[m] is None else masks[m])[0]
+        for m in METRICS
+    ])
+    by_time = data['by_time']
+    for period in buckets:
+        by_time[period] = {metric: {} for metric in order}
+
+    author_firsts = [
+        _firsts(authors, len(names), every if masks[m] is None else masks[m])
+        for m in METRICS
+    ]
+    seen = np.flatnonzero(author_firsts[0] < len(timestamps))
+    seen = seen[np.argsort(author_firsts[0][seen], kind='stable')].tolist()
+    by_authors = data['by_authors']
+    for author in seen:
+        order = metric_order([firsts[author] for firsts in author_firsts])
+        by_authors[names[author]] = {
+            period: {metric: {} for metric in order} for period in buckets
+        }
+
+    author_periods = [by_authors.get(name) for name in names]
+    for period, (bucket, keys) in buckets.items():
+        overall = _Pairs(nobody, bucket, len(keys))
+        by_author = _Pairs(authors, bucket, len(keys))
+        for metric in METRICS:
+            if metric not in by_time[period]:
+                continue
+            overall.update([by_time[period][metric]], keys, weights[metric],
+                           masks[metric])
+            by_author.update([
+                periods and periods[period].get(metric)
+                for periods in author_periods
+            ], keys, weights[metric], masks[metric])
+
+    weekdays, hours, sums = _Pairs(weekdays, hours, 24).sums()
+    hour_of_week = data['hour_of_week']
+    for weekday, hour, value in zip(weekdays.tolist(), hours.tolist(),
+                                    sums.tolist()):
+        hour_of_week.setdefault(weekday, {})[hour] = value
+
+    order = np.argsort(authors, kind='stable')
+    starts = np.flatnonzero(np.diff(authors[order], prepend=-1))
+    ages = zip(authors[order][starts].tolist(),
+               np.minimum.reduceat(timestamps[order], starts).tolist(),
+               np.maximum.reduceat(timestamps[order], starts).tolist())
+    ages = {author: (first, max(last, 0)) for author, first, last in ages}
+    for author in seen:
+        first, last = ages[author]
+        data['authors_age'][names[author]] = {
+            'first_commit': first, 'last_commit': last,
+            'days': math.ceil((last - first) / 60 / 60 / 24),
+        }
+
+    return data
@@ -1,12 +1,11 @@
-import json
 import logging
 import math
 import os
-import re
+from array import array
 from collections import defaultdict
 from datetime import datetime
 
-from . import utils
+from . import utils, ownership, commits, buckets, loc, trees
 
 logger = logging.getLogger(__name__)
 
@@ -16,61 +15,78 @@ def update_repo(workdir, repo):
     Update a given repository to current state
 
     :param workdir: working root folder
-    :param repo: a tuple (repo_name, repo_origin_path)
+    :param repo: a tuple (repo_name, repo_origin_path, mirror), a new clone
+        is a bare mirror if `mirror` is true, which is optional
     :return: a dict {repo_name: current_head_info}
     """
     try:
-        clone(workdir, *repo)
-        utils.run_git(workdir, repo[0], 'pull --tags')
-        head, timestamp, author = utils.run_git(
-            workdir, repo[0],
-            f'log --pretty=format:"%H %at %aN" -n1'
-        ).split(' ', 2)
-        first_commit = int(utils.run_git(
-            workdir, repo[0],
-            'log --reverse --pretty=format:"%at"'
-        ).splitlines()[0])
+        name, origin, *mirror = repo
+        clone(workdir, name, origin, bool(mirror and mirror[0]))
+        if utils.is_bare(workdir, name):
+            utils.git(workdir, name, 'fetch', '--prune', '--quiet', 'origin')
+        else:
+            utils.git(workdir, name, 'pull', '--tags')
+        index = commits.load_index(workdir, name)
+        trees.load_index(workdir, name)
         return {
-            'name': repo[0],
-            'HEAD': head,
-            'date': int(timestamp),
-            'start_date': int(first_commit),
-            'author': author,
+            'name': name,
+            'HEAD': index.head,
+            'date': index.timestamps[-1],
+            'start_date': index.timestamps[0],
+            'author': index.author(-1),
         }
     except Exception:
         logger.exception(f'update error for repo "{repo}"')
         return {}
 
 
-def clone(workdir, repo_name, repo_path):
+def remote_refs(workdir, repo):
+    """
+    List the refs of the origin of a repository with `git ls-remote`, which
+    is much cheaper than fetching, to tell if it has changed
+
+    :param repo: a tuple (repo_name, repo_origin_path, ...)
+    :return: a dict with the `name` of the repo and a hash of its remote
+        `refs`, None if they could not be listed
+    """
+    name, origin = repo[:2]
+    try:
+        refs = utils.git(workdir, '', 'ls-remote', origin)
+        refs = utils.content_hash(refs.encode())
+    except Exception:
+        logger.exception(f'ls-remote error for repo "{name}"')
+        refs = None
+    return {'name': name, 'refs': refs}
+
+
+def clone(workdir, repo_name, repo_path, mirror=False):
     """
     Clone current repository. It will fail silently if already cloned.
+
+    :param mirror: make a bare mirror without a working tree
     """
     try:
-        return utils.run(f'git clone {repo_path} {repo_name}', workdir)
+        opts = ['--mirror'] if mirror else []
+        return utils.execute(['git', 'clone', *opts, repo_path, repo_name],
+                             workdir)
     except Exception:
         pass
 
 
 def summary(workdir, repo):
-    empty_sha = utils.empty_git_sha(workdir, repo)
-    output = utils.run_git(workdir, repo, f'diff --shortstat {empty_sha}')
-    files, lines = re.search(r'(\d+) .*, (\d+) .*', output).groups()
-    authors = len(utils.run_git(workdir, repo, 'shortlog -s').splitlines())
-    commits = utils.run_git(workdir, repo, 'rev-list --count HEAD')
-    branches = len([x for x in utils.run_git(workdir, repo,
-                                             'branch -r').splitlines()
-                    if 'HEAD' not in x])
-    first_commit = int(utils.run_git(
-        workdir, repo,
-        'log --reverse --pretty=format:"%at"'
-    ).splitlines()[0])
-    latest_commit = int(utils.run_git(workdir, repo,
-                                      'log --pretty=format:"%at" -n1'))
+    tree = trees.load_index(workdir, repo)
+    files, lines = str(len(tree)), str(tree.lines)
+    index = commits.load_index(workdir, repo)
+    # the branches of a mirror are local, of a clone remote
+    branches = len([x for x in utils.git(
+        workdir, repo, 'branch',
+        *([] if utils.is_bare(workdir, repo) else ['-r'])
+    ).splitlines() if 'HEAD' not in x])
+    first_commit, latest_commit = index.timestamps[0], index.timestamps[-1]
     age = math.ceil((latest_commit - first_commit) / 60 / 60 / 24)
     try:
-        tags = len(utils.run_git(workdir, repo,
-                                 'show-ref --tags').splitlines())
+        tags = len(utils.git(workdir, repo,
+                             'show-ref', '--tags').splitlines())
     except Exception:
         tags = 0
 
@@ -78,8 +94,9 @@ def summary(workdir, repo):
         'data': [
             {'key': 'files', 'value': files},
             {'key': 'lines', 'value': lines, 'notes': 'includes empty lines'},
-            {'key': 'authors', 'value': authors},
-            {'key': 'commits', 'value': commits, 'notes': 'master only'},
+            {'key': 'authors', 'value': len(index.names)},
+            {'key': 'commits', 'value': str(len(index)),
+             'notes': 'master only'},
             {'key': 'branches', 'value': branches},
             {'key': 'tags', 'value': tags},
             {'key': 'age', 'value': age, 'notes': 'active days since creation'},
@@ -88,145 +105,427 @@ def summary(workdir, repo):
     }
 
 
-def activity(workdir, repo):
-    hour_of_week = defaultdict(lambda: defaultdict(int))
-    by_time = defaultdict(lambda: defaultdict(lambda: defaultdict(int)))
-    authors = defaultdict(
-        lambda: defaultdict(
-            lambda: defaultdict(
-                lambda: defaultdict(int)
-            )
-        )
-    )
-    authors_age = defaultdict(lambda: defaultdict(int))
+def iter_log(workdir, repo, rev_range='HEAD'):
+    """
+    Stream the commit log of a repository in a single pass
 
-    revisions = []
-    for line in utils.run_git(
+    Every commit is written as a NUL prefixed record of a header line
+    followed by an optional shortstat line, so the output can be consumed
+    from the pipe without buffering the whole history.
+
+    :return: generator of (timestamp, revision, author, insertions,
+        deletions) tuples, newest commit first
+    """
+    for record in utils.stream_git(
         workdir, repo,
-        'log --shortstat --pretty=format:"%at %T %aN" HEAD'
-    ).splitlines():
-        line = line.strip()
-        if not line:
-            continue
+        'log', '--shortstat', '--pretty=format:%x00%at %T %aN', rev_range
+    ):
+        header, _, stat = record.strip().partition(b'\n')
+        timestamp, revision, author = header.decode(
+            'utf-8', 'replace').split(' ', 2)
+        insertions, deletions = commits.parse_shortstat(stat)
+        yield int(timestamp), revision, author, insertions, deletions
 
-        data = {}
-        m = re.search(r'\d+ files? changed,', line)
-        if m:
-            m = re.search(r' (\d+) insert', line)
-            if m:
-                data['insertions'] = int(m.groups()[0])
-            m = re.search(r' (\d+) delet', line)
-            if m:
-                data['deletions'] = int(m.groups()[0])
-        else:
-            data['commits'] = 1
-            timestamp, revision, author = line.split(' ', 2)
-            timestamp = int(timestamp)
+
+def activity(workdir, repo, rev_range='HEAD', index=None, start=0):
+    """
+    Aggregate the commits of a repository by time and author
+
+    :param index: the CommitIndex to aggregate the commits of from the start
+        position on, the rev_range is walked if not given
+    """
+    if index is None:
+        # the columns are built in typed arrays while streaming the log, like
+        # the CommitIndex holds them
+        timestamps, authors = array('q'), array('i')
+        insertions, deletions = array('i'), array('i')
+        names = {}
+        revisions = []
+        for timestamp, revision, author, inserted, deleted in iter_log(
+            workdir, repo, rev_range
+        ):
+            timestamps.append(timestamp)
+            authors.append(names.setdefault(author, len(names)))
+            insertions.append(-1 if inserted is None else inserted)
+            deletions.append(-1 if deleted is None else deleted)
             revisions.append({'timestamp': timestamp, 'revision': revision})
+        data = buckets.aggregate(timestamps, authors, list(names),
+                                 insertions, deletions)
+    else:
+        # the index is oldest first
+        data = buckets.aggregate(
+            index.timestamps[start:][::-1], index.authors[start:][::-1],
+            index.names, index.insertions[start:][::-1],
+            index.deletions[start:][::-1],
+        )
+        revisions = [{'timestamp': index.timestamps[i],
+                      'revision': index.tree(i)}
+                     for i in range(len(index) - 1, start - 1, -1)]
 
-            date = datetime.fromtimestamp(timestamp)
-            month = date.strftime('%Y-%m')
-            day = date.strftime('%Y-%m-%d')
-            week = date.strftime('%Y-%V')
+    return {
+        'data': data,
+        'revisions': revisions,
+        'repo': repo,
+    }
 
-            hour_of_week[date.weekday()][date.hour] += 1
 
-            if (
-                authors_age[author]['first_commit'] == 0 or
-                authors_age[author]['first_commit'] > timestamp
-            ):
-                authors_age[author]['first_commit'] = timestamp
+def activity_since(workdir, repo_state):
+    """
+    Collect the activity of a repository committed after a previously
+    processed HEAD
 
-            if authors_age[author]['last_commit'] < timestamp:
-                authors_age[author]['last_commit'] = timestamp
+    :param workdir: working root folder
+    :param repo_state: a tuple (repo_name, previous_head), previous_head may
+        be None to walk the whole history
+    :return: activity result of the new commits only with the processed
+        `HEAD` and the `since` revision, which is None when the previous head
+        is not in the commit index anymore and the whole history has been
+        aggregated
+    """
+    repo, since = repo_state
+    index = commits.load_index(workdir, repo)
+    start = index.position(since) if since else None
+    if start is None:
+        since, start = None, 0
 
-        for ktype, kvalue in (
-            ('yearly', date.year),
-            ('monthly', month),
-            ('daily', day),
-            ('weekly', week),
-            ('at_hour', date.hour),
-        ):
-            for key, value in data.items():
-                by_time[ktype][key][kvalue] += value
-                authors[author][ktype][key][kvalue] += value
+    result = activity(workdir, repo, index=index, start=start)
+    result.update({'HEAD': index.head, 'since': since})
+    return result
 
-    for author in authors_age:
-        authors_age[author]['days'] = math.ceil((
-            authors_age[author]['last_commit'] -
-            authors_age[author]['first_commit']
-        ) / 60 / 60 / 24)
+
+def merge_activity(data, delta):
+    """
+    Merge the counters of newer commits into previously saved activity data
+
+    :param data: activity data as loaded from activity.json
+    :param delta: activity data of the commits made after `data`
+    :return: the updated `data`
+    """
+    def merge(old, new):
+        for key, value in new.items():
+            key = str(key)
+            if isinstance(value, dict):
+                merge(old.setdefault(key, {}), value)
+            else:
+                old[key] = old.get(key, 0) + value
+
+    for key in ('by_time', 'hour_of_week', 'by_authors'):
+        merge(data.setdefault(key, {}), delta[key])
+
+    authors_age = data.setdefault('authors_age', {})
+    for author, age in delta['authors_age'].items():
+        prev = authors_age.setdefault(author, dict(age))
+        prev['first_commit'] = min(prev['first_commit'], age['first_commit'])
+        prev['last_commit'] = max(prev['last_commit'], age['last_commit'])
+        prev['days'] = math.ceil(
+            (prev['last_commit'] - prev['first_commit']) / 60 / 60 / 24
+        )
+
+    return data
+
+
+def count_lines(workdir, repo):
+    try:
+        lines, hits, misses = loc.count_revision(workdir, repo)
+    except Exception:
+        lines, hits, misses = [], 0, 0
 
     return {
         'data': {
-            'by_time': {k: dict(v) for k, v in by_time.items()},
-            'hour_of_week': {k: dict(v) for k, v in hour_of_week.items()},
-            'by_authors': {k: {kk: dict(vv) for kk, vv in v.items()}
-                           for k, v in authors.items()},
-            'authors_age': {k: dict(v) for k, v in authors_age.items()},
+            'lines': lines,
         },
-        'revisions': revisions,
         'repo': repo,
+        'cache': {'hits': hits, 'misses': misses},
     }
 
 
-def count_lines(workdir, repo):
+def lines_history(workdir, repo_state):
+    """
+    Count the lines of code by language at every tag and at the last commit
+    of every month on the first parent history of HEAD. Blobs and subtrees
+    shared by the revisions are counted once, and revisions whose tree was
+    counted in the previous history are not counted again. The counts of the
+    blobs of the trees counted last are kept in the gitstats-lines-history
+    file of the repo, so that a new revision reads its changed blobs only.
+
+    :param repo_state: a tuple (repo, known) where `known` is the previously
+        saved lines history or None
+    :return: a dict with the lines history `data` of `tags`, newest first,
+        and `monthly` revisions
+    """
+    repo, known = repo_state
+    known = known or {'tags': [], 'monthly': {}}
+    counted = {point['tree']: point['lines'] for point in
+               [*known['tags'], *known['monthly'].values()]}
+
     try:
-        lines = json.loads(utils.run(f'cloc --vcs git --json',
-                           os.path.join(workdir, repo)).stdout.strip())
+        tags = [{'tag': tag['tag'], 'timestamp': tag['timestamp'],
+                 'revision': tag['commit']}
+                for tag in list_tags(workdir, repo) if tag['commit']]
+        cat = utils.cat_file(workdir, repo)
+        for tag in tags:
+            tag['tree'] = cat.commit(tag['revision'])['tree']
+
+        monthly = {}
+        for record in utils.stream_git(workdir, repo, 'log', '--first-parent',
+                                       '--pretty=format:%H %T %ct', 'HEAD',
+                                       sep=b'\n'):
+            revision, tree, timestamp = record.decode().split()
+            month = datetime.fromtimestamp(int(timestamp)).strftime('%Y-%m')
+            if month not in monthly:
+                monthly[month] = {'timestamp': int(timestamp),
+                                  'revision': revision, 'tree': tree}
+        monthly = dict(reversed(monthly.items()))
+
+        points = [*tags, *monthly.values()]
+        trees = list({point['tree']: None for point in points
+                      if point['tree'] not in counted})
+        # the blobs of HEAD are looked up in the cache of the lines as well
+        path = loc.history_cache_path(workdir, repo)
+        cache = {**loc.load_cache(loc.cache_path(workdir, repo)),
+                 **loc.load_cache(path)}
+        blobs = set()
+        counts, misses = loc.count_trees(workdir, repo, trees, cache,
+                                         blobs=blobs)
+        # the blobs of the newest trees are kept for the next ones
+        if misses:
+            utils.save_json({sha: cache[sha] for sha in blobs},
+                            os.path.dirname(path),
+                            loc.HISTORY_CACHE_FILENAME)
+        counted.update((tree, loc.tree_lines(tree_counts))
+                       for tree, tree_counts in zip(trees, counts))
+        for point in points:
+            point['lines'] = counted[point['tree']]
     except Exception:
-        lines = []
+        logger.exception(f'lines history error for repo "{repo}"')
+        tags, monthly, trees, points = [], {}, [], []
 
     return {
-        'data': {
-            'lines': lines,
-        },
+        'data': {'tags': tags, 'monthly': monthly},
         'repo': repo,
+        'cache': {'hits': len(points) - len(trees), 'misses': len(trees)},
     }
 
 
 def num_files(workdir, repo, revision):
-    files = len(utils.run_git(
-        workdir, repo,
-        f'ls-tree -r --name-only {revision["revision"]}'
-    ).splitlines())
+    cat = utils.cat_file(workdir, repo)
     return {
         revision['revision']: {
             'timestamp': revision['timestamp'],
-            'files': files,
+            'files': count_tree_files(cat, revision['revision']),
         },
     }
 
 
+def count_tree_files(cat, tree, memo=None):
+    """
+    Count the files of a tree recursively, like `ls-tree -r` does
+
+    :param cat: the CatFile of the repo
+    :param tree: a tree or commit object
+    :param memo: optional dict of already counted subtrees
+    """
+    memo = {} if memo is None else memo
+    if tree not in memo:
+        files = 0
+        for mode, _, sha in cat.tree(tree):
+            if mode == '40000':
+                files += count_tree_files(cat, sha, memo)
+            else:
+                files += 1
+        memo[tree] = files
+    return memo[tree]
+
+
+def files_history(workdir, repo_state):
+    """
+    Count the files of every revision by replaying the file additions and
+    deletions of a single history walk on a running counter
+
+    Merges are counted against their first parent. Commits at the boundary
+    of an incremental walk are looked up in the known counts by their tree
+    and only counted from their tree objects when missing there.
+
+    :param workdir: working root folder
+    :param repo_state: a tuple (repo_name, since, known) where `since` is the
+        HEAD walked previously or None, and `known` is the previously saved
+        files history
+    :return: a dict with files history `data` of the walked revisions
+    """
+    repo, since, known = repo_state
+    head = utils.git(workdir, repo, 'rev-parse', 'HEAD')
+    rev_range = f'{since}..{head}' if since else head
+
+    cat = utils.cat_file(workdir, repo)
+    memo = {}
+    counts = {}
+    data = {}
+
+    def count(tree):
+        if tree in known:
+            return known[tree]['files']
+        return count_tree_files(cat, tree, memo)
+
+    for record in utils.stream_git(
+        workdir, repo,
+        'log', '--reverse', '--topo-order', '--boundary',
+        '--diff-merges=first-parent', '--summary', '--no-renames',
+        '--pretty=format:%x00%m %H %T %at %P', rev_range
+    ):
+        header, *changes = record.strip().split(b'\n')
+        mark, commit, tree, timestamp, *parents = header.decode().split()
+        if mark == '-':
+            counts[commit] = count(tree)
+            continue
+
+        files = 0
+        if parents:
+            if parents[0] not in counts:
+                counts[parents[0]] = count(
+                    cat.info(f'{parents[0]}^{{tree}}')[0]
+                )
+            files = counts[parents[0]]
+
+        for line in changes:
+            if line.startswith(b' create mode '):
+                files += 1
+            elif line.startswith(b' delete mode '):
+                files -= 1
+
+        counts[commit] = files
+        data[tree] = {'timestamp': int(timestamp), 'files': files}
+
+    return {
+        'data': data,
+        'HEAD': head,
+        'repo': repo,
+    }
+
+
 def get_tags(workdir, repo):
-    try:
-        tags = []
+    """
+    Collect the tags of a repository with their creation dates and the
+    authors of the commits released with each tag
 
-        for line in utils.run_git(
-            workdir, repo,
-            f'show-ref --tags'
-        ).splitlines():
-            revision, tag = line.split()
-            tag = tag.replace('refs/tags/', '')
-            tags.append({'tag': tag, 'revision': revision})
+    :return: a dict with the `tags` list, newest tag first
+    """
+    try:
+        tags = list_tags(workdir, repo)
+        tag_authors(workdir, repo, tags)
 
     except Exception:
+        logger.exception(f'tags error for repo "{repo}"')
         tags = []
 
+    for tag in tags:
+        tag.pop('commit', None)
+
     return {
         'tags': tags,
         'repo': repo,
     }
 
 
+def list_tags(workdir, repo):
+    """
+    :return: list of the tags of a repository, newest first, with the tag
+        `revision`, the tagged `commit` peeled from an annotated tag, None if
+        it tags another type of object, and the `timestamp` of its creation
+    """
+    tags = []
+    for line in utils.git(
+        workdir, repo,
+        'for-each-ref', '--format=%(objectname)%09%(*objectname)%09'
+        '%(objecttype)%09%(*objecttype)%09%(creatordate:unix)%09'
+        '%(refname:strip=2)', 'refs/tags'
+    ).splitlines():
+        revision, commit, kind, peeled_kind, timestamp, tag = line.split(
+            '\t', 5)
+        tags.append({
+            'tag': tag,
+            'revision': revision,
+            'commit': (commit or revision)
+            if (peeled_kind or kind) == 'commit' else None,
+            'timestamp': int(timestamp or 0),
+        })
+
+    tags.sort(key=lambda x: -x['timestamp'])
+    return tags
+
+
+def tag_authors(workdir, repo, tags):
+    """
+    Attribute every commit to the oldest tag containing it and set the
+    `authors` and `commits` counts of each tag from a single history walk
+
+    The walk is in topological order, so all children of a commit are seen
+    before it and the oldest tag containing the commit is known by then.
+
+    :param tags: list of tags with `timestamp` and the tagged `commit`,
+        which is None for tags of other objects, updated in place
+    """
+    ranks = {}
+    for rank, tag in enumerate(sorted(tags, key=lambda x: x['timestamp'])):
+        if tag['commit'] and ranks.get(tag['commit'], len(tags)) > rank:
+            ranks[tag['commit']] = rank
+
+    counts = [defaultdict(int) for _ in tags]
+    pending = {}
+
+    if ranks:
+        for record in utils.stream_git(
+            workdir, repo,
+            'log', '--topo-order', '--stdin',
+            '--pretty=format:%x00%H %P%x09%aN',
+            input=''.join(f'{commit}\n' for commit in ranks).encode(),
+        ):
+            header, _, author = record.strip().decode(
+                'utf-8', 'replace').partition('\t')
+            commit, *parents = header.split()
+
+            rank = min(pending.pop(commit, len(tags)),
+                       ranks.get(commit, len(tags)))
+            if rank == len(tags):
+                continue
+
+            counts[rank][author] += 1
+            for parent in parents:
+                if pending.get(parent, len(tags)) > rank:
+                    pending[parent] = rank
+
+    by_rank = sorted(tags, key=lambda x: x['timestamp'])
+    for rank, tag in enumerate(by_rank):
+        authors = counts[rank] if ranks.get(tag['commit']) == rank else {}
+        tag['authors'] = [{'author': author, 'commits': commits}
+                          for author, commits in sorted(authors.items())]
+        tag['commits'] = sum(authors.values())
+
+    return tags
+
+
 def get_branches(workdir, repo):
+    """
+    Collect the remote branches of a repository with their creation dates
+
+    :return: a dict with the `branches` list, newest branch first
+    """
+    # the branches of a mirror are the local ones, named as in a clone
+    bare = utils.is_bare(workdir, repo)
     branches = []
-    for line in utils.run_git(workdir, repo, 'branch -r').splitlines():
-        line = line.strip()
-        if 'HEAD' in line:
+    for line in utils.git(
+        workdir, repo,
+        'for-each-ref', '--format=%(objectname)%09%(symref)%09'
+        '%(creatordate:unix)%09%(refname:strip=2)',
+        'refs/heads' if bare else 'refs/remotes'
+    ).splitlines():
+        _, symref, timestamp, branch = line.split('\t', 3)
+        if symref:
             continue
 
-        branches.append(line)
+        branches.append({'timestamp': int(timestamp),
+                         'revision': f'origin/{branch}' if bare else branch})
+
+    branches.sort(key=lambda x: -x['timestamp'])
 
     return {
         'branches': branches,
@@ -235,26 +534,50 @@ def get_branches(workdir, repo):
 
 
 def get_blame(workdir, repo, detect_move, fname):
-    authors = defaultdict(int)
-    opts = '-C -C -C -M' if detect_move else ''
+    """
+    Count the lines of a file at HEAD per author
+
+    :return: dict of the file, its authors and the runs of authors of its
+        lines, `failed` is set if the blame did not succeed
+    """
+    lines = []
+    opts = ['-C', '-C', '-C', '-M'] if detect_move else []
 
     try:
-        for line in utils.run_git(
-            workdir, repo, f'blame --line-porcelain {opts} -w {fname}'
+        for line in utils.git(
+            workdir, repo, 'blame', '--line-porcelain', *opts, '-w', 'HEAD',
+            '--', fname
         ).splitlines():
             if line.startswith('author '):
                 _, author = line.split(' ', 1)
-                authors[author] += 1
+                lines.append(author)
     except Exception:
-        pass
+        logger.exception(f'{repo} failed to blame {fname}')
+        return {'file': fname, 'authors': {}, 'failed': True}
+
+    runs = ownership.runs_of(lines)
+    return {'file': fname, 'authors': ownership.count_authors(runs),
+            'runs': runs}
 
-    return {'file': fname, 'authors': dict(authors)}
+
+def get_blames(workdir, task):
+    """
+    Blame a batch of files of a repo
+
+    :param task: a tuple (repo_name, detect_move, file names)
+    :return: dict of the repo and the get_blame() results
+    """
+    repo, detect_move, fnames = task
+    return {
+        'repo': repo,
+        'results': [get_blame(workdir, repo, detect_move, fname)
+                    for fname in fnames],
+    }
 
 
 def get_timestamp(workdir, repo, revision):
-    timestamp = utils.run_git(workdir, repo,
-                              f'log --pretty=format:"%at" -n 1 {revision}')
+    timestamp = utils.cat_file(workdir, repo).commit(revision)['author'][1]
     return {
-        'timestamp': int(timestamp),
+        'timestamp': timestamp,
         'revision': revision,
     }
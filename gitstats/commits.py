@@ -0,0 +1,216 @@
+"""
+A compact index of the commits of a repo, persisted in its git folder and
+extended incrementally, from which the history statistics are derived
+without walking the history again
+"""
+import json
+import os
+import sys
+from array import array
+
+from . import utils
+
+VERSION = 1
+FILENAME = 'gitstats-commits'
+
+
+class CommitIndex:
+    """
+    The commits reachable from HEAD in the order of `git log --reverse`, held
+    in columns of typed arrays. Author names are interned, insertions and
+    deletions are -1 when the commit has no such changes.
+
+    The HEADs the index was extended to are kept with the number of commits
+    at that time, so that the commits made after any of them are a slice.
+    """
+    def __init__(self):
+        self.hash_size = 0
+        self.commits = bytearray()
+        self.trees = bytearray()
+        self.timestamps = array('q')
+        self.authors = array('i')
+        self.insertions = array('i')
+        self.deletions = array('i')
+        self.parents = array('B')
+        self.names = []
+        self.heads = []
+        self._ids = {}
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @property
+    def head(self):
+        return self.heads[-1][0] if self.heads else None
+
+    def position(self, head):
+        """
+        :return: the number of commits when the index was at a HEAD, None if
+            it never was
+        """
+        for commit, count in reversed(self.heads):
+            if commit == head:
+                return count
+        return None
+
+    def add(self, commit, tree, timestamp, author, insertions=None,
+            deletions=None, parents=1):
+        """
+        Append a commit, given as hex object ids
+        """
+        if not self.hash_size:
+            self.hash_size = len(commit) // 2
+        if author not in self._ids:
+            self._ids[author] = len(self.names)
+            self.names.append(author)
+        self.commits += bytes.fromhex(commit)
+        self.trees += bytes.fromhex(tree)
+        self.timestamps.append(timestamp)
+        self.authors.append(self._ids[author])
+        self.insertions.append(-1 if insertions is None else insertions)
+        self.deletions.append(-1 if deletions is None else deletions)
+        self.parents.append(min(parents, 255))
+
+    def commit(self, i):
+        return self._hex(self.commits, i)
+
+    def tree(self, i):
+        return self._hex(self.trees, i)
+
+    def author(self, i):
+        return self.names[self.authors[i]]
+
+    def _hex(self, column, i):
+        i = i % len(self)
+        return column[i * self.hash_size:(i + 1) * self.hash_size].hex()
+
+    def rows(self, start=0):
+        """
+        The commits from a position on, newest first like iter_log()
+
+        :return: generator of (timestamp, tree, author, insertions,
+            deletions) tuples
+        """
+        for i in range(len(self) - 1, start - 1, -1):
+            insertions, deletions = self.insertions[i], self.deletions[i]
+            yield (self.timestamps[i], self.tree(i), self.author(i),
+                   None if insertions < 0 else insertions,
+                   None if deletions < 0 else deletions)
+
+    def update(self, workdir, repo):
+        """
+        Extend the index to the current HEAD of the repo, it is rebuilt if
+        its HEAD is not an ancestor anymore
+
+        :return: True if the index has changed
+        """
+        head = utils.git(workdir, repo, 'rev-parse', 'HEAD')
+        if head == self.head:
+            return False
+
+        rev_range = head
+        if self.head:
+            try:
+                utils.git(workdir, repo, 'merge-base', '--is-ancestor',
+                          self.head, head)
+                rev_range = f'{self.head}..{head}'
+            except Exception:
+                self.__init__()
+
+        for record in utils.stream_git(
+            workdir, repo,
+            'log', '--reverse', '--shortstat',
+            '--pretty=format:%x00%H %T %at %P%x09%aN', rev_range
+        ):
+            header, _, stat = record.strip().partition(b'\n')
+            ids, _, author = header.decode('utf-8', 'replace').partition(
+                '\t')
+            commit, tree, timestamp, *parents = ids.split(' ')
+            insertions, deletions = parse_shortstat(stat)
+            self.add(commit, tree, int(timestamp), author, insertions,
+                     deletions, len(parents))
+
+        self.heads.append([head, len(self)])
+        return True
+
+    def save(self, path):
+        """
+        Write the index atomically, a JSON header line followed by the
+        columns in machine byte order
+        """
+        header = {
+            'version': VERSION, 'byteorder': sys.byteorder,
+            'count': len(self), 'hash_size': self.hash_size,
+            'names': self.names, 'heads': self.heads,
+        }
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'wb') as fh:
+            fh.write(json.dumps(header).encode() + b'\n')
+            fh.write(self.commits)
+            fh.write(self.trees)
+            for column in self._columns():
+                column.tofile(fh)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: the index saved at the path, empty if missing or unreadable
+        """
+        index = cls()
+        try:
+            with open(path, 'rb') as fh:
+                header = json.loads(fh.readline())
+                if (header['version'] != VERSION or
+                        header['byteorder'] != sys.byteorder):
+                    return index
+                count, size = header['count'], header['hash_size']
+                index.hash_size = size
+                index.commits = bytearray(fh.read(count * size))
+                index.trees = bytearray(fh.read(count * size))
+                for column in index._columns():
+                    column.fromfile(fh, count)
+        except (OSError, ValueError, KeyError, EOFError):
+            return cls()
+
+        index.names = header['names']
+        index.heads = header['heads']
+        index._ids = {name: i for i, name in enumerate(index.names)}
+        return index
+
+    def _columns(self):
+        return (self.timestamps, self.authors, self.insertions,
+                self.deletions, self.parents)
+
+
+def parse_shortstat(stat):
+    """
+    :param stat: a `--shortstat` line, e.g. b' 2 files changed, 3
+        insertions(+), 1 deletion(-)'
+    :return: a tuple (insertions, deletions), either None if it is not in
+        the line
+    """
+    insertions = deletions = None
+    for part in stat.split(b','):
+        count, _, kind = part.strip().partition(b' ')
+        if kind.startswith(b'insert'):
+            insertions = int(count)
+        elif kind.startswith(b'delet'):
+            deletions = int(count)
+    return insertions, deletions
+
+
+def index_path(workdir, repo):
+    return utils.git_path(workdir, repo, FILENAME)
+
+
+def load_index(workdir, repo):
+    """
+    :return: the CommitIndex of a repo extended to its current HEAD, saved
+        if it has changed
+    """
+    path = index_path(workdir, repo)
+    index = CommitIndex.load(path)
+    if index.update(workdir, repo):
+        index.save(path)
+    return index
@@ -1,8 +1,27 @@
 import os
+import re
 from configparser import ConfigParser
 
 from .utils import PROJECT_DIR
 
+DEFAULT_INTERVAL = '1h'
+DEFAULT_NOTIFY_DELAY = '5s'
+DEFAULT_LISTEN_HOST = '127.0.0.1'
+INTERVAL_UNITS = {'': 1, 's': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def parse_interval(value):
+    """
+    :param value: a number of seconds, or of minutes, hours or days with an
+        `m`, `h` or `d` suffix, e.g. `90`, `15m` or `1d`
+    :return: the number of seconds
+    """
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([smhd]?)\s*',
+                         str(value).lower())
+    if not match:
+        raise ValueError(f'invalid interval "{value}"')
+    return float(match.group(1)) * INTERVAL_UNITS[match.group(2)]
+
 
 class Config:
     """
@@ -10,12 +29,15 @@ class Config:
     """
     _config = None
 
-    def __init__(self, *, config_path='', force=False, **kwargs):
+    def __init__(self, *, config_path='', force=False, profile=False,
+                 **kwargs):
         """
         :param config_path: if not given, defaults to project root config.ini
             file
+        :param profile: dump cProfile stats of every stage of a run
         """
         self.force = force
+        self.profile = profile
         self.config_path = config_path or os.path.join(PROJECT_DIR,
                                                        'config.ini')
 
@@ -31,6 +53,13 @@ class Config:
         self._config.read(self.config_path)
         return self._config
 
+    def reload(self):
+        """
+        Read the config file again on the next access, e.g. by a long
+        running service
+        """
+        self._config = None
+
     def __getattr__(self, name):
         """
         Convenient object dot accessor to config section
@@ -51,3 +80,34 @@ class Config:
             if 'clone' in repo:
                 repos[repo_id] = repo
         return repos
+
+    def refresh_interval(self, repo):
+        """
+        :param repo: the config of a repo, see repositories()
+        :return: the seconds between checks of a repo for changes, its
+            `interval` defaults to the GLOBAL `refresh_interval`
+        """
+        return parse_interval(repo.get('interval', self.config.get(
+            'GLOBAL', 'refresh_interval', fallback=DEFAULT_INTERVAL
+        )))
+
+    def listen_address(self):
+        """
+        :return: the (host, port) the daemon listens to for notifications of
+            pushes, from the GLOBAL `listen` as `host:port` or `port`, None
+            if not set
+        """
+        listen = self.config.get('GLOBAL', 'listen', fallback='').strip()
+        if not listen:
+            return None
+        host, _, port = listen.rpartition(':')
+        return host.strip('[]') or DEFAULT_LISTEN_HOST, int(port)
+
+    def notify_delay(self):
+        """
+        :return: the seconds a notified repo waits for more notifications
+            before it is updated, from the GLOBAL `notify_delay`
+        """
+        return parse_interval(self.config.get(
+            'GLOBAL', 'notify_delay', fallback=DEFAULT_NOTIFY_DELAY
+        ))
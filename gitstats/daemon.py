@@ -0,0 +1,151 @@
+"""
+Keep the statistics up to date as a long running service, instead of
+running the generator periodically from cron
+"""
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+from . import metrics, utils
+from .listener import Listener
+
+logger = logging.getLogger(__name__)
+
+REMOTES = 'remotes.json'
+
+
+class Daemon:
+    """
+    Check every repo for changes at its refresh interval and run the stages
+    of the changed repos only. A repo is checked by listing the refs of its
+    origin with `git ls-remote`, which is much cheaper than fetching it, and
+    is updated if they differ from the refs of its last run.
+
+    The worker pool and the caches stay warm between the cycles, the config
+    is read again every cycle.
+
+    A repo can be notified of a push as well, it is updated in the next cycle
+    after the notify delay regardless of its interval. The notifications of a
+    repo during the delay or its update are merged into one.
+    """
+    def __init__(self, stats):
+        """
+        :param stats: the GitStats instance
+        """
+        self.stats = stats
+        # the time every repo is checked next
+        self.due = {name: 0 for name in stats.config.repositories()}
+        # the time of the first pending notification of the notified repos
+        self.pending = {}
+        self.lock = threading.Lock()
+        self.remotes = self._load_remotes()
+        self.wakeup = threading.Event()
+        self.stopped = threading.Event()
+
+    @property
+    def remotes_path(self):
+        """
+        The hashes of the remote refs of the last run of every repo, so that
+        a restarted service does not update the unchanged repos again
+        """
+        return os.path.join(self.stats.cache_dir, REMOTES)
+
+    def _load_remotes(self):
+        try:
+            with open(self.remotes_path) as fh:
+                return json.load(fh)
+        except Exception:
+            return {}
+
+    def cycle(self, now=None):
+        """
+        Check the repos due at the time, run the changed ones
+
+        :return: the seconds until the next repo is due
+        """
+        started = time.time()
+        now = started if now is None else now
+        config = self.stats.config
+        config.reload()
+        repos = config.repositories()
+        delay = config.notify_delay()
+        with self.lock:
+            self.due = {name: self.due.get(name, 0) for name in repos}
+            notified = {name for name, at in self.pending.items()
+                        if at + delay <= now}
+            for name in notified:
+                del self.pending[name]
+            pending = [at + delay for at in self.pending.values()]
+
+        due = {name: conf for name, conf in repos.items()
+               if self.due[name] <= now or name in notified}
+        if due:
+            refs = self.stats.remote_refs(due)
+            for name, conf in due.items():
+                self.due[name] = now + config.refresh_interval(conf)
+            changed = {name for name in due
+                       if name in notified or refs.get(name) and
+                       refs[name] != self.remotes.get(name)}
+            logger.info(f'{len(changed)} of {len(due)} checked repos changed')
+            if changed:
+                self._run(changed, refs)
+
+        if not self.due and not pending:
+            return config.refresh_interval({})
+        # the time the cycle took counts
+        elapsed = time.time() - started
+        return max(0, min([*self.due.values(), *pending]) - now - elapsed)
+
+    def _run(self, names, refs):
+        """
+        Run the stages of the repos, the refs of the updated ones are kept
+        """
+        self.stats.metrics = metrics.Metrics(profile=self.stats.config.profile)
+        updated = self.stats.run(names)
+        self.remotes.update({name: refs[name] for name in updated
+                             if refs.get(name)})
+        utils.save_json(self.remotes, self.stats.cache_dir, REMOTES)
+
+    def serve(self):
+        """
+        Run the cycles until stopped, waiting for the next due repo in
+        between unless woken up
+        """
+        address = self.stats.config.listen_address()
+        listener = Listener(self, address) if address else nullcontext()
+        with listener, self.stats.warm():
+            while not self.stopped.is_set():
+                try:
+                    timeout = self.cycle()
+                except Exception:
+                    logger.exception('cycle failed')
+                    timeout = self.stats.config.refresh_interval({})
+                self.wakeup.wait(timeout)
+                self.wakeup.clear()
+
+    def notify(self, name, now=None):
+        """
+        Queue an update of a repo, e.g. pushed to
+
+        :return: False if the repo is unknown
+        """
+        with self.lock:
+            if name not in self.due:
+                return False
+            self.pending.setdefault(name, time.time() if now is None else now)
+        logger.info(f'{name} notified')
+        self.wake()
+        return True
+
+    def wake(self):
+        """
+        Start the next cycle now
+        """
+        self.wakeup.set()
+
+    def stop(self):
+        self.stopped.set()
+        self.wakeup.set()
@@ -1,15 +1,63 @@
 import json
 import logging
+import math
 import os
 from collections import defaultdict
+from contextlib import contextmanager, nullcontext
 from datetime import datetime
-from functools import partial
+from functools import partial, wraps
 from multiprocessing import Pool
 
-from . import utils, collectors
+from . import utils, collectors, metrics, ownership, scheduler, trees
 
 logger = logging.getLogger(__name__)
 
+STAGES = ('update', 'summary', 'lines', 'lines-history', 'activity',
+          'files-history', 'tags', 'branches', 'blame')
+# the stages whose outputs a stage needs, run along with a selected stage if
+# their outputs are missing, see GitStats.run()
+STAGE_DEPS = {
+    'summary': ('update',),
+    'lines': ('update',),
+    'lines-history': ('update',),
+    # activity corrects the number of authors in summary.json
+    'activity': ('update', 'summary'),
+    'files-history': ('update',),
+    'tags': ('update',),
+    'branches': ('update',),
+    'blame': ('update',),
+}
+# the series of all authors in authors/index.json of sharded activity
+SHARD_INDEX_PERIODS = ('yearly', 'monthly', 'weekly')
+# the tasks of stages other than blame are cheap, they run before any blame
+STAGE_PRIORITY = math.inf
+# files smaller than this many bytes are blamed in batches of the batch size
+BLAME_SMALL_FILE = 16 * 1024
+BLAME_BATCH_SIZE = 256 * 1024
+# how much more expensive a blame detecting moves and copies is estimated
+DETECT_MOVE_COST = 10
+
+
+def stage(name):
+    """
+    Decorate a GitStats method as a stage of the run measured in the metrics
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            self._stage = name
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def author_id(author):
+    """
+    The name of the activity shard of an author
+    """
+    return utils.content_hash(author.encode())
+
 
 class GitStats:
     """
@@ -20,226 +68,642 @@ class GitStats:
         :param config: config instance
         """
         self.config = config
-
-    def run(self):
+        self.metrics = metrics.Metrics(profile=config.profile)
+        self.compressor = None
+        self._manifest = None
+        self._stage = None
+        self._warm_pool = None
+        self._blame_cache = None
+
+    def run(self, names=None, stages=None):
         """
-        Main runner
+        Main runner. The stages of all repos are tasks of one worker pool, the
+        stages of a repo start as soon as it is updated and the stages they
+        depend on are done, so a slow repo does not hold back the others.
+
+        Selected stages run even if the HEAD of a repo has not changed, the
+        outputs of the other stages are left untouched. The stages they
+        depend on run as well if their outputs are missing, a repo is not
+        updated unless `update` is selected or it is not cloned yet.
+
+        :param names: the names of the repos to update, all if None
+        :param stages: the names of the stages to run, all if None
+        :return: dict of the updated repos to their state in repos.json
         """
-        self.update_repos()
-        self.repo_summary()
-        self.repo_lines()
-        revisions = self.repo_activity()
-        self.repo_files_history(revisions)
-        self.repo_tags()
-        self.repo_branches()
-        self.repo_blame()
-
-        self.save_last_update()
+        for name in STAGES:
+            self.metrics.add_stage(name)
 
-    def update_repos(self):
-        prev_states = self.load_data('repos.json') or []
-        repo_states = []
+        prev = {r['name']: r for r in self.load_data('repos.json') or []}
         repos = self.config.repositories()
-
-        with Pool(self.num_pools) as p:
-            for result in p.imap_unordered(
-                partial(collectors.update_repo, self.repos_dir),
-                [(k, v['clone']) for k, v in repos.items()]
-            ):
-                if result:
-                    result.update(repos[result['name']])
-                    logger.info(f'{result["name"]} updated')
-                    repo_states.append(result)
-
-        prev = {r['name']: r for r in prev_states}
-        curr = {r['name']: r for r in repo_states}
-        self.repos = []
-        for repo in curr:
-            if prev.get(repo, {}).get('HEAD') != curr[repo]['HEAD']:
-                self.repos.append(repo)
-
-        repo_states = {**prev}
-        repo_states.update(curr)
-
-        if self.config.force:
-            self.repos = list(repo_states)
-
-        self.save_data(list(repo_states.values()), 'repos.json')
-
-    def repo_summary(self):
-        with Pool(self.num_pools) as p:
-            for result in p.imap_unordered(
-                partial(collectors.summary, self.repos_dir),
-                self.repos
-            ):
-                self.save_data(result['data'], 'summary.json', result['repo'])
-                logger.info(f'{result["repo"]} summary updated')
-
-    def repo_activity(self):
-        revisions = {}
-        with Pool(self.num_pools) as p:
-            for result in p.imap_unordered(
-                partial(collectors.activity, self.repos_dir),
-                self.repos
-            ):
-                repo = result['repo']
-                revisions[repo] = result['revisions']
-                self.save_data(result['data'], 'activity.json', repo)
-                logger.info(f'{repo} activity updated')
-
-                # check number of authors
-                authors = len(result['data']['by_authors'])
-                summary = self.load_data('summary.json', repo)
-                need_update = False
-                for row in summary:
-                    if row['key'] == 'authors' and row['value'] != authors:
-                        row['value'] = authors
-                        need_update = True
-                if need_update:
-                    self.save_data(summary, 'summary.json', repo)
-                    logger.info(f'summary updated for {repo}')
-
-        return revisions
-
-    def repo_files_history(self, revisions):
-        fname = 'files-history.json'
-
-        for repo, revs in revisions.items():
-            cache = self.load_data(fname, repo)
-            revs_to_check = []
-            if cache:
-                data = cache
-                revs_to_check = [rev for rev in revs
-                                 if rev['revision'] not in cache]
-            else:
-                data = {}
-                revs_to_check = revs
-
-            with Pool(self.num_pools) as p:
-                for result in p.imap_unordered(
-                    partial(collectors.num_files, self.repos_dir, repo),
-                    revs_to_check
-                ):
-                    data.update(result)
-
-            self.save_data(data, fname, repo)
-            logger.info(f'{repo} files history updated')
-
-    def repo_lines(self):
-        with Pool(self.num_pools) as p:
-            for result in p.imap_unordered(
-                partial(collectors.count_lines, self.repos_dir),
-                self.repos
-            ):
-                self.save_data(result['data'], 'lines.json', result['repo'])
-                logger.info(f'{result["repo"]} lines updated')
-
-    def repo_tags(self):
-        repo_tags = {}
-        with Pool(self.num_pools) as p:
-            for result in p.imap_unordered(
-                partial(collectors.get_tags, self.repos_dir),
-                self.repos
-            ):
-                repo_tags[result['repo']] = result['tags']
-
-        for repo, tags in repo_tags.items():
-            with Pool(self.num_pools) as p:
-                for result in p.imap_unordered(
-                    partial(collectors.get_timestamp, self.repos_dir, repo),
-                    [t['revision'] for t in tags]
-                ):
-                    for t in tags:
-                        if t['revision'] == result['revision']:
-                            t['timestamp'] = result['timestamp']
-
-            tags = sorted(tags, key=lambda x: -x['timestamp'])
-            r = [t['revision'] for t in tags]
-
-            for i in range(len(tags)):
-                if i == len(tags) - 1:
-                    cmd = f'shortlog -s {r[i]}'
+        for name in set(names or ()) - set(repos):
+            logger.warning(f'unknown repo "{name}"')
+        repos = {name: conf for name, conf in repos.items()
+                 if names is None or name in names}
+        curr = {}
+        blame = self._blame_context()
+
+        with self.pool() as pool, utils.Compressor() as self.compressor:
+            self.scheduler = scheduler.Scheduler(pool, self.num_pools,
+                                                 self.metrics)
+            for name, conf in repos.items():
+                repo_stages = (None if stages is None else
+                               self._repo_stages(name, prev, stages))
+                if repo_stages is None or 'update' in repo_stages:
+                    self.scheduler.add(
+                        ('update', name),
+                        partial(collectors.update_repo, self.repos_dir),
+                        (self._repo_origin(name, conf),),
+                        priority=STAGE_PRIORITY, stage='update', repo=name,
+                        callback=partial(self._schedule_repo, repos, prev,
+                                         curr, blame, repo_stages)
+                    )
                 else:
-                    cmd = f'shortlog -s {r[i]} ^{r[i+1]}'
-                authors = []
-
-                for line in utils.run_git(
-                    self.repos_dir, repo, cmd
-                ).splitlines():
-                    commits, author = line.strip().split('\t', 1)
-                    authors.append({'author': author, 'commits': int(commits)})
-                    tags[i]['authors'] = authors
-
-            self.save_data(tags, 'tags.json', repo)
-            logger.info(f'{repo} tags updated')
-
-    def repo_branches(self):
-        repo_branches = {}
-        with Pool(self.num_pools) as p:
-            for result in p.imap_unordered(
+                    self.scheduler.add(
+                        ('update', name), priority=STAGE_PRIORITY,
+                        stage='update', repo=name,
+                        callback=partial(self._schedule_stages, name,
+                                         prev[name]['HEAD'], blame,
+                                         repo_stages)
+                    )
+            self.scheduler.add(
+                'repos', deps=[('update', name) for name in repos],
+                priority=STAGE_PRIORITY, stage='update',
+                callback=partial(self._save_repos, prev, curr)
+            )
+            try:
+                self.scheduler.run()
+                self.save_last_update()
+            finally:
+                self._blame_close(blame)
+                self.save_manifest()
+
+        self.metrics.cache('compress', hits=self.compressor.skipped,
+                           misses=self.compressor.written)
+        self.compressor = None
+        self.metrics.save(self.data_dir)
+        return curr
+
+    @contextmanager
+    def warm(self):
+        """
+        Keep the worker pool, with the git processes of its workers, and the
+        blame cache across the runs inside the context
+        """
+        with Pool(self.num_pools, initializer=utils.lower_priority) as pool:
+            self._warm_pool = pool
+            self._blame_cache = self._load_blame_cache()
+            try:
+                yield self
+            finally:
+                self._warm_pool = None
+                self._blame_cache = None
+
+    @stage('remotes')
+    def remote_refs(self, repos):
+        """
+        :param repos: dict of the repos to their config
+        :return: dict of the repos to a hash of the refs of their origin,
+            None if unknown
+        """
+        return {
+            result['name']: result['refs'] for result in self.imap(
+                partial(collectors.remote_refs, self.repos_dir),
+                [self._repo_origin(k, v) for k, v in repos.items()]
+            )
+        }
+
+    def _repo_stages(self, repo, prev, stages):
+        """
+        :return: the selected stages with the stages they depend on whose
+            outputs are missing for the repo
+        """
+        selected = set(stages)
+        todo = list(selected)
+        while todo:
+            for dep in STAGE_DEPS.get(todo.pop(), ()):
+                if dep not in selected and not self._has_output(dep, repo,
+                                                                prev):
+                    logger.info(f'{repo} {dep} is run for its output')
+                    selected.add(dep)
+                    todo.append(dep)
+        return selected
+
+    def _has_output(self, stage, repo, prev):
+        if stage == 'update':
+            return repo in prev and os.path.isdir(
+                os.path.join(self.repos_dir, repo))
+        return self.load_data(f'{stage}.json', repo) is not None
+
+    def _schedule_repo(self, repos, prev, curr, blame, stages, result):
+        """
+        Add the stages of an updated repo to the scheduler if its HEAD has
+        changed, the selected stages regardless
+
+        :param stages: the stages to run, all if None
+        """
+        repo = self._repo_updated(repos, curr, result)
+        if not repo or stages is None and not self._is_changed(prev,
+                                                               curr[repo]):
+            return
+        self._schedule_stages(repo, curr[repo]['HEAD'], blame,
+                              STAGES if stages is None else stages)
+
+    def _schedule_stages(self, repo, head, blame, stages):
+        """
+        Add the stages of a repo to the scheduler, only the given ones
+        """
+        add = partial(self.scheduler.add, priority=STAGE_PRIORITY, repo=repo)
+        if 'summary' in stages:
+            add(('summary', repo),
+                partial(collectors.summary, self.repos_dir), (repo,),
+                stage='summary', callback=self._summary_done)
+        if 'lines' in stages:
+            add(('lines', repo),
+                partial(collectors.count_lines, self.repos_dir), (repo,),
+                stage='lines', callback=self._lines_done)
+        if 'lines-history' in stages:
+            add(('lines-history', repo),
+                partial(collectors.lines_history, self.repos_dir),
+                (self._lines_history_state(repo),), stage='lines-history',
+                callback=self._lines_history_done)
+        if 'activity' in stages:
+            add(('activity', repo),
+                partial(collectors.activity_since, self.repos_dir),
+                (self._activity_state(repo),),
+                deps=[('summary', repo)] if 'summary' in stages else [],
+                stage='activity',
+                callback=(self._schedule_files_history
+                          if 'files-history' in stages
+                          else self._activity_done))
+        elif 'files-history' in stages:
+            self._add_files_history(repo, None)
+        if 'tags' in stages:
+            add(('tags', repo), partial(collectors.get_tags, self.repos_dir),
+                (repo,), stage='tags', callback=self._tags_done)
+        if 'branches' in stages:
+            add(('branches', repo),
                 partial(collectors.get_branches, self.repos_dir),
-                self.repos
-            ):
-                repo_branches[result['repo']] = result['branches']
-
-        for repo, branches in repo_branches.items():
-            branch_timestamps = []
-            with Pool(self.num_pools) as p:
-                for result in p.imap_unordered(
-                    partial(collectors.get_timestamp, self.repos_dir, repo),
-                    branches
-                ):
-                    branch_timestamps.append(result)
-
-            branches = sorted(branch_timestamps, key=lambda x: -x['timestamp'])
-            self.save_data(branches, 'branches.json', repo)
-            logger.info(f'{repo} branches updated')
-
-    def repo_blame(self):
-        detect_moves = self.config.config.get(
-            'GLOBAL', 'detect_move', fallback=''
-        ).strip().split()
-
-        for repo in self.repos:
-            cache = self.load_data('files-authors.json', repo) or {}
-            detect_move = repo in detect_moves
-
-            files_to_blame = {}
-            authors = {}
-            for line in utils.run_git(
-                self.repos_dir, repo,
-                'ls-tree -r HEAD'
-            ).splitlines():
-                *_, revision, fname = line.split()
-                if cache.get(fname, {}).get('revision') == revision:
-                    authors[fname] = cache[fname]
-                else:
-                    files_to_blame[fname] = revision
-
-            with Pool(self.num_pools) as p:
-                for result in p.imap_unordered(
-                    partial(collectors.get_blame, self.repos_dir, repo,
-                            detect_move),
-                    files_to_blame
-                ):
-                    authors[result['file']] = {
-                        'authors': result['authors'],
-                        'revision': files_to_blame[result['file']],
-                    }
-
-                    self.save_data(authors, 'files-authors.json', repo)
-
-            authors_counts = {
-                'lines': defaultdict(int),
-                'files': defaultdict(int),
+                (repo,), stage='branches', callback=self._branches_done)
+        if 'blame' in stages:
+            add(('blame', repo), stage='blame',
+                callback=partial(self._schedule_blame, blame, repo, head))
+
+    def _schedule_files_history(self, result):
+        self._add_files_history(result['repo'], self._activity_done(result))
+
+    def _add_files_history(self, repo, revisions):
+        state = self._files_history_state(repo, revisions)
+        if state:
+            self.scheduler.add(
+                ('files-history', repo),
+                partial(collectors.files_history, self.repos_dir), (state,),
+                priority=STAGE_PRIORITY, stage='files-history', repo=repo,
+                callback=partial(self._files_history_done, state[2])
+            )
+
+    def _schedule_blame(self, blame, repo, head):
+        """
+        Blame the files at HEAD of a repo. A file is looked up by name and
+        blob in the files-authors.json of its repo and then by blob in the
+        blame cache shared by all repos of the workdir, only files missing
+        from both are blamed. Blames of `detect_move` repos depend on the
+        history, hence are kept out of the shared cache. Failed or empty
+        blames are not shared either.
+
+        Files changed since the HEAD recorded in files-authors-state.json are
+        not blamed again if the diffs of the new commits can be applied to
+        the runs of authors of their lines, see ownership.update().
+
+        The files of all repos are blamed in the pool of the run, the most
+        expensive first by blob size so that a huge file does not run alone
+        at the end. Small files are blamed in batches.
+
+        Blamed files are appended to files-authors.journal, which is compacted
+        into files-authors.json once all files of the repo are blamed. An
+        interrupted run resumes from the journal.
+        """
+        for i, (cost, task) in enumerate(self._blame_repo(blame, repo, head)):
+            self.scheduler.add(
+                ('blame', repo, i),
+                partial(collectors.get_blames, self.repos_dir), (task,),
+                priority=cost, stage='blame', repo=repo,
+                callback=partial(self._blame_result, blame)
+            )
+
+    def _repo_origin(self, name, conf):
+        """
+        :return: a tuple (repo, origin, mirror) for collectors.update_repo(),
+            the `storage` of a repo defaults to the GLOBAL one
+        """
+        storage = conf.get('storage', self.config.config.get(
+            'GLOBAL', 'storage', fallback='worktree'
+        ))
+        return name, conf['clone'], storage.strip() == 'mirror'
+
+    def _repo_updated(self, repos, curr, result):
+        """
+        :return: the name of the repo if updated
+        """
+        if result:
+            result.update(repos[result['name']])
+            logger.info(f'{result["name"]} updated')
+            curr[result['name']] = result
+            return result['name']
+
+    def _is_changed(self, prev, state):
+        return (self.config.force or
+                prev.get(state['name'], {}).get('HEAD') != state['HEAD'])
+
+    def _save_repos(self, prev, curr):
+        self.save_data(list({**prev, **curr}.values()), 'repos.json')
+
+    def _summary_done(self, result):
+        self.save_data(result['data'], 'summary.json', result['repo'])
+        logger.info(f'{result["repo"]} summary updated')
+
+    def _activity_state(self, repo):
+        """
+        :return: a tuple (repo, previous HEAD), the HEAD is None if the whole
+            history is to be walked
+        """
+        state = self.load_data('activity-state.json', repo) or {}
+        since = state.get('HEAD')
+        if self.config.force or not os.path.isfile(
+            os.path.join(self.data_dir, repo, 'activity.json')
+        ):
+            since = None
+        return repo, since
+
+    def _activity_done(self, result):
+        """
+        Update activity.json of a repo from the commits made since the HEAD
+        recorded in activity-state.json, the saved activity data holds the
+        raw counters the new commits are merged into
+
+        :return: the revisions of the repo
+        """
+        repo = result['repo']
+        data = result['data']
+        shards = self.config.config.getboolean('GLOBAL', 'activity_shards',
+                                               fallback=False)
+        if result['since']:
+            data = collectors.merge_activity(
+                self._load_activity(
+                    repo, data['by_authors'] if shards else None
+                ), data
+            )
+        if shards:
+            self._save_activity_shards(repo, data, not result['since'])
+        else:
+            self.save_data(data, 'activity.json', repo)
+        self.save_data({'HEAD': result['HEAD']},
+                       'activity-state.json', repo)
+        logger.info(f'{repo} activity updated')
+
+        # check number of authors
+        authors = len(data['authors_age' if shards else 'by_authors'])
+        summary = self.load_data('summary.json', repo)
+        need_update = False
+        for row in summary:
+            if row['key'] == 'authors' and row['value'] != authors:
+                row['value'] = authors
+                need_update = True
+        if need_update:
+            self.save_data(summary, 'summary.json', repo)
+            logger.info(f'summary updated for {repo}')
+
+        return result['revisions']
+
+    def _load_activity(self, repo, authors=None):
+        """
+        Load activity.json of a repo, with the series of the authors read
+        from their shards if it is sharded
+
+        :param authors: the authors to read the shards of, all if None
+        """
+        data = self.load_data('activity.json', repo)
+        if 'by_authors' not in data:
+            ids = data.pop('authors')
+            data['by_authors'] = {
+                author: self.load_data(f'{ids[author]}.json',
+                                       f'{repo}/authors') or {}
+                for author in (ids if authors is None else authors)
+                if author in ids
             }
-            for values in authors.values():
-                for author, lines in values['authors'].items():
-                    authors_counts['lines'][author] += lines
-                    authors_counts['files'][author] += 1
+        return data
 
-            self.save_data(authors_counts, 'authors.json', repo)
-            logger.info(f'{repo} authors lines updated')
+    def _save_activity_shards(self, repo, data, full):
+        """
+        Save the series of every author of the activity data in its own
+        shard authors/<id>.json, so that the viewer loads the series of an
+        author only when shown. activity.json keeps the rest and the ids of
+        the authors. authors/index.json holds the yearly, monthly and weekly
+        series of all authors.
+
+        :param data: the activity data, `by_authors` may hold only the
+            authors changed since the saved data
+        :param full: `by_authors` holds all the authors
+        """
+        folders = f'{repo}/authors'
+        index = {} if full else self.load_data('index.json', folders) or {}
+        for author, series in data['by_authors'].items():
+            self.save_data(series, f'{author_id(author)}.json', folders)
+            index[author] = {
+                period: series[period] for period in SHARD_INDEX_PERIODS
+                if period in series
+            }
+        self.save_data(index, 'index.json', folders)
+
+        self.save_data({
+            **{k: v for k, v in data.items() if k != 'by_authors'},
+            'authors': {author: author_id(author)
+                        for author in data['authors_age']},
+        }, 'activity.json', repo)
+
+    def _files_history_state(self, repo, revisions):
+        """
+        :param revisions: the revisions of the new commits, None if unknown
+            and the history is walked from the previous HEAD
+        :return: a tuple (repo, previous HEAD, cached history) for
+            collectors.files_history(), None if the history is up to date.
+            The history is walked all over again if forced.
+        """
+        cache = {}
+        if not self.config.force:
+            cache = self.load_data('files-history.json', repo) or {}
+        if revisions is not None:
+            hits = sum(rev['revision'] in cache for rev in revisions)
+            self.metrics.cache('files-history', hits=hits,
+                               misses=len(revisions) - hits)
+            if cache and hits == len(revisions):
+                logger.info(f'{repo} files history is up to date')
+                return None
+
+        state = self.load_data('files-history-state.json', repo) or {}
+        return repo, state.get('HEAD') if cache else None, cache
+
+    def _files_history_done(self, cache, result):
+        repo = result['repo']
+        self.save_data({**cache, **result['data']}, 'files-history.json',
+                       repo)
+        self.save_data({'HEAD': result['HEAD']},
+                       'files-history-state.json', repo)
+        logger.info(f'{repo} files history updated')
+
+    def _lines_done(self, result):
+        self.metrics.cache('lines', **result['cache'])
+        self.save_data(result['data'], 'lines.json', result['repo'])
+        logger.info(f'{result["repo"]} lines updated')
+
+    def _lines_history_state(self, repo):
+        """
+        :return: a tuple (repo, known) for collectors.lines_history(), the
+            counts of the saved history are reused unless forced
+        """
+        known = None
+        if not self.config.force:
+            known = self.load_data('lines-history.json', repo)
+        return repo, known
+
+    def _lines_history_done(self, result):
+        self.metrics.cache('lines-history', **result['cache'])
+        self.save_data(result['data'], 'lines-history.json', result['repo'])
+        logger.info(f'{result["repo"]} lines history updated')
+
+    def _tags_done(self, result):
+        self.save_data(result['tags'], 'tags.json', result['repo'])
+        logger.info(f'{result["repo"]} tags updated')
+
+    def _branches_done(self, result):
+        self.save_data(result['branches'], 'branches.json', result['repo'])
+        logger.info(f'{result["repo"]} branches updated')
+
+    def _blame_context(self):
+        """
+        The state of the blames of a run shared by all repos
+        """
+        return {
+            'detect_moves': self.config.config.get(
+                'GLOBAL', 'detect_move', fallback=''
+            ).strip().split(),
+            'cache': (self._load_blame_cache() if self._blame_cache is None
+                      else self._blame_cache),
+            # a blob is blamed once, other repos having it wait for its result
+            'scheduled': set(),
+            'waiting': defaultdict(list),
+            'repos': {},
+        }
+
+    def _load_blame_cache(self):
+        return utils.LRUCache(
+            os.path.join(self.cache_dir, 'blame.json'),
+            self.config.config.getint('GLOBAL', 'blame_cache_size',
+                                      fallback=100000)
+        )
+
+    def _blame_repo(self, context, repo, head):
+        """
+        Prepare the blame of a repo, saved right away if nothing is to be
+        blamed
+
+        :return: list of (estimated cost, task) for collectors.get_blames()
+        """
+        detect_move = repo in context['detect_moves']
+        blame = self._prepare_blame(repo, detect_move, head, context['cache'],
+                                    context['scheduled'])
+        for fname, revision in blame['waiting'].items():
+            context['waiting'][revision].append((repo, fname))
+
+        tasks = list(self._blame_tasks(repo, detect_move, blame['files']))
+        blame['pending'] = len(tasks) + len(blame['waiting'])
+        context['repos'][repo] = blame
+        if not blame['pending']:
+            self._save_blame(repo, blame)
+        return tasks
+
+    def _blame_result(self, context, result):
+        """
+        Add a result of collectors.get_blames() to the blame of its repo and
+        of the repos waiting for the same blobs
+        """
+        blames = context['repos']
+
+        def add(repo, fname, entry):
+            blames[repo]['authors'][fname] = entry
+            blames[repo]['journal'].append([fname, entry])
+
+        def done(repo):
+            blames[repo]['pending'] -= 1
+            if not blames[repo]['pending']:
+                self._save_blame(repo, blames[repo])
+
+        repo = result['repo']
+        detect_move = blames[repo]['detect_move']
+        for item in result['results']:
+            revision = blames[repo]['files'][item['file']][0]
+            entry = {'authors': item['authors'], 'revision': revision}
+            if 'runs' in item:
+                entry['runs'] = item['runs']
+            add(repo, item['file'], entry)
+            if detect_move:
+                continue
+
+            if not (item.get('failed') or not item['authors']):
+                context['cache'].set(revision, item['authors'])
+            context['scheduled'].discard(revision)
+            for other, fname in context['waiting'].pop(revision, []):
+                add(other, fname, {'authors': item['authors'],
+                                   'revision': revision})
+                done(other)
+        done(repo)
+
+    def _blame_close(self, context):
+        for blame in context['repos'].values():
+            blame['journal'].close()
+        context['cache'].save()
+
+    def _prepare_blame(self, repo, detect_move, head, blame_cache,
+                       scheduled):
+        """
+        Resolve the authors of the files at HEAD of a repo from the caches
+
+        :param scheduled: set of the blobs already to be blamed in this run,
+            updated with the blobs of this repo
+        :return: dict of the resolved `authors`, the `files` to blame as file
+            name to (blob, size), the files `waiting` for a scheduled blob as
+            file name to blob, the `journal` and the `head`. Every file is
+            blamed again if forced, only the blobs blamed in this run are
+            shared.
+        """
+        force = self.config.force
+        cache = {}
+        if not force:
+            cache = self.load_data('files-authors.json', repo) or {}
+        tracked = {}
+        since = (self.load_data('files-authors-state.json', repo)
+                 or {}).get('HEAD')
+        if cache and head and since and since != head and not detect_move:
+            changed = ownership.update(
+                self.repos_dir, repo, since, head,
+                {k: v.get('runs') for k, v in cache.items()}
+            )
+            for fname, runs in (changed or {}).items():
+                cache.pop(fname, None)
+                if runs is not None:
+                    tracked[fname] = runs
+
+        # the journal of an interrupted run is blamed at HEAD already, the
+        # changes since the saved state are not to be applied to it
+        journal = utils.Journal(os.path.join(
+            self.data_dir, repo, 'files-authors.journal'))
+        if force:
+            journal.clear()
+        for fname, entry in journal:
+            cache[fname] = entry
+            tracked.pop(fname, None)
+
+        files_to_blame = {}
+        waiting = {}
+        authors = {}
+        blob_hits = 0
+        tracked_hits = 0
+        files = trees.load_index(self.repos_dir, repo).files
+        for fname, (_, revision, size, _) in files.items():
+            if cache.get(fname, {}).get('revision') == revision:
+                authors[fname] = cache[fname]
+            elif fname in tracked and self._fits(repo, revision,
+                                                 tracked[fname]):
+                authors[fname] = {
+                    'authors': ownership.count_authors(tracked[fname]),
+                    'revision': revision,
+                    'runs': tracked[fname],
+                }
+                tracked_hits += 1
+            elif not (detect_move or force) and revision in blame_cache:
+                authors[fname] = {
+                    'authors': blame_cache.get(revision),
+                    'revision': revision,
+                }
+                blob_hits += 1
+            elif not detect_move and revision in scheduled:
+                waiting[fname] = revision
+                blob_hits += 1
+            else:
+                files_to_blame[fname] = (revision, size)
+                if not detect_move:
+                    scheduled.add(revision)
+
+        self.metrics.cache('blame', hits=len(authors) + len(waiting),
+                           misses=len(files_to_blame))
+        self.metrics.cache('blame-blob', hits=blob_hits,
+                           misses=len(files_to_blame))
+        self.metrics.cache('blame-tracked', hits=tracked_hits,
+                           misses=len(tracked) - tracked_hits)
+
+        return {
+            'authors': authors,
+            'files': files_to_blame,
+            'waiting': waiting,
+            'journal': journal,
+            'head': head,
+            'detect_move': detect_move,
+        }
+
+    def _blame_tasks(self, repo, detect_move, files):
+        """
+        Split the files to blame of a repo into tasks of the pool, a file per
+        task, but small files are batched up to BLAME_BATCH_SIZE bytes
+
+        :param files: dict of file name to (blob, size)
+        :return: generator of (estimated cost, (repo, detect_move, files))
+        """
+        factor = DETECT_MOVE_COST if detect_move else 1
+        batch, batch_size = [], 0
+        for fname, (_, size) in files.items():
+            if size >= BLAME_SMALL_FILE:
+                yield size * factor, (repo, detect_move, [fname])
+                continue
+            batch.append(fname)
+            batch_size += size
+            if batch_size >= BLAME_BATCH_SIZE:
+                yield batch_size * factor, (repo, detect_move, batch)
+                batch, batch_size = [], 0
+        if batch:
+            yield batch_size * factor, (repo, detect_move, batch)
+
+    def _save_blame(self, repo, blame):
+        """
+        Compact the blame results of a repo into files-authors.json and
+        update its authors.json
+        """
+        authors = blame['authors']
+        self.save_data(authors, 'files-authors.json', repo)
+        if blame['head']:
+            self.save_data({'HEAD': blame['head']},
+                           'files-authors-state.json', repo)
+        blame['journal'].clear()
+
+        authors_counts = {
+            'lines': defaultdict(int),
+            'files': defaultdict(int),
+        }
+        for values in authors.values():
+            for author, lines in values['authors'].items():
+                authors_counts['lines'][author] += lines
+                authors_counts['files'][author] += 1
+
+        self.save_data(authors_counts, 'authors.json', repo)
+        logger.info(f'{repo} authors lines updated')
+
+    def _fits(self, repo, revision, runs):
+        """
+        Whether the tracked runs of a file cover the lines of its blob
+        """
+        try:
+            content = utils.cat_file(self.repos_dir, repo).read(revision)[2]
+        except KeyError:
+            return False
+        return utils.count_lines(content) == sum(c for c, _ in runs)
 
     def _prepare_workdir(self):
         workdir = self.config.GLOBAL['workdir']
@@ -247,6 +711,7 @@ class GitStats:
 
         self._repos_dir = os.path.join(workdir, 'repos')
         self._data_dir = os.path.join(workdir, 'data')
+        self._cache_dir = os.path.join(workdir, 'cache')
 
         os.makedirs(self._repos_dir, exist_ok=True)
         os.makedirs(self._data_dir, exist_ok=True)
@@ -263,6 +728,12 @@ class GitStats:
             self._prepare_workdir()
         return self._data_dir
 
+    @property
+    def cache_dir(self):
+        if not hasattr(self, '_cache_dir'):
+            self._prepare_workdir()
+        return self._cache_dir
+
     @property
     def num_pools(self):
         if not hasattr(self, '_num_pools'):
@@ -272,8 +743,59 @@ class GitStats:
 
         return self._num_pools
 
+    def pool(self):
+        """
+        A worker pool of `num_pools` processes running at a low priority, the
+        warm one if inside warm()
+        """
+        if self._warm_pool is not None:
+            return nullcontext(self._warm_pool)
+        return Pool(self.num_pools, initializer=utils.lower_priority)
+
+    def imap(self, func, iterable, repo=None):
+        """
+        Map a collector over the iterable in a worker pool, measuring every
+        call into the metrics of the current stage
+
+        :param func: the collector, pickleable
+        :param repo: the repo of all the calls, otherwise taken from the
+            `repo` or `name` of each result
+        :return: generator of the results in completion order
+        """
+        with self.pool() as p:
+            for result, sample in p.imap_unordered(
+                partial(metrics.measure, func, self.metrics.profile),
+                iterable
+            ):
+                self.metrics.task(
+                    self._stage,
+                    repo or result.get('repo') or result.get('name'),
+                    sample, self.num_pools
+                )
+                yield result
+
+    @property
+    def manifest(self):
+        """
+        The content hashes of the data files by their path in the data
+        folder, see utils.save_json()
+        """
+        if self._manifest is None:
+            self._manifest = self.load_data(utils.MANIFEST) or {}
+        return self._manifest
+
     def save_data(self, data, fname, folders=''):
-        utils.save_json(data, self.data_dir, fname, folders)
+        path = utils.save_json(data, self.data_dir, fname, folders,
+                               self.manifest)
+        if path and self.compressor:
+            self.compressor.add(path)
+
+    def save_manifest(self):
+        """
+        Save manifest.json once the data files it lists are written, for the
+        viewer to request the files by their content hash
+        """
+        utils.save_json(self.manifest, self.data_dir, utils.MANIFEST)
 
     def load_data(self, fname, folders=''):
         try:
@@ -0,0 +1,83 @@
+"""
+A small HTTP endpoint of the daemon to be notified of the pushes to a repo,
+e.g. by its post-receive hook, so that it is updated right away instead of at
+its refresh interval
+"""
+import json
+import logging
+import socket
+import threading
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlsplit
+
+logger = logging.getLogger(__name__)
+
+PREFIX = '/refresh/'
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    `POST /refresh/<repo>` queues a refresh of the repo
+    """
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        name = unquote(path[len(PREFIX):]) if path.startswith(PREFIX) else ''
+        if not name:
+            self._reply(HTTPStatus.NOT_FOUND, {'error': 'not found'})
+        elif not self.server.daemon.notify(name):
+            self._reply(HTTPStatus.NOT_FOUND,
+                        {'error': f'unknown repo "{name}"'})
+        else:
+            self._reply(HTTPStatus.ACCEPTED, {'repo': name})
+
+    def _reply(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        logger.debug(f'{self.address_string()} {format % args}')
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, daemon):
+        if ':' in address[0]:
+            self.address_family = socket.AF_INET6
+        self.daemon = daemon
+        super().__init__(address, Handler)
+
+
+class Listener:
+    """
+    Serve the notifications in a thread while in its context
+    """
+    def __init__(self, daemon, address):
+        """
+        :param daemon: the Daemon notified of the pushes
+        :param address: the (host, port) to listen to, port 0 for any
+        """
+        self.server = Server(address, daemon)
+        self.thread = None
+
+    @property
+    def address(self):
+        return self.server.server_address[:2]
+
+    def __enter__(self):
+        self.thread = threading.Thread(target=self.server.serve_forever,
+                                       name='gitstats-listener', daemon=True)
+        self.thread.start()
+        host, port = self.address
+        logger.info(f'listening to notifications at {host}:{port}')
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
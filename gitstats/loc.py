@@ -0,0 +1,387 @@
+"""
+Count the blank, comment and code lines of the files of a tree by language,
+like cloc does, from the blob contents read through git. The counts of every
+blob are kept by its SHA, so that only the blobs changed since the last
+count are read and counted again.
+"""
+import json
+import os
+import re
+import time
+
+from . import utils
+
+CACHE_FILENAME = 'gitstats-lines'
+# the counts of the blobs of the trees of the lines history
+HISTORY_CACHE_FILENAME = 'gitstats-lines-history'
+
+C = (('//',), (('/*', '*/'),))
+HASH = (('#',), ())
+XML = ((), (('<!--', '-->'),))
+
+# language: (extensions, line comment markers, block comment markers)
+LANGUAGES = {
+    'Python': (('py', 'pyw', 'pyi'), ('#',),
+               (('"""', '"""'), ("'''", "'''"))),
+    'Cython': (('pyx', 'pxd'), ('#',), (('"""', '"""'),)),
+    'JavaScript': (('js', 'mjs', 'cjs', 'jsx'), *C),
+    'TypeScript': (('ts', 'tsx', 'mts', 'cts'), *C),
+    'JSON': (('json',), (), ()),
+    'HTML': (('html', 'htm', 'xhtml'), *XML),
+    'XML': (('xml', 'xsd', 'xsl', 'xslt', 'svg', 'plist'), *XML),
+    'Markdown': (('md', 'markdown'), *XML),
+    'CSS': (('css',), (), (('/*', '*/'),)),
+    'SCSS': (('scss',), *C),
+    'Sass': (('sass',), *C),
+    'LESS': (('less',), *C),
+    'Vuejs Component': (('vue',), ('//',), (('/*', '*/'), ('<!--', '-->'))),
+    'C': (('c',), *C),
+    'C/C++ Header': (('h', 'hh', 'hpp', 'hxx'), *C),
+    'C++': (('cpp', 'cc', 'cxx', 'c++'), *C),
+    'C#': (('cs',), *C),
+    'Objective-C': (('m',), *C),
+    'Java': (('java',), *C),
+    'Kotlin': (('kt', 'kts'), *C),
+    'Scala': (('scala', 'sc'), *C),
+    'Groovy': (('groovy', 'gradle'), *C),
+    'Go': (('go',), *C),
+    'Rust': (('rs',), *C),
+    'Swift': (('swift',), *C),
+    'Dart': (('dart',), *C),
+    'PHP': (('php',), ('//', '#'), (('/*', '*/'),)),
+    'Ruby': (('rb', 'rake', 'gemspec'), ('#',), (('=begin', '=end'),)),
+    'Perl': (('pl', 'pm'), ('#',), (('=pod', '=cut'),)),
+    'Lua': (('lua',), ('--',), (('--[[', ']]'),)),
+    'R': (('r',), *HASH),
+    'Julia': (('jl',), ('#',), (('#=', '=#'),)),
+    'Haskell': (('hs',), ('--',), (('{-', '-}'),)),
+    'Elixir': (('ex', 'exs'), *HASH),
+    'Erlang': (('erl', 'hrl'), ('%',), ()),
+    'Clojure': (('clj', 'cljs', 'cljc', 'edn'), (';',), ()),
+    'Lisp': (('lisp', 'lsp', 'el'), (';',), (('#|', '|#'),)),
+    'OCaml': (('ml', 'mli'), (), (('(*', '*)'),)),
+    'F#': (('fs', 'fsi', 'fsx'), ('//',), (('(*', '*)'),)),
+    'SQL': (('sql',), ('--',), (('/*', '*/'),)),
+    'Bourne Shell': (('sh',), *HASH),
+    'Bourne Again Shell': (('bash',), *HASH),
+    'zsh': (('zsh',), *HASH),
+    'PowerShell': (('ps1', 'psm1'), ('#',), (('<#', '#>'),)),
+    'DOS Batch': (('bat', 'cmd'), ('REM', 'rem', '::'), ()),
+    'YAML': (('yaml', 'yml'), *HASH),
+    'TOML': (('toml',), *HASH),
+    'INI': (('ini', 'cfg'), ('#', ';'), ()),
+    'make': (('mk', 'mak'), *HASH),
+    'CMake': (('cmake',), *HASH),
+    'Dockerfile': ((), *HASH),
+    'reStructuredText': (('rst',), (), ()),
+    'TeX': (('tex', 'sty'), ('%',), ()),
+    'Protocol Buffers': (('proto',), *C),
+    'GraphQL': (('graphql', 'gql'), *HASH),
+    'Terraform': (('tf',), ('#', '//'), (('/*', '*/'),)),
+}
+
+EXTENSIONS = {
+    extension: language
+    for language, (extensions, _, _) in LANGUAGES.items()
+    for extension in extensions
+}
+FILENAMES = {
+    'makefile': 'make', 'gnumakefile': 'make',
+    'dockerfile': 'Dockerfile', 'cmakelists.txt': 'CMake',
+    'rakefile': 'Ruby', 'gemfile': 'Ruby',
+}
+INTERPRETERS = {
+    'python': 'Python', 'node': 'JavaScript', 'nodejs': 'JavaScript',
+    'sh': 'Bourne Shell', 'dash': 'Bourne Shell',
+    'bash': 'Bourne Again Shell', 'zsh': 'zsh', 'ruby': 'Ruby',
+    'perl': 'Perl', 'php': 'PHP', 'lua': 'Lua', 'Rscript': 'R',
+}
+
+
+def language_of(path):
+    """
+    :return: the language of a file by its name or extension, None if
+        unknown
+    """
+    name = path.rpartition('/')[2].lower()
+    if name in FILENAMES:
+        return FILENAMES[name]
+    if name.startswith('dockerfile.'):
+        return 'Dockerfile'
+    stem, dot, extension = name.rpartition('.')
+    return EXTENSIONS.get(extension) if dot and stem else None
+
+
+def language_of_shebang(content):
+    """
+    :return: the language of a script by the interpreter of its `#!` line,
+        None if unknown
+    """
+    if not content.startswith(b'#!'):
+        return None
+    line = content[2:].partition(b'\n')[0]
+    words = line.decode('utf-8', 'replace').split()
+    if words and words[0].endswith('/env'):
+        words = [word for word in words[1:] if not word.startswith('-')]
+    if not words:
+        return None
+    interpreter = re.sub(r'[\d.]+$', '', words[0].rpartition('/')[2])
+    return INTERPRETERS.get(interpreter)
+
+
+def count(content, language):
+    """
+    Count the lines of a file, a line is a comment line if it has only
+    comments and blanks, and a code line if it has anything else
+
+    :param content: the file content as bytes
+    :return: list of the blank, comment and code lines
+    """
+    _, markers, blocks = LANGUAGES[language]
+    starts = [(marker, None) for marker in markers] + list(blocks)
+    blank = comment = code = 0
+    end = None  # the end marker of the open block comment
+    for line in content.decode('utf-8', 'replace').splitlines():
+        line = line.strip()
+        if not line:
+            blank += 1
+            continue
+
+        has_code = False
+        pos = 0
+        while pos < len(line):
+            if end:
+                found = line.find(end, pos)
+                if found < 0:
+                    break
+                pos, end = found + len(end), None
+                continue
+
+            nearest = None
+            for start, stop in starts:
+                found = line.find(start, pos)
+                if found >= 0 and (nearest is None or found < nearest[0]):
+                    nearest = found, start, stop
+            if nearest is None:
+                has_code = has_code or bool(line[pos:].strip())
+                break
+
+            found, start, end = nearest
+            has_code = has_code or bool(line[pos:found].strip())
+            if end is None:
+                break
+            pos = found + len(start)
+
+        if has_code:
+            code += 1
+        else:
+            comment += 1
+    return [blank, comment, code]
+
+
+def count_blob(path, content):
+    """
+    :return: list of the language, blank, comment and code lines of a file,
+        the language is None if it is binary or in an unknown language
+    """
+    language = language_of(path)
+    if language is None:
+        language = language_of_shebang(content)
+    if language is None or utils.is_binary(content):
+        return [None, 0, 0, 0]
+    return [language, *count(content, language)]
+
+
+def ls_tree(workdir, repo, rev='HEAD'):
+    """
+    :return: list of (path, blob sha) tuples of the regular files of a tree
+    """
+    files = []
+    for record in utils.stream_git(workdir, repo, 'ls-tree', '-r', '-z',
+                                   '--full-tree', rev):
+        info, _, path = record.decode('utf-8', 'surrogateescape'
+                                      ).partition('\t')
+        mode, kind, sha = info.split()
+        if kind == 'blob' and mode != '120000':
+            files.append((path, sha))
+    return files
+
+
+def count_files(workdir, repo, files, cache):
+    """
+    Count the lines of files, reading only the blobs missing from the cache
+
+    :param files: list of (path, blob sha) tuples
+    :param cache: dict of the blob sha to the result of count_blob(),
+        updated. A blob counted for another language is counted again.
+    :return: a tuple of the list of the result of count_blob() of every
+        file and the number of blobs read
+    """
+    counts = {}
+    missing = {}
+    for path, sha in files:
+        cached = cache.get(sha)
+        language = language_of(path)
+        if cached is None or (language and cached[0] != language):
+            missing.setdefault(sha, path)
+        else:
+            counts[sha] = cached
+
+    for sha, content in utils.read_blobs(workdir, repo, missing):
+        if content is not None:
+            counts[sha] = cache[sha] = count_blob(missing[sha], content)
+
+    return ([counts.get(sha, [None, 0, 0, 0]) for _, sha in files],
+            len(missing))
+
+
+def summarize(counts, elapsed=0):
+    """
+    :param counts: list of the result of count_blob() of every file
+    :return: the lines by language in the format of `cloc --json`, with a
+        `header` and the total in `SUM`
+    """
+    languages = {}
+    total = {'blank': 0, 'comment': 0, 'code': 0, 'nFiles': 0}
+    for language, blank, comment, code in counts:
+        if language is None:
+            continue
+        lines = languages.setdefault(language, {
+            'nFiles': 0, 'blank': 0, 'comment': 0, 'code': 0,
+        })
+        for entry in (lines, total):
+            entry['nFiles'] += 1
+            entry['blank'] += blank
+            entry['comment'] += comment
+            entry['code'] += code
+
+    n_lines = total['blank'] + total['comment'] + total['code']
+    return {
+        'header': {
+            'n_files': total['nFiles'],
+            'n_lines': n_lines,
+            'elapsed_seconds': round(elapsed, 3),
+        },
+        **dict(sorted(languages.items(), key=lambda item: -item[1]['code'])),
+        'SUM': total,
+    }
+
+
+def count_trees(workdir, repo, trees, cache, memo=None, blobs=None):
+    """
+    Count the lines of the files of trees by language, a subtree shared by
+    the trees is counted once and a blob is read only if missing from the
+    cache
+
+    :param trees: the tree or commit objects
+    :param cache: dict of the blob sha to the result of count_blob(),
+        updated
+    :param memo: dict of the tree sha to its counts, updated
+    :param blobs: optional set, updated with the blobs of the walked trees
+    :return: a tuple of the list of the counts of every tree, a dict of the
+        language to a list of the files, blank, comment and code lines, and
+        the number of blobs read
+    """
+    cat = utils.cat_file(workdir, repo)
+    memo = {} if memo is None else memo
+    blobs = set() if blobs is None else blobs
+    entries = {}
+    missing = {}
+
+    def walk(tree):
+        if tree in memo or tree in entries:
+            return
+        entries[tree] = cat.tree(tree)
+        for mode, name, sha in entries[tree]:
+            if mode == '40000':
+                walk(sha)
+            elif mode not in ('120000', '160000'):
+                blobs.add(sha)
+                cached = cache.get(sha)
+                language = language_of(name)
+                if cached is None or (language and cached[0] != language):
+                    missing.setdefault(sha, name)
+
+    trees = [cat.info(f'{tree}^{{tree}}')[0] for tree in trees]
+    for tree in trees:
+        walk(tree)
+
+    for sha, content in utils.read_blobs(workdir, repo, missing):
+        cache[sha] = [None, 0, 0, 0] if content is None else count_blob(
+            missing[sha], content)
+
+    def total(tree):
+        if tree not in memo:
+            counts = {}
+            for mode, name, sha in entries[tree]:
+                if mode == '40000':
+                    for language, lines in total(sha).items():
+                        current = counts.setdefault(language, [0, 0, 0, 0])
+                        for i, value in enumerate(lines):
+                            current[i] += value
+                elif mode not in ('120000', '160000'):
+                    language, *lines = cache[sha]
+                    if language is not None:
+                        current = counts.setdefault(language, [0, 0, 0, 0])
+                        current[0] += 1
+                        for i, value in enumerate(lines, 1):
+                            current[i] += value
+            memo[tree] = counts
+        return memo[tree]
+
+    return [total(tree) for tree in trees], len(missing)
+
+
+def tree_lines(counts):
+    """
+    :param counts: the counts of a tree, see count_trees()
+    :return: the lines by language in the format of summarize(), without the
+        header
+    """
+    total = {'nFiles': 0, 'blank': 0, 'comment': 0, 'code': 0}
+    lines = {}
+    for language, values in sorted(counts.items(),
+                                   key=lambda item: -item[1][3]):
+        lines[language] = dict(zip(total, values))
+        for key, value in lines[language].items():
+            total[key] += value
+    return {**lines, 'SUM': total}
+
+
+def cache_path(workdir, repo):
+    return utils.git_path(workdir, repo, CACHE_FILENAME)
+
+
+def history_cache_path(workdir, repo):
+    return utils.git_path(workdir, repo, HISTORY_CACHE_FILENAME)
+
+
+def load_cache(path):
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except Exception:
+        return {}
+
+
+def count_revision(workdir, repo, rev='HEAD'):
+    """
+    Count the lines of the files of a revision by language, keeping the
+    counts of its blobs in the cache of the repo
+
+    :return: a tuple of the lines, see summarize(), and the numbers of cache
+        hits and misses
+    """
+    start = time.monotonic()
+    path = cache_path(workdir, repo)
+    cache = load_cache(path)
+    files = ls_tree(workdir, repo, rev)
+    counts, misses = count_files(workdir, repo, files, cache)
+
+    # only the blobs of the counted tree are kept
+    blobs = {sha for _, sha in files}
+    kept = {sha: value for sha, value in cache.items() if sha in blobs}
+    if misses or len(kept) < len(cache):
+        utils.save_json(kept, os.path.dirname(path), CACHE_FILENAME)
+    return (summarize(counts, time.monotonic() - start),
+            len(blobs) - misses, misses)
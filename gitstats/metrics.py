@@ -0,0 +1,213 @@
+import cProfile
+import json
+import os
+import pstats
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime
+
+from . import utils
+
+HISTORY_SIZE = 100
+
+
+def _clock():
+    """
+    Wall time, CPU time of the current process and CPU time of its waited
+    for children, which includes pool workers and git processes
+    """
+    times = os.times()
+    return (time.perf_counter(), times.user + times.system,
+            times.children_user + times.children_system)
+
+
+class _ProfileStats:
+    """
+    Wrap raw profiler stats sent by a pool worker to load them into
+    pstats.Stats
+    """
+    def __init__(self, stats):
+        self.stats = stats
+
+    def create_stats(self):
+        pass
+
+
+def measure(func, profile, *args):
+    """
+    Call a collector in a pool worker and measure it
+
+    :param func: the collector
+    :param profile: profile the call with cProfile
+    :return: a tuple (result, sample) where sample holds the wall and cpu
+        time, the git subprocesses spawned and bytes read from them and the
+        raw profiler stats if profiled
+    """
+    before = dict(utils.counters)
+    profiler = cProfile.Profile() if profile else None
+    wall, cpu, children = _clock()
+
+    if profiler:
+        profiler.enable()
+    try:
+        result = func(*args)
+    finally:
+        if profiler:
+            profiler.disable()
+
+    wall_end, cpu_end, children_end = _clock()
+    sample = {
+        'wall': wall_end - wall,
+        'cpu': cpu_end - cpu + children_end - children,
+        'processes': utils.counters['processes'] - before['processes'],
+        'bytes_read': utils.counters['bytes_read'] - before['bytes_read'],
+    }
+    if profiler:
+        profiler.create_stats()
+        sample['profile'] = profiler.stats
+
+    return result, sample
+
+
+class Metrics:
+    """
+    Performance metrics of a run collected per stage and per repo
+    """
+    def __init__(self, profile=False):
+        """
+        :param profile: dump cProfile stats of every stage
+        """
+        self.profile = profile
+        self.started = time.time()
+        self.stages = {}
+        self.caches = defaultdict(lambda: {'hits': 0, 'misses': 0})
+        self._profiles = {}
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Measure a stage of the run, the work done in its pool workers is
+        added by `task()`. The cpu time of a stage is the time of the main
+        process and of the tasks, as pool workers may be reaped any time.
+        """
+        stage = self.add_stage(name)
+        before = dict(utils.counters)
+        profiler = cProfile.Profile() if self.profile else None
+        wall, cpu, _ = _clock()
+
+        if profiler:
+            profiler.enable()
+        try:
+            yield stage
+        finally:
+            if profiler:
+                profiler.disable()
+                self._add_profile(name, profiler)
+
+            wall_end, cpu_end, _ = _clock()
+            stage['wall'] += wall_end - wall
+            stage['cpu'] += cpu_end - cpu
+            for key in ('processes', 'bytes_read'):
+                stage[key] += utils.counters[key] - before[key]
+            self._utilization(stage)
+
+    def add_stage(self, name):
+        """
+        :return: the metrics of a stage, added if missing
+        """
+        return self.stages.setdefault(name, {
+            'wall': 0, 'cpu': 0, 'processes': 0, 'bytes_read': 0,
+            'tasks': 0, 'busy': 0, 'workers': 0, 'repos': {},
+        })
+
+    def span(self, name, wall):
+        """
+        Set the wall time of a stage whose tasks were interleaved with the
+        tasks of other stages, from its first task started to its last done
+        """
+        stage = self.add_stage(name)
+        stage['wall'] = wall
+        self._utilization(stage)
+
+    def _utilization(self, stage):
+        if stage['wall'] and stage['workers']:
+            stage['utilization'] = min(
+                1, stage['busy'] / stage['wall'] / stage['workers'])
+
+    def task(self, name, repo, sample, workers=1):
+        """
+        Add the sample of a task run in a pool worker to a stage
+
+        :param workers: size of the pool the task was run in
+        """
+        stage = self.add_stage(name)
+        stage['tasks'] += 1
+        stage['busy'] += sample['wall']
+        stage['cpu'] += sample['cpu']
+        stage['workers'] = max(stage['workers'], workers)
+        for key in ('processes', 'bytes_read'):
+            stage[key] += sample[key]
+
+        if repo:
+            repo_stage = stage['repos'].setdefault(repo, {
+                'wall': 0, 'cpu': 0, 'processes': 0, 'bytes_read': 0,
+                'tasks': 0,
+            })
+            repo_stage['tasks'] += 1
+            for key in ('wall', 'cpu', 'processes', 'bytes_read'):
+                repo_stage[key] += sample[key]
+
+        if 'profile' in sample:
+            self._add_profile(name, _ProfileStats(sample['profile']))
+
+    def cache(self, name, hits=0, misses=0):
+        """
+        Count hits and misses of a cache
+        """
+        self.caches[name]['hits'] += hits
+        self.caches[name]['misses'] += misses
+
+    def _add_profile(self, name, profile):
+        if name in self._profiles:
+            self._profiles[name].add(profile)
+        else:
+            self._profiles[name] = pstats.Stats(profile)
+
+    def data(self):
+        return {
+            'started': int(self.started),
+            'wall': time.time() - self.started,
+            'stages': self.stages,
+            'caches': dict(self.caches),
+        }
+
+    def save(self, data_dir):
+        """
+        Write metrics.json, append the run to metrics-history.json and dump
+        the profiles of the stages into the profile folder
+        """
+        data = self.data()
+        utils.save_json(data, data_dir, 'metrics.json')
+
+        history_path = os.path.join(data_dir, 'metrics-history.json')
+        try:
+            with open(history_path) as fh:
+                history = json.load(fh)
+        except Exception:
+            history = []
+        history.append({
+            'date': datetime.utcfromtimestamp(self.started).isoformat(),
+            'wall': data['wall'],
+            'stages': {name: {k: v for k, v in stage.items() if k != 'repos'}
+                       for name, stage in self.stages.items()},
+            'caches': data['caches'],
+        })
+        utils.save_json(history[-HISTORY_SIZE:], data_dir,
+                        'metrics-history.json')
+
+        if self._profiles:
+            profile_dir = os.path.join(data_dir, 'profile')
+            os.makedirs(profile_dir, exist_ok=True)
+            for name, stats in self._profiles.items():
+                stats.dump_stats(os.path.join(profile_dir, f'{name}.prof'))
@@ -0,0 +1,204 @@
+"""
+Track the authors of the lines of files at HEAD by applying the diffs of new
+commits to the runs of authors known at a previous HEAD, instead of blaming
+the changed files again
+"""
+import codecs
+import re
+from collections import defaultdict
+
+from . import utils
+
+HUNK = re.compile(rb'^@@ -(\d+)(?:,(\d+))? \+(\d+)(?:,(\d+))? @@')
+
+
+def runs_of(authors):
+    """
+    :param authors: iterable of the author of every line of a file
+    :return: list of [number of lines, author] of consecutive lines
+    """
+    runs = []
+    for author in authors:
+        if runs and runs[-1][1] == author:
+            runs[-1][0] += 1
+        else:
+            runs.append([1, author])
+    return runs
+
+
+def lines_of(runs):
+    """
+    :return: list of the author of every line of the runs
+    """
+    return [author for count, author in runs for _ in range(count)]
+
+
+def count_authors(runs):
+    """
+    :return: dict of author to number of lines
+    """
+    authors = defaultdict(int)
+    for count, author in runs:
+        authors[author] += count
+    return dict(authors)
+
+
+def apply_hunks(lines, hunks, author):
+    """
+    Apply the hunks of a zero context diff to the authors of the lines of a
+    file, inserted lines are credited to the author
+
+    :param lines: the author of every line, updated in place
+    :param hunks: list of (old start, old count, new count) in diff order
+    :return: False if the hunks do not fit the lines
+    """
+    for start, old, new in reversed(hunks):
+        # a pure insertion is placed after the start line
+        index = start if old == 0 else start - 1
+        if index < 0 or index + old > len(lines):
+            return False
+        lines[index:index + old] = [author] * new
+    return True
+
+
+def _path(name):
+    if name.startswith(b'"'):
+        name = codecs.escape_decode(name[1:-1])[0]
+    return name.decode()
+
+
+def _header_path(header):
+    """
+    The path of a `diff --git` header without prefixes, which is only
+    unambiguous when both sides are the same
+    """
+    half = len(header) // 2
+    if len(header) % 2 and header[:half] == header[half + 1:]:
+        return _path(header[:half])
+    return None
+
+
+def _parse_patch(patch):
+    """
+    Parse the file sections of a zero context patch
+
+    :return: generator of dicts with the old and new path, the hunks and the
+        created, deleted and binary flags of every file
+    """
+    lines = patch.split(b'\n')
+    section = None
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        i += 1
+        if line.startswith(b'diff --git '):
+            if section:
+                yield section
+            path = _header_path(line[11:])
+            section = {'old': path, 'new': path, 'hunks': [],
+                       'created': False, 'deleted': False, 'binary': False}
+        elif section is None:
+            continue
+        elif line.startswith(b'rename from '):
+            section['old'] = _path(line[12:])
+        elif line.startswith(b'rename to '):
+            section['new'] = _path(line[10:])
+        elif line.startswith(b'new file mode '):
+            section['created'] = True
+        elif line.startswith(b'deleted file mode '):
+            section['deleted'] = True
+        elif line.startswith(b'--- '):
+            if line[4:] != b'/dev/null':
+                section['old'] = _path(line[4:])
+        elif line.startswith(b'+++ '):
+            if line[4:] != b'/dev/null':
+                section['new'] = _path(line[4:])
+        elif line.startswith(b'Binary files '):
+            section['binary'] = True
+        else:
+            match = HUNK.match(line)
+            if not match:
+                continue
+            start, old, _, new = match.groups()
+            old = 1 if old is None else int(old)
+            new = 1 if new is None else int(new)
+            section['hunks'].append((int(start), old, new))
+
+            # skip the removed and added lines, whatever they look like
+            remaining = old + new
+            while i < len(lines) and (remaining or
+                                      lines[i].startswith(b'\\')):
+                if not lines[i].startswith(b'\\'):
+                    remaining -= 1
+                i += 1
+    if section:
+        yield section
+
+
+def update(workdir, repo, since, head, files):
+    """
+    Replay the first parent history between two HEADs on the authors of the
+    lines of the files known at the previous HEAD. Files changed by merge
+    commits, binary files and files whose hunks do not fit cannot be
+    reconciled and have to be blamed again.
+
+    :param workdir: working root folder
+    :param repo: the repo name
+    :param since: the previous HEAD
+    :param head: the new HEAD
+    :param files: dict of file name to its runs at the previous HEAD, runs may
+        be None if unknown
+    :return: dict of file name to its runs at the new HEAD of every file
+        changed in between, runs are None for deleted files and files to be
+        blamed again. None if the previous HEAD is not an ancestor anymore or
+        the history cannot be followed.
+    """
+    try:
+        utils.git(workdir, repo, 'merge-base', '--is-ancestor', since, head)
+    except Exception:
+        return None
+
+    changed = {}
+
+    def current(name):
+        if name not in changed:
+            runs = files.get(name)
+            changed[name] = None if runs is None else lines_of(runs)
+        return changed[name]
+
+    for record in utils.stream_git(
+        workdir, repo, '-c', 'core.quotePath=false',
+        'log', '--reverse', '--first-parent', '--diff-merges=first-parent',
+        '-p', '-U0', '-w', '-M', '--no-prefix', '--no-color', '--no-ext-diff',
+        '--format=%x00%P%x09%aN', f'{since}..{head}'
+    ):
+        header, _, patch = record.partition(b'\n')
+        parents, _, author = header.decode().partition('\t')
+        merge = len(parents.split()) > 1
+
+        for section in _parse_patch(patch):
+            old, new = section['old'], section['new']
+            if old is None or new is None:
+                return None
+
+            if section['deleted']:
+                changed[old] = None
+                continue
+
+            if section['created']:
+                lines = []
+            else:
+                lines = current(old)
+                if old != new:
+                    changed[old] = None
+
+            if (lines is None or merge or section['binary'] or
+                    not apply_hunks(lines, section['hunks'], author)):
+                changed[new] = None
+            else:
+                changed[new] = lines
+
+    return {
+        name: None if lines is None else runs_of(lines)
+        for name, lines in changed.items()
+    }
@@ -0,0 +1,168 @@
+"""
+Run the collectors of a run as a graph of tasks in one worker pool
+"""
+import heapq
+import itertools
+import logging
+import queue
+import time
+from collections import defaultdict
+
+from . import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Scheduler:
+    """
+    Run tasks in one worker pool as soon as the tasks they depend on are
+    done, the ready tasks with the highest priority first. The results are
+    handled by callbacks in the main process, which may add more tasks.
+
+    A failed task is logged and the tasks depending on it are skipped, the
+    other tasks carry on.
+    """
+    def __init__(self, pool, workers, metrics=None):
+        """
+        :param pool: the worker pool, any multiprocessing Pool
+        :param workers: the size of the pool
+        :param metrics: the Metrics the tasks are measured into
+        """
+        self.pool = pool
+        self.workers = workers
+        self.metrics = metrics
+        self.done = set()
+        self.failed = set()
+        self._tasks = {}
+        self._ready = []
+        self._dependents = defaultdict(list)
+        self._results = queue.Queue()
+        self._running = 0
+        self._order = itertools.count()
+        self._spans = {}
+
+    def add(self, key, func=None, args=(), deps=(), priority=0,
+            callback=None, stage=None, repo=None):
+        """
+        Add a task
+
+        :param key: the unique hashable name of the task, e.g. (stage, repo)
+        :param func: the pickleable collector called with the args in the
+            pool. Without it, the task only calls its callback in the main
+            process.
+        :param deps: keys of the tasks to be done first, they may be added
+            later
+        :param priority: ready tasks of a higher priority are started first
+        :param callback: called in the main process with the result of the
+            collector, or without arguments if there is no collector
+        :param stage: the stage the task is measured in
+        :param repo: the repo the task is measured for
+        """
+        if key in self._tasks:
+            raise ValueError(f'task {key} already added')
+
+        self._tasks[key] = task = {
+            'key': key, 'func': func, 'args': args, 'priority': priority,
+            'callback': callback, 'stage': stage, 'repo': repo, 'pending': 0,
+        }
+        if any(dep in self.failed for dep in deps):
+            self._fail(key)
+            return
+
+        for dep in deps:
+            if dep not in self.done:
+                task['pending'] += 1
+                self._dependents[dep].append(key)
+        if not task['pending']:
+            self._push(task)
+
+    def run(self):
+        """
+        Run until all the tasks are done or skipped
+
+        :return: the keys of the tasks never run as their dependencies were
+            never added
+        """
+        while self._ready or self._running:
+            while self._ready and self._running < 2 * self.workers:
+                _, _, key = heapq.heappop(self._ready)
+                self._start(self._tasks[key])
+
+            if self._running:
+                key, ok, value = self._results.get()
+                self._running -= 1
+                self._finish(self._tasks[key], ok, value)
+
+        if self.metrics:
+            for stage, (start, end) in self._spans.items():
+                self.metrics.span(stage, end - start)
+
+        return [key for key, task in self._tasks.items()
+                if key not in self.done and key not in self.failed]
+
+    def _push(self, task):
+        heapq.heappush(self._ready,
+                       (-task['priority'], next(self._order), task['key']))
+
+    def _start(self, task):
+        if task['stage']:
+            now = time.perf_counter()
+            self._spans.setdefault(task['stage'], [now, now])
+
+        if task['func'] is None:
+            self._finish(task, True, None)
+            return
+
+        key = task['key']
+        self._running += 1
+        self.pool.apply_async(
+            metrics.measure,
+            (task['func'], bool(self.metrics and self.metrics.profile),
+             *task['args']),
+            callback=lambda value: self._results.put((key, True, value)),
+            error_callback=lambda error: self._results.put(
+                (key, False, error)),
+        )
+
+    def _finish(self, task, ok, value):
+        key = task['key']
+        try:
+            if not ok:
+                raise value
+            if task['func'] is None:
+                self._call(task)
+            else:
+                result, sample = value
+                if self.metrics and task['stage']:
+                    self.metrics.task(task['stage'], task['repo'], sample,
+                                      self.workers)
+                self._call(task, result)
+        except Exception as e:
+            logger.error(f'task {key} failed', exc_info=e)
+            self._fail(key)
+        else:
+            self.done.add(key)
+            for dependent in self._dependents.pop(key, []):
+                dependent = self._tasks[dependent]
+                dependent['pending'] -= 1
+                if not dependent['pending']:
+                    self._push(dependent)
+        finally:
+            if task['stage']:
+                self._spans[task['stage']][1] = time.perf_counter()
+
+    def _call(self, task, *result):
+        if not task['callback']:
+            return
+        if self.metrics and task['stage']:
+            with self.metrics.stage(task['stage']):
+                task['callback'](*result)
+        else:
+            task['callback'](*result)
+
+    def _fail(self, key):
+        self.failed.add(key)
+        for dependent in self._dependents.pop(key, []):
+            if dependent not in self.failed:
+                logger.warning(f'task {dependent} skipped, {key} failed')
+                self._fail(dependent)
@@ -0,0 +1,72 @@
+import json
+
+from gitstats import benchmark, collectors, utils
+
+
+def test_generate_repo(tmp_path):
+    path = str(tmp_path / 'repo')
+    benchmark.generate_repo(path, commits=20, authors=3, files=5, tags=2,
+                            branches=2, seed=1)
+
+    assert utils.git(path, '', 'rev-list', '--count', 'master') == '20'
+    assert utils.git(path, '', 'tag').split() == ['v10', 'v20']
+    branches = utils.git(path, '', 'branch', '--format=%(refname:short)')
+    assert len(branches.split()) == 3
+    authors = utils.git(path, '', 'shortlog', '-s', 'master').splitlines()
+    assert 1 < len(authors) <= 3
+
+    again = str(tmp_path / 'again')
+    benchmark.generate_repo(again, commits=20, authors=3, files=5, tags=2,
+                            branches=2, seed=1)
+    assert (utils.git(path, '', 'rev-parse', 'master') ==
+            utils.git(again, '', 'rev-parse', 'master'))
+
+    benchmark.generate_repo(path, commits=5, tags=1, branches=0, seed=2,
+                            append=True)
+    assert utils.git(path, '', 'rev-list', '--count', 'master') == '25'
+    assert 'v25' in utils.git(path, '', 'tag').split()
+
+
+def test_bench_collectors(tmp_path):
+    source = str(tmp_path / 'source')
+    benchmark.generate_repo(source, commits=10, files=3, tags=1, branches=1)
+    workdir = str(tmp_path / 'work')
+    (tmp_path / 'work').mkdir()
+    collectors.clone(workdir, 'repo', source)
+
+    results = benchmark.bench_collectors(workdir, 'repo', repeat=2)
+    assert 'activity' in results and 'get_blame' in results
+    assert all(r['runs'] == 2 and r['min'] <= r['median']
+               for r in results.values())
+
+
+def test_compare():
+    old = {'collectors': {'activity': {'median': 2.0}},
+           'run': {'cold': {'wall': 4.0}}}
+    new = {'collectors': {'activity': {'median': 1.0},
+                          'summary': {'median': 1.0}},
+           'run': {'cold': {'wall': 2.0}}}
+    lines = benchmark.compare(old, new)
+    assert len(lines) == 4
+    assert lines[1].split() == ['activity', '2.000', '1.000', '0.50x']
+    assert lines[2].split() == ['summary', '-', '1.000', '-']
+    assert lines[3].split() == ['run', 'cold', '4.000', '2.000', '0.50x']
+
+
+def test_main_compare_same_output(tmp_path, mocker, capsys):
+    path = str(tmp_path / 'benchmark.json')
+    old = {'collectors': {'activity': {'median': 2.0}},
+           'run': {'cold': {'wall': 4.0}}}
+    with open(path, 'w') as fh:
+        json.dump(old, fh)
+    mocker.patch.object(benchmark.utils, 'lower_priority')
+    mocker.patch.object(benchmark, 'benchmark', return_value={
+        'collectors': {'activity': {'median': 1.0}},
+        'run': {'cold': {'wall': 2.0}},
+    })
+
+    benchmark.main(['-o', path, '--compare', path])
+
+    assert '0.50x' in capsys.readouterr().out
+    with open(path) as fh:
+        assert json.load(fh)['run']['cold']['wall'] == 2.0
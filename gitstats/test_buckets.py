@@ -0,0 +1,48 @@
+import json
+import random
+
+import pytest
+
+from . import buckets
+
+
+def commits(count, seed=0):
+    rnd = random.Random(seed)
+    # spans the DST changes of a few years
+    timestamps = sorted((rnd.randint(1509237000, 1572400000)
+                         for _ in range(count)), reverse=True)
+    # around a DST change by the second
+    timestamps[:0] = range(1521939600 + 1800, 1521939600 - 1800, -450)
+    return (
+        timestamps,
+        [rnd.randrange(5) for _ in timestamps],
+        [f'author {i}' for i in range(6)],
+        [rnd.choice([-1, 0, rnd.randint(1, 100)]) for _ in timestamps],
+        [rnd.choice([-1, rnd.randint(1, 100)]) for _ in timestamps],
+    )
+
+
+@pytest.mark.skipif(buckets.np is None, reason='needs numpy')
+@pytest.mark.parametrize('count', [0, 1, 500])
+def test_numpy_same_as_python(count):
+    columns = commits(count)
+    if not count:
+        columns = ([], [], [], [], [])
+    expected = buckets._aggregate_python(*columns)
+    assert json.dumps(buckets._aggregate_numpy(*columns)) == json.dumps(
+        expected)
+    assert buckets.aggregate(*columns) == expected
+
+
+@pytest.mark.skipif(buckets.np is None, reason='needs numpy')
+def test_numpy_metric_order():
+    # deletions are seen before insertions, for author 1 only
+    columns = ([300, 200, 100], [0, 1, 0], ['a', 'b'], [5, -1, 1],
+               [-1, 2, -1])
+    data = buckets._aggregate_numpy(*columns)
+    assert list(data['by_time']['daily']) == [
+        'commits', 'insertions', 'deletions']
+    assert list(data['by_authors']['b']['daily']) == [
+        'commits', 'deletions']
+    assert json.dumps(data) == json.dumps(
+        buckets._aggregate_python(*columns))
@@ -1,6 +1,8 @@
+import io
 import json
+import os
 import subprocess
-from . import collectors
+from . import benchmark, collectors, commits, loc, trees, utils
 
 
 class CompletedProcessMock:
@@ -22,88 +24,232 @@ filename file.txt
 	line two
 """     # flake8: noqa
 
-shortlog_text = """\
-1528753992 dcc3c393 M Nasimul Haque
- 1 file changed, 1 insertion(+), 1 deletion(-)
+log_bytes = (
+    b'\x001528753992 dcc3c393 M Nasimul Haque\n\n'
+    b' 1 file changed, 1 insertion(+), 1 deletion(-)\n'
+    b'\x001528753813 a36e16b3 M Nasimul Haque\n\n'
+    b' 1 file changed, 3 insertions(+)\n'
+)
 
-1528753813 a36e16b3 M Nasimul Haque
- 1 file changed, 3 insertions(+)
-"""
 
+def popen_mock(mocker, stdout=b'', returncode=0):
+    popen = mocker.patch('subprocess.Popen')
+    popen.return_value.stdout = io.BytesIO(stdout)
+    popen.return_value.wait.return_value = returncode
+    return popen
 
-def assert_subprocess_run(cmd):
+
+def assert_subprocess_popen(argv, stdin=subprocess.DEVNULL):
+    assert subprocess.Popen.call_count == 1
+    args, kwargs = subprocess.Popen.call_args
+    assert args == (argv,)
+    assert kwargs['cwd'] == '/tmp'
+    assert kwargs['stdin'] == stdin
+    assert 'shell' not in kwargs
+
+
+def assert_subprocess_run(argv):
     assert subprocess.run.call_count == 1
-    subprocess.run.assert_any_call(
-        f'nice -n 20 {cmd}', cwd='/tmp', check=True, shell=True,
-        stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True
-    )
+    args, kwargs = subprocess.run.call_args
+    assert args == (argv,)
+    assert kwargs['cwd'] == '/tmp'
+    assert kwargs['check'] is True
+    assert 'shell' not in kwargs
 
 
 def test_clone(mocker):
     mocker.patch('subprocess.run')
     collectors.clone('/tmp', 'foo', 'bar')
-    assert_subprocess_run('git clone bar foo')
+    assert_subprocess_run(['git', 'clone', 'bar', 'foo'])
 
 
 def test_clone_on_exception(mocker):
     run = mocker.patch('subprocess.run')
     run.side_effect = Exception('failed')
     collectors.clone('/tmp', 'foo', 'bar')
-    assert_subprocess_run('git clone bar foo')
+    assert_subprocess_run(['git', 'clone', 'bar', 'foo'])
+
+
+def test_remote_refs(tmp_path):
+    origin = str(tmp_path / 'origin')
+    benchmark.generate_repo(origin, commits=5, tags=1, branches=1)
+    workdir = str(tmp_path)
+
+    refs = collectors.remote_refs(workdir, ('repo', origin, False))
+    assert refs['name'] == 'repo'
+    assert refs == collectors.remote_refs(workdir, ('repo', origin))
+
+    utils.git(origin, '', 'tag', 'new')
+    assert collectors.remote_refs(workdir, ('repo', origin)) != refs
+    assert collectors.remote_refs(workdir, ('repo', 'missing')) == {
+        'name': 'repo', 'refs': None,
+    }
+
+
+def test_clone_mirror(mocker):
+    mocker.patch('subprocess.run')
+    collectors.clone('/tmp', 'foo', 'bar', mirror=True)
+    assert_subprocess_run(['git', 'clone', '--mirror', 'bar', 'foo'])
+
+
+def test_mirror(tmp_path):
+    origin = str(tmp_path / 'origin')
+    benchmark.generate_repo(origin, commits=20, files=4, tags=1, branches=2,
+                            seed=1)
+    workdir = str(tmp_path / 'repos')
+    os.makedirs(workdir)
+
+    for name, mirror in (('clone', False), ('mirror', True)):
+        result = collectors.update_repo(workdir, (name, origin, mirror))
+        assert result['HEAD'] == utils.git(origin, '', 'rev-parse', 'HEAD')
+    assert not utils.is_bare(workdir, 'clone')
+    assert utils.is_bare(workdir, 'mirror')
+
+    # a mirror is updated by fetching
+    utils.git(origin, '', 'reset', '-q')
+    utils.git(origin, '', '-c', 'user.name=a', '-c', 'user.email=a@b',
+              'commit', '--allow-empty', '-m', 'new')
+    head = utils.git(origin, '', 'rev-parse', 'HEAD')
+    assert collectors.update_repo(workdir, ('mirror', origin))['HEAD'] == head
+    collectors.update_repo(workdir, ('clone', origin))
+
+    fname = utils.git(origin, '', 'ls-tree', '-r', '--name-only',
+                      'HEAD').split()[0]
+
+    def get_blame(workdir, repo):
+        return {'repo': repo,
+                **collectors.get_blame(workdir, repo, False, fname)}
+
+    for collector in (collectors.summary, collectors.get_branches,
+                      collectors.get_tags, get_blame):
+        clone = collector(workdir, 'clone')
+        mirror = collector(workdir, 'mirror')
+        assert clone.pop('repo') == 'clone'
+        assert mirror.pop('repo') == 'mirror'
+        assert clone == mirror
 
 
 def test_get_timestamp(mocker):
-    run = mocker.patch('subprocess.run')
-    run.return_value = CompletedProcessMock('123456')
+    cat_file = mocker.patch('gitstats.utils.cat_file')
+    cat_file.return_value.commit.return_value = {'author': ('a', 123456)}
     result = {'timestamp': 123456, 'revision': 'bar'}
     assert collectors.get_timestamp('/', 'tmp', 'bar') == result
-    assert_subprocess_run('git log --pretty=format:"%at" -n 1 bar')
+    cat_file.assert_called_once_with('/', 'tmp')
+    cat_file.return_value.commit.assert_called_once_with('bar')
 
 
 def test_get_blame(mocker):
     run = mocker.patch('subprocess.run')
     run.return_value = CompletedProcessMock(blame_text)
-    result = {'authors': {'M Nasimul Haque': 2}, 'file': 'file.txt'}
+    result = {'authors': {'M Nasimul Haque': 2}, 'file': 'file.txt',
+              'runs': [[2, 'M Nasimul Haque']]}
     assert collectors.get_blame('/', 'tmp', False, 'file.txt') == result
-    assert_subprocess_run('git blame --line-porcelain  -w file.txt')
+    assert_subprocess_run(['git', 'blame', '--line-porcelain', '-w', 'HEAD',
+                           '--', 'file.txt'])
 
 
 def test_get_blame_detect_move(mocker):
     run = mocker.patch('subprocess.run')
     run.return_value = CompletedProcessMock(blame_text)
-    result = {'authors': {'M Nasimul Haque': 2}, 'file': 'file.txt'}
+    result = {'authors': {'M Nasimul Haque': 2}, 'file': 'file.txt',
+              'runs': [[2, 'M Nasimul Haque']]}
     assert collectors.get_blame('/', 'tmp', True, 'file.txt') == result
-    assert_subprocess_run('git blame --line-porcelain -C -C -C -M -w file.txt')
+    assert_subprocess_run(['git', 'blame', '--line-porcelain', '-C', '-C',
+                           '-C', '-M', '-w', 'HEAD', '--', 'file.txt'])
 
 
 def test_get_blame_on_exception(mocker):
     run = mocker.patch('subprocess.run')
     run.side_effect = Exception('failed')
-    result = {'authors': {}, 'file': 'file.txt'}
+    result = {'authors': {}, 'file': 'file.txt', 'failed': True}
     assert collectors.get_blame('/', 'tmp', False, 'file.txt') == result
-    assert_subprocess_run('git blame --line-porcelain  -w file.txt')
+    assert_subprocess_run(['git', 'blame', '--line-porcelain', '-w', 'HEAD',
+                           '--', 'file.txt'])
+
+
+def test_get_blames(mocker):
+    run = mocker.patch('subprocess.run')
+    run.return_value = CompletedProcessMock(blame_text)
+    result = collectors.get_blames('/', ('tmp', False, ['a', 'b']))
+    assert result['repo'] == 'tmp'
+    assert [r['file'] for r in result['results']] == ['a', 'b']
+    assert run.call_count == 2
 
 
 def test_get_branches(mocker):
     run = mocker.patch('subprocess.run')
-    run.return_value = CompletedProcessMock('b1\nb2\nb3 HEAD')
-    result = {'branches': ['b1', 'b2'], 'repo': 'tmp'}
+    run.return_value = CompletedProcessMock(
+        'c1\t\t100\torigin/b1\n'
+        'c2\t\t200\torigin/b2\n'
+        'c2\trefs/remotes/origin/b2\t200\torigin/HEAD'
+    )
+    result = {
+        'branches': [
+            {'revision': 'origin/b2', 'timestamp': 200},
+            {'revision': 'origin/b1', 'timestamp': 100},
+        ],
+        'repo': 'tmp',
+    }
     assert collectors.get_branches('/', 'tmp') == result
-    assert_subprocess_run('git branch -r')
+    assert_subprocess_run([
+        'git', 'for-each-ref', '--format=%(objectname)%09%(symref)%09'
+        '%(creatordate:unix)%09%(refname:strip=2)', 'refs/remotes'
+    ])
+
+
+# tags v1 <- c1 <- c2 (v2, v2-again) <- c3 <- c4 (v3) and a tree tag
+tags_text = """\
+c1\t\tcommit\t\t100\tv1
+a2\tc2\ttag\tcommit\t200\tv2
+c2\t\tcommit\t\t250\tv2-again
+a4\tc4\ttag\tcommit\t400\tv3
+a5\tt5\ttag\ttree\t500\ttree-tag"""
+
+tags_log = (
+    b'\x00c4 c3\tauthor2\n'
+    b'\x00c3 c2\tauthor1\n'
+    b'\x00c2 c1\tauthor1\n'
+    b'\x00c1 \tauthor1\n'
+)
 
 
 def test_get_tags(mocker):
     run = mocker.patch('subprocess.run')
-    run.return_value = CompletedProcessMock('123 b1\n456 b2')
+    run.return_value = CompletedProcessMock(tags_text)
+    popen_mock(mocker, tags_log)
+
+    def tag(name, revision, timestamp, authors):
+        return {
+            'tag': name,
+            'revision': revision,
+            'timestamp': timestamp,
+            'authors': [{'author': a, 'commits': c} for a, c in authors],
+            'commits': sum(c for _, c in authors),
+        }
+
     result = {
         'tags': [
-            {'revision': '123', 'tag': 'b1'},
-            {'revision': '456', 'tag': 'b2'},
+            tag('tree-tag', 'a5', 500, []),
+            tag('v3', 'a4', 400, [('author1', 1), ('author2', 1)]),
+            tag('v2-again', 'c2', 250, []),
+            tag('v2', 'a2', 200, [('author1', 1)]),
+            tag('v1', 'c1', 100, [('author1', 1)]),
         ],
         'repo': 'tmp',
     }
     assert collectors.get_tags('/', 'tmp') == result
-    assert_subprocess_run('git show-ref --tags')
+    assert_subprocess_run([
+        'git', 'for-each-ref', '--format=%(objectname)%09%(*objectname)%09'
+        '%(objecttype)%09%(*objecttype)%09%(creatordate:unix)%09'
+        '%(refname:strip=2)', 'refs/tags'
+    ])
+    assert_subprocess_popen(
+        ['git', 'log', '--topo-order', '--stdin',
+         '--pretty=format:%x00%H %P%x09%aN'],
+        stdin=subprocess.PIPE,
+    )
+    subprocess.Popen.return_value.stdin.write.assert_called_once_with(
+        b'c1\nc2\nc4\n')
 
 
 def test_get_tags_on_exception(mocker):
@@ -111,37 +257,163 @@ def test_get_tags_on_exception(mocker):
     run.side_effect = Exception('failed')
     result = {'repo': 'tmp', 'tags': []}
     assert collectors.get_tags('/', 'tmp') == result
-    assert_subprocess_run('git show-ref --tags')
+    assert_subprocess_run([
+        'git', 'for-each-ref', '--format=%(objectname)%09%(*objectname)%09'
+        '%(objecttype)%09%(*objecttype)%09%(creatordate:unix)%09'
+        '%(refname:strip=2)', 'refs/tags'
+    ])
 
 
 def test_num_files(mocker):
-    run = mocker.patch('subprocess.run')
-    run.return_value = CompletedProcessMock('f1\nf2')
-    result = {'12345': {'files': 2, 'timestamp': 12345}}
+    cat_file = mocker.patch('gitstats.utils.cat_file')
+    cat_file.return_value.tree.side_effect = lambda sha: {
+        '12345': [('100644', 'f1', 'b1'), ('40000', 'd1', 't1'),
+                  ('160000', 'm1', 'c1')],
+        't1': [('100644', 'f2', 'b2'), ('100755', 'f3', 'b3')],
+    }[sha]
+    result = {'12345': {'files': 4, 'timestamp': 12345}}
     revision = {'revision': '12345', 'timestamp': 12345}
     assert collectors.num_files('/', 'tmp', revision) == result
-    assert_subprocess_run('git ls-tree -r --name-only 12345')
 
 
-def test_count_lines(mocker):
+summary_bytes = (
+    b'\x00- c0 t0 100 \n\n'
+    b'\x00> c1 t1 200 c0\n\n'
+    b' create mode 100644 a.txt\n create mode 100644 b.txt\n'
+    b'\x00> c2 t2 300 c1\n\n'
+    b' delete mode 100644 a.txt\n mode change 100644 => 100755 b.txt\n'
+    b'\x00> c3 t3 400 c1 c2\n'
+)
+
+
+def test_files_history(mocker):
     run = mocker.patch('subprocess.run')
-    run.return_value = CompletedProcessMock('{"lines": "data from cloc"}')
-    result = {'data': {'lines': {'lines': 'data from cloc'}}, 'repo': 'tmp'}
+    run.return_value = CompletedProcessMock('c3')
+    popen_mock(mocker, summary_bytes)
+
+    known = {'t0': {'timestamp': 100, 'files': 10}}
+    result = collectors.files_history('/', ('tmp', 'c0', known))
+    assert result == {
+        'data': {
+            't1': {'timestamp': 200, 'files': 12},
+            't2': {'timestamp': 300, 'files': 11},
+            't3': {'timestamp': 400, 'files': 12},
+        },
+        'HEAD': 'c3',
+        'repo': 'tmp',
+    }
+    assert_subprocess_popen([
+        'git', 'log', '--reverse', '--topo-order', '--boundary',
+        '--diff-merges=first-parent', '--summary', '--no-renames',
+        '--pretty=format:%x00%m %H %T %at %P', 'c0..c3'
+    ])
+
+
+def test_files_history_unknown_boundary(mocker):
+    run = mocker.patch('subprocess.run')
+    run.return_value = CompletedProcessMock('c1')
+    cat_file = mocker.patch('gitstats.utils.cat_file')
+    cat_file.return_value.tree.return_value = [('100644', 'f1', 'b1'),
+                                               ('100644', 'f2', 'b2')]
+    popen_mock(mocker, summary_bytes.split(b'\x00> c2')[0])
+
+    result = collectors.files_history('/', ('tmp', 'c0', {}))
+    assert result['data'] == {'t1': {'timestamp': 200, 'files': 4}}
+
+
+def test_count_lines(mocker):
+    count_lines = mocker.patch.object(loc, 'count_revision',
+                                      return_value=({'SUM': {}}, 1, 2))
+    result = {'data': {'lines': {'SUM': {}}}, 'repo': 'tmp',
+              'cache': {'hits': 1, 'misses': 2}}
     assert collectors.count_lines('/', 'tmp') == result
-    assert_subprocess_run('cloc --vcs git --json')
+    count_lines.assert_called_once_with('/', 'tmp')
 
 
 def test_count_lines_on_exception(mocker):
-    run = mocker.patch('subprocess.run')
-    run.side_effect = Exception('failed')
-    result = {'data': {'lines': []}, 'repo': 'tmp'}
+    mocker.patch.object(loc, 'count_revision', side_effect=Exception('failed'))
+    result = {'data': {'lines': []}, 'repo': 'tmp',
+              'cache': {'hits': 0, 'misses': 0}}
     assert collectors.count_lines('/', 'tmp') == result
-    assert_subprocess_run('cloc --vcs git --json')
+
+
+def test_lines_history(tmp_path, mocker):
+    path = str(tmp_path / 'repo')
+    benchmark.generate_repo(path, commits=100, files=200, tags=3,
+                            branches=0)
+    workdir = str(tmp_path)
+
+    result = collectors.lines_history(workdir, ('repo', None))
+    assert result['repo'] == 'repo'
+    data = result['data']
+    assert [tag['tag'] for tag in data['tags']] == utils.git(
+        path, '', 'tag', '--sort=-creatordate').split()
+    months = list(data['monthly'])
+    assert len(months) > 1
+    assert months == sorted(months)
+    assert data['monthly'][months[-1]]['revision'] == utils.git(
+        path, '', 'rev-parse', 'HEAD')
+
+    # as counted from the files of every revision
+    for point in [*data['tags'], *data['monthly'].values()]:
+        lines, _, _ = loc.count_revision(workdir, 'repo', point['revision'])
+        lines.pop('header')
+        assert point['lines'] == lines
+        assert point['lines']['Python']['nFiles'] > 0
+
+    # the revisions of the previous history are not counted again
+    points = len(data['tags']) + len(months)
+    count_trees = mocker.patch.object(loc, 'count_trees',
+                                      wraps=loc.count_trees)
+    again = collectors.lines_history(workdir, ('repo', data))
+    assert again['data'] == data
+    assert count_trees.call_args.args[2] == []
+    assert again['cache'] == {'hits': points, 'misses': 0}
+
+    # the blobs of the new months are read only if changed since the
+    # counted ones
+    counted = {line.split()[2]
+               for point in [*data['tags'], *data['monthly'].values()]
+               for line in utils.git(path, '', 'ls-tree', '-r',
+                                     point['revision']).splitlines()}
+    utils.git(path, '', 'reset', '-q', '--hard')
+    benchmark.generate_repo(path, commits=100, files=200, tags=0,
+                            branches=0, append=True)
+    utils.git(path, '', 'reset', '-q', '--hard')
+    # the cache of the lines holds the blobs of the new HEAD only
+    loc.count_revision(workdir, 'repo')
+    read_blobs = mocker.patch.object(utils, 'read_blobs',
+                                     wraps=utils.read_blobs)
+    result = collectors.lines_history(workdir, ('repo', data))
+    assert list(result['data']['monthly'])[:len(months) - 1] == months[:-1]
+    read = {sha for call in read_blobs.call_args_list
+            for sha in call.args[2]}
+    assert read and not read & counted
+    for point in result['data']['monthly'].values():
+        lines, _, _ = loc.count_revision(workdir, 'repo', point['revision'])
+        lines.pop('header')
+        assert point['lines'] == lines
+
+
+def test_lines_history_error(tmp_path):
+    assert collectors.lines_history(str(tmp_path), ('missing', None)) == {
+        'data': {'tags': [], 'monthly': {}},
+        'repo': 'missing',
+        'cache': {'hits': 0, 'misses': 0},
+    }
+
+
+def test_iter_log(mocker):
+    popen_mock(mocker, log_bytes + b'\x001528753000 f00 Some One\n')
+    assert list(collectors.iter_log('/', 'tmp')) == [
+        (1528753992, 'dcc3c393', 'M Nasimul Haque', 1, 1),
+        (1528753813, 'a36e16b3', 'M Nasimul Haque', 3, None),
+        (1528753000, 'f00', 'Some One', None, None),
+    ]
 
 
 def test_activity(mocker):
-    run = mocker.patch('subprocess.run')
-    run.return_value = CompletedProcessMock(shortlog_text)
+    popen_mock(mocker, log_bytes)
     result = {
         'data': {
             'authors_age': {
@@ -216,26 +488,86 @@ def test_activity(mocker):
         ],
     }
     assert json.loads(json.dumps(collectors.activity('/', 'tmp'))) == result
-    assert_subprocess_run('git log --shortstat --pretty=format:"%at %T %aN" HEAD')
+    assert_subprocess_popen(['git', 'log', '--shortstat',
+                             '--pretty=format:%x00%at %T %aN', 'HEAD'])
+
+
+def test_activity_since(tmp_path):
+    path = str(tmp_path / 'repo')
+    benchmark.generate_repo(path, commits=20, tags=0, branches=0)
+    since = utils.git(path, '', 'rev-parse', 'HEAD')
+    commits.load_index(str(tmp_path), 'repo')
+    benchmark.generate_repo(path, commits=5, tags=0, branches=0, seed=1,
+                            append=True)
+    head = utils.git(path, '', 'rev-parse', 'HEAD')
+
+    result = collectors.activity_since(str(tmp_path), ('repo', since))
+    expected = collectors.activity(path, '', f'{since}..{head}')
+    assert result['HEAD'] == head
+    assert result['since'] == since
+    assert result['revisions'] == expected['revisions']
+    assert result['data'] == expected['data']
+
+    # unknown to the commit index, the whole history is aggregated
+    result = collectors.activity_since(str(tmp_path), ('repo', 'old'))
+    assert result['since'] is None
+    assert result['data'] == collectors.activity(path, '')['data']
+
+
+def test_merge_activity():
+    data = {
+        'by_time': {'daily': {'commits': {'2018-06-11': 1}}},
+        'hour_of_week': {'0': {'22': 1}},
+        'by_authors': {'a': {'daily': {'commits': {'2018-06-11': 1}}}},
+        'authors_age': {
+            'a': {'first_commit': 86400, 'last_commit': 86400, 'days': 0},
+        },
+    }
+    delta = {
+        'by_time': {'daily': {'commits': {'2018-06-11': 1},
+                              'insertions': {'2018-06-11': 5}}},
+        'hour_of_week': {0: {22: 1, 23: 1}},
+        'by_authors': {'a': {'daily': {'commits': {'2018-06-11': 1}}}},
+        'authors_age': {
+            'a': {'first_commit': 86400 * 3, 'last_commit': 86400 * 3,
+                  'days': 0},
+        },
+    }
+    assert collectors.merge_activity(data, delta) == {
+        'by_time': {'daily': {'commits': {'2018-06-11': 2},
+                              'insertions': {'2018-06-11': 5}}},
+        'hour_of_week': {'0': {'22': 2, '23': 1}},
+        'by_authors': {'a': {'daily': {'commits': {'2018-06-11': 2}}}},
+        'authors_age': {
+            'a': {'first_commit': 86400, 'last_commit': 86400 * 3,
+                  'days': 2},
+        },
+    }
+
+
+def index_mock(mocker):
+    index = commits.CommitIndex()
+    for i, timestamp in enumerate((1527621944, 1527761990, 1528755935)):
+        index.add(f'{i:040x}', f'{i:040x}', timestamp, 'M Nasimul Haque')
+    index.heads.append([index.commit(-1), len(index)])
+    mocker.patch.object(commits, 'load_index', return_value=index)
+    return index
+
+
+def tree_mock(mocker):
+    tree = trees.TreeIndex()
+    tree.files = {f'f{i}': ['100644', f'{i:040x}', 0, 0] for i in range(98)}
+    tree.lines = 10564
+    return mocker.patch.object(trees, 'load_index', return_value=tree)
 
 
 def test_summary(mocker):
+    index_mock(mocker)
+    tree_mock(mocker)
     run = mocker.patch('subprocess.run')
     run.side_effect = [
-        # empty sha generator
-        CompletedProcessMock('1234'),
-        # diff --shortstat
-        CompletedProcessMock(' 98 files changed, 10564 insertions(+)'),
-        # shortlog -s
-        CompletedProcessMock('    93  M Nasimul Haque'),
-        # rev-list --count HEAD
-        CompletedProcessMock('93'),
         # branch -r
         CompletedProcessMock('origin/master'),
-        # log --reverse %at
-        CompletedProcessMock('1527621944\n1527761990\n1527763244'),
-        # log %at -n1
-        CompletedProcessMock('1528755935'),
         # show-ref --tags
         CompletedProcessMock('refs/tags/v1'),
     ]
@@ -244,7 +576,7 @@ def test_summary(mocker):
             {'key': 'files', 'value': '98'},
             {'key': 'lines', 'notes': 'includes empty lines', 'value': '10564'},
             {'key': 'authors', 'value': 1},
-            {'key': 'commits', 'notes': 'master only', 'value': '93'},
+            {'key': 'commits', 'notes': 'master only', 'value': '3'},
             {'key': 'branches', 'value': 1},
             {'key': 'tags', 'value': 1},
             {'key': 'age', 'notes': 'active days since creation', 'value': 14}],
@@ -254,22 +586,12 @@ def test_summary(mocker):
 
 
 def test_summary_on_exception(mocker):
+    index_mock(mocker)
+    tree_mock(mocker)
     run = mocker.patch('subprocess.run')
     run.side_effect = [
-        # empty sha generator
-        CompletedProcessMock('1234'),
-        # diff --shortstat
-        CompletedProcessMock(' 98 files changed, 10564 insertions(+)'),
-        # shortlog -s
-        CompletedProcessMock('    93  M Nasimul Haque'),
-        # rev-list --count HEAD
-        CompletedProcessMock('93'),
         # branch -r
         CompletedProcessMock('origin/master'),
-        # log --reverse %at
-        CompletedProcessMock('1527621944\n1527761990\n1527763244'),
-        # log %at -n1
-        CompletedProcessMock('1528755935'),
         # show-ref --tags
         Exception('refs/tags/v1'),
     ]
@@ -278,7 +600,7 @@ def test_summary_on_exception(mocker):
             {'key': 'files', 'value': '98'},
             {'key': 'lines', 'notes': 'includes empty lines', 'value': '10564'},
             {'key': 'authors', 'value': 1},
-            {'key': 'commits', 'notes': 'master only', 'value': '93'},
+            {'key': 'commits', 'notes': 'master only', 'value': '3'},
             {'key': 'branches', 'value': 1},
             {'key': 'tags', 'value': 0},
             {'key': 'age', 'notes': 'active days since creation', 'value': 14}],
@@ -288,25 +610,24 @@ def test_summary_on_exception(mocker):
 
 
 def test_update_repo(mocker):
+    index = index_mock(mocker)
+    tree = tree_mock(mocker)
     run = mocker.patch('subprocess.run')
     run.side_effect = [
         # clone
         CompletedProcessMock(''),
         # pull --tags
         CompletedProcessMock(''),
-        # log --pretty=format:"%H %at %aN" -n1
-        CompletedProcessMock('head 23456 author'),
-        # log --reverse --pretty=format:"%at"
-        CompletedProcessMock('12345'),
     ]
     result = {
-        'HEAD': 'head',
-        'author': 'author',
-        'date': 23456,
+        'HEAD': index.head,
+        'author': 'M Nasimul Haque',
+        'date': 1528755935,
         'name': 'tmp',
-        'start_date': 12345,
+        'start_date': 1527621944,
     }
     assert collectors.update_repo('/', ['tmp', 'https://example.com']) == result
+    tree.assert_called_once_with('/', 'tmp')
 
 
 def test_update_repo_on_exception(mocker):
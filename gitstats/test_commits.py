@@ -0,0 +1,67 @@
+from gitstats import benchmark, collectors, commits, utils
+
+
+def test_index(tmp_path):
+    path = str(tmp_path / 'repo')
+    benchmark.generate_repo(path, commits=30, authors=4, tags=0, branches=0)
+    workdir = str(tmp_path)
+
+    index = commits.load_index(workdir, 'repo')
+    head = utils.git(path, '', 'rev-parse', 'HEAD')
+    assert index.head == head
+    assert index.commit(-1) == head
+    assert len(index) == int(utils.git(path, '', 'rev-list', '--count',
+                                       'HEAD'))
+    assert sorted(index.names) == sorted(
+        line.split('\t')[1]
+        for line in utils.git(path, '', 'shortlog', '-s', 'HEAD').splitlines()
+    )
+    assert index.timestamps[0] == int(utils.git(
+        path, '', 'log', '--reverse', '--pretty=format:%at').splitlines()[0])
+    assert list(index.rows()) == list(collectors.iter_log(path, ''))
+
+    # persisted and loaded as is
+    loaded = commits.CommitIndex.load(commits.index_path(workdir, 'repo'))
+    assert list(loaded.rows()) == list(index.rows())
+    assert loaded.heads == index.heads
+    assert not loaded.update(workdir, 'repo')
+
+    # extended with the new commits only
+    benchmark.generate_repo(path, commits=5, tags=0, branches=0, seed=1,
+                            append=True)
+    index = commits.load_index(workdir, 'repo')
+    assert len(index) == 35
+    assert index.position(head) == 30
+    assert index.position('unknown') is None
+    assert list(index.rows(30)) == list(collectors.iter_log(
+        path, '', f'{head}..HEAD'))
+
+    # rebuilt when the history is rewritten
+    utils.git(path, '', 'update-ref', 'refs/heads/master', 'HEAD~10')
+    index = commits.load_index(workdir, 'repo')
+    assert len(index) == 25
+    assert index.heads == [[index.commit(-1), 25]]
+
+
+def test_parse_shortstat():
+    assert commits.parse_shortstat(b'') == (None, None)
+    assert commits.parse_shortstat(
+        b' 2 files changed, 3 insertions(+), 1 deletion(-)') == (3, 1)
+    assert commits.parse_shortstat(
+        b' 1 file changed, 1 insertion(+)') == (1, None)
+    assert commits.parse_shortstat(
+        b' 1 file changed, 4 deletions(-)') == (None, 4)
+
+
+def test_load_invalid(tmp_path):
+    path = tmp_path / 'index'
+    assert len(commits.CommitIndex.load(str(path))) == 0
+
+    path.write_bytes(b'{"version": 1}\n')
+    assert len(commits.CommitIndex.load(str(path))) == 0
+
+    index = commits.CommitIndex()
+    index.add('ab' * 20, 'cd' * 20, 100, 'a', 1, None, 2)
+    index.save(str(path))
+    path.write_bytes(path.read_bytes()[:-3])
+    assert len(commits.CommitIndex.load(str(path))) == 0
@@ -2,6 +2,8 @@ import configparser
 import os
 import tempfile
 
+import pytest
+
 from . import config, utils
 
 
@@ -43,3 +45,53 @@ def test_repositories():
                 'site': 'http://example.com/',
             },
         }
+
+
+def test_parse_interval():
+    assert config.parse_interval('90') == 90
+    assert config.parse_interval(' 15m ') == 15 * 60
+    assert config.parse_interval('1.5H') == 90 * 60
+    assert config.parse_interval('2d') == 2 * 24 * 60 * 60
+    with pytest.raises(ValueError):
+        config.parse_interval('soon')
+
+
+def test_refresh_interval():
+    with tempfile.NamedTemporaryFile() as fh:
+        fh.write(b"""
+        [GLOBAL]
+        refresh_interval = 10m
+        """)
+        fh.flush()
+        conf = config.Config(config_path=fh.name)
+        assert conf.refresh_interval({'interval': '30'}) == 30
+        assert conf.refresh_interval({}) == 600
+
+        fh.seek(0)
+        fh.truncate()
+        fh.write(b"[GLOBAL]\n")
+        fh.flush()
+        assert conf.refresh_interval({}) == 600
+        conf.reload()
+        assert conf.refresh_interval({}) == 60 * 60
+
+
+def test_listen_address():
+    with tempfile.NamedTemporaryFile() as fh:
+        fh.write(b"[GLOBAL]\n")
+        fh.flush()
+        conf = config.Config(config_path=fh.name)
+        assert conf.listen_address() is None
+        assert conf.notify_delay() == 5
+
+        for listen, address in [('8050', ('127.0.0.1', 8050)),
+                                ('0.0.0.0:80', ('0.0.0.0', 80)),
+                                ('[::1]:8050', ('::1', 8050))]:
+            fh.seek(0)
+            fh.truncate()
+            fh.write(f'[GLOBAL]\nlisten = {listen}\n'
+                     'notify_delay = 1m\n'.encode())
+            fh.flush()
+            conf.reload()
+            assert conf.listen_address() == address
+            assert conf.notify_delay() == 60
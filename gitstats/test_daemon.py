@@ -0,0 +1,196 @@
+import json
+import threading
+import time
+from multiprocessing.dummy import Pool
+from tempfile import NamedTemporaryFile as tf, TemporaryDirectory as td
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+import pytest
+
+from . import config, daemon, gitstats, listener
+
+gitstats.Pool = Pool
+
+
+@pytest.fixture()
+def stats():
+    with td(prefix='gitstats') as d, tf(prefix='gitstats') as f:
+        f.write(f"""
+        [GLOBAL]
+        workdir = {d}
+        refresh_interval = 1h
+        notify_delay = 5s
+
+        [REPOSITORIES]
+        repo1 =
+            clone: https://a-git.repo/repo1
+            interval: 1m
+        repo2 = clone: https://a-git.repo/repo2
+        """.encode())
+        f.flush()
+
+        yield gitstats.GitStats(config.Config(config_path=f.name))
+
+
+def test_cycle(stats, mocker):
+    refs = {'repo1': 'a', 'repo2': 'b'}
+    remote_refs = mocker.patch.object(
+        stats, 'remote_refs',
+        side_effect=lambda repos: {name: refs[name] for name in repos}
+    )
+    run = mocker.patch.object(stats, 'run', side_effect=lambda names: {
+        name: {} for name in names
+    })
+    service = daemon.Daemon(stats)
+
+    # every repo is checked and run first
+    assert 0 < service.cycle(now=1000) <= 1000 + 60
+    assert set(remote_refs.call_args.args[0]) == {'repo1', 'repo2'}
+    run.assert_called_once_with({'repo1', 'repo2'})
+    assert service.due == {'repo1': 1060, 'repo2': 1000 + 3600}
+
+    # nothing is due
+    service.cycle(now=1030)
+    assert remote_refs.call_count == 1
+
+    # only the repos of changed refs are run, at their own interval
+    refs['repo1'] = 'c'
+    service.cycle(now=1060)
+    assert set(remote_refs.call_args.args[0]) == {'repo1'}
+    run.assert_called_with({'repo1'})
+    refs['repo2'] = None
+    service.cycle(now=5000)
+    assert set(remote_refs.call_args.args[0]) == {'repo1', 'repo2'}
+    assert run.call_count == 2
+
+    # the refs of the last runs are kept across restarts
+    assert daemon.Daemon(stats).remotes == {'repo1': 'c', 'repo2': 'b'}
+
+
+def test_cycle_failed_update(stats, mocker):
+    mocker.patch.object(stats, 'remote_refs',
+                        return_value={'repo1': 'a', 'repo2': 'b'})
+    run = mocker.patch.object(stats, 'run', return_value={'repo2': {}})
+    service = daemon.Daemon(stats)
+
+    service.cycle(now=1000)
+    service.cycle(now=1060)
+    run.assert_called_with({'repo1'})
+
+
+def test_notify(stats, mocker):
+    refs = {'repo1': 'a', 'repo2': 'b'}
+    mocker.patch.object(stats, 'remote_refs',
+                        side_effect=lambda repos: {name: refs[name]
+                                                   for name in repos})
+    run = mocker.patch.object(stats, 'run', side_effect=lambda names: {
+        name: {} for name in names
+    })
+    service = daemon.Daemon(stats)
+    service.cycle(now=1000)
+    wake = mocker.spy(service, 'wake')
+
+    assert not service.notify('unknown', now=1010)
+    # a burst of notifications is one update after the delay
+    assert service.notify('repo2', now=1010)
+    assert service.notify('repo2', now=1012)
+    wake.assert_called_with()
+    assert service.cycle(now=1012) <= 3
+    assert run.call_count == 1
+    assert service.cycle(now=1015) <= 60
+    # updated although its refs and interval say otherwise
+    run.assert_called_with({'repo2'})
+    assert service.due['repo2'] == 1015 + 3600
+    assert service.pending == {}
+    service.cycle(now=1020)
+    assert run.call_count == 2
+
+    # refs are not lost if the remote cannot be listed
+    refs['repo2'] = None
+    service.notify('repo2', now=1020)
+    service.cycle(now=1025)
+    assert run.call_count == 3
+    assert service.remotes['repo2'] == 'b'
+
+
+def request(address, path):
+    host, port = address
+    try:
+        with urlopen(Request(f'http://{host}:{port}{path}',
+                             method='POST')) as resp:
+            return resp.status, json.load(resp)
+    except HTTPError as e:
+        return e.code, json.load(e)
+
+
+def test_listener(stats, mocker):
+    service = daemon.Daemon(stats)
+    wake = mocker.spy(service, 'wake')
+
+    with listener.Listener(service, ('127.0.0.1', 0)) as server:
+        assert request(server.address, '/refresh/repo1') == (
+            202, {'repo': 'repo1'})
+        assert request(server.address, '/refresh/repo1?ref=main') == (
+            202, {'repo': 'repo1'})
+        assert request(server.address, '/refresh/other') == (
+            404, {'error': 'unknown repo "other"'})
+        assert request(server.address, '/refresh/')[0] == 404
+        assert request(server.address, '/repo1')[0] == 404
+
+    assert list(service.pending) == ['repo1']
+    assert wake.call_count == 2
+    assert not server.thread.is_alive()
+
+
+def test_serve(stats, mocker):
+    service = daemon.Daemon(stats)
+    cycles = []
+
+    def cycle():
+        cycles.append(stats._warm_pool)
+        if len(cycles) == 1:
+            raise RuntimeError('failed')
+        if len(cycles) == 3:
+            service.stop()
+        return 3600
+
+    mocker.patch.object(service, 'cycle', side_effect=cycle)
+    # the listener is optional
+    assert stats.config.listen_address() is None
+    thread = threading.Thread(target=service.serve)
+    thread.start()
+    # failed cycles are retried later, woken up cycles run right away
+    while thread.is_alive() and len(cycles) < 3:
+        service.wake()
+        time.sleep(0.01)
+    thread.join(5)
+
+    assert not thread.is_alive()
+    assert len(cycles) == 3
+    assert cycles[0] is not None and cycles[0] is cycles[2]
+    assert stats._warm_pool is None
+
+
+def test_serve_notified(stats, mocker):
+    mocker.patch.object(stats, 'remote_refs', return_value={})
+    run = mocker.patch.object(stats, 'run', return_value={})
+    mocker.patch.object(stats.config, 'notify_delay', return_value=0)
+    service = daemon.Daemon(stats)
+    listen = mocker.patch.object(stats.config, 'listen_address',
+                                 return_value=('127.0.0.1', 0))
+    server = mocker.spy(daemon, 'Listener')
+
+    thread = threading.Thread(target=service.serve)
+    thread.start()
+    while not server.spy_return:
+        time.sleep(0.01)
+    assert request(server.spy_return.address, '/refresh/repo2')[0] == 202
+    while not run.called or run.call_args.args[0] != {'repo2'}:
+        time.sleep(0.01)
+    service.stop()
+    thread.join(5)
+
+    assert not thread.is_alive()
+    listen.assert_called_once_with()
+    assert not server.spy_return.thread.is_alive()
@@ -6,7 +6,7 @@ from tempfile import NamedTemporaryFile as tf, TemporaryDirectory as td
 
 import pytest
 
-from . import gitstats, config, collectors, utils
+from . import gitstats, config, collectors, ownership, trees, utils
 
 gitstats.Pool = Pool
 
@@ -34,6 +34,41 @@ def stat():
         }
 
 
+def tree_index(mocker, *ls_trees):
+    """
+    Patch the tree indexes of the repos to hold the files of `ls-tree -r -l
+    -z` outputs, one per repo in the order loaded, the last one repeated
+    """
+    indexes = []
+    for output in ls_trees:
+        index = trees.TreeIndex()
+        for line in output.split('\0'):
+            if line:
+                meta, _, fname = line.partition('\t')
+                mode, _, revision, *size = meta.split()
+                size = int(size[0]) if size and size[0].isdigit() else 0
+                index.files[fname] = [mode, revision, size, 0]
+        indexes.append(index)
+
+    return mocker.patch.object(trees, 'load_index', side_effect=lambda w, r: (
+        indexes.pop(0) if len(indexes) > 1 else indexes[0]
+    ))
+
+
+def run_stages(gs, stages, repos=('repo1', 'repo2')):
+    """
+    Run the stages of the repos on their clones through GitStats.run(), the
+    repos are in repos.json at HEAD `h` unless there already
+    """
+    prev = {r['name']: r for r in gs.load_data('repos.json') or []}
+    for repo in repos:
+        os.makedirs(os.path.join(gs.repos_dir, repo), exist_ok=True)
+        prev.setdefault(repo, {'name': repo, 'HEAD': 'h'})
+    gs.save_data(list(prev.values()), 'repos.json')
+    gs.run(repos, stages)
+    assert not gs.scheduler.failed
+
+
 def test_repos_dir(stat):
     assert stat['cls'].repos_dir == stat['workdir'] + '/repos'
 
@@ -107,46 +142,197 @@ def test_run(stat, mocker):
 
     gs = stat['cls']
 
-    methods = [
-        'update_repos',
-        'repo_summary',
-        'repo_lines',
-        'repo_activity',
-        'repo_files_history',
-        'repo_tags',
-        'repo_branches',
-        'repo_blame',
-    ]
-    for m in methods:
-        mocker.spy(gs, m)
-
     gs.run()
 
-    for m in methods:
-        assert getattr(gs, 'update_repos').call_count == 1
-
     data = gs.load_data('last_update.json')
 
     end = int(datetime.utcnow().timestamp())
 
     assert start <= data['last_updated'] <= end
 
+    metrics = gs.load_data('metrics.json')
+    assert set(metrics['stages']) == {
+        'update', 'summary', 'lines', 'lines-history', 'activity',
+        'files-history', 'tags', 'branches', 'blame',
+    }
+    assert len(gs.load_data('metrics-history.json')) == 1
+    assert 'compress' in metrics['caches']
+
+    manifest = gs.load_data('manifest.json')
+    assert manifest['repos.json'] == utils.content_hash(
+        json.dumps(gs.load_data('repos.json')).encode())
+    assert 'last_update.json' in manifest
+
+
+def run_collectors(mocker):
+    """
+    Patch the collectors of a run to record their calls as (stage, repo)
+    """
+    calls = []
+
+    def collector(name, result):
+        def func(workdir, arg):
+            repo = arg[0] if isinstance(arg, tuple) else arg
+            calls.append((name, repo))
+            return {'repo': repo, **result}
+        return func
+
+    mocker.patch.object(collectors, 'update_repo', side_effect=lambda w, r: (
+        calls.append(('update', r[0])) or {'name': r[0], 'HEAD': 'h'}
+    ))
+    mocker.patch.object(collectors, 'summary', collector('summary', {
+        'data': [{'key': 'authors', 'value': 0}],
+    }))
+    mocker.patch.object(collectors, 'count_lines',
+                        collector('lines', {'data': {}, 'cache': {
+                            'hits': 1, 'misses': 2}}))
+    mocker.patch.object(collectors, 'lines_history', collector(
+        'lines-history', {'data': {}, 'cache': {'hits': 0, 'misses': 1}}
+    ))
+    mocker.patch.object(collectors, 'activity_since', collector('activity', {
+        'since': None, 'HEAD': 'h', 'data': {'by_authors': {'a': 1}},
+        'revisions': [{'revision': 'h'}],
+    }))
+    mocker.patch.object(collectors, 'files_history', collector(
+        'files-history', {'HEAD': 'h', 'data': {'h': []}}
+    ))
+    mocker.patch.object(collectors, 'get_tags',
+                        collector('tags', {'tags': []}))
+    mocker.patch.object(collectors, 'get_branches',
+                        collector('branches', {'branches': []}))
+    mocker.patch.object(utils, 'git', return_value='')
+    tree_index(mocker, '')
+    return calls
+
+
+def test_run_scheduled(stat, mocker):
+    gs = stat['cls']
+    calls = run_collectors(mocker)
 
-def test_update_repos(stat, mocker):
-    _tmp = collectors.update_repo
+    gs.run()
 
-    collectors.update_repo = mocker.Mock()
-    collectors.update_repo.side_effect = [
-        {'name': 'repo1', 'HEAD': 'repo1'},
-        {'name': 'repo2', 'HEAD': 'repo2'},
-    ]
+    for repo in ('repo1', 'repo2'):
+        stages = [name for name, r in calls if r == repo]
+        assert sorted(stages) == sorted([
+            'update', 'summary', 'lines', 'lines-history', 'activity',
+            'files-history', 'tags', 'branches',
+        ])
+        assert stages[0] == 'update'
+        assert stages.index('summary') < stages.index('activity')
+        assert stages.index('activity') < stages.index('files-history')
+
+        # activity corrected the number of authors of the summary
+        assert gs.load_data('summary.json', repo) == [
+            {'key': 'authors', 'value': 1},
+        ]
+        assert gs.load_data('files-history.json', repo) == {'h': []}
+        assert gs.load_data('authors.json', repo) == {
+            'lines': {}, 'files': {},
+        }
 
+    assert {r['name'] for r in gs.load_data('repos.json')} == {
+        'repo1', 'repo2',
+    }
+    assert gs.scheduler.done >= {('update', 'repo1'), 'repos'}
+    assert not gs.scheduler.failed
+
+
+def test_run_stages(stat, mocker):
+    gs = stat['cls']
+    calls = run_collectors(mocker)
+    gs.save_data([{'name': 'repo1', 'HEAD': 'h1'},
+                  {'name': 'repo2', 'HEAD': 'h2'}], 'repos.json')
+    os.makedirs(os.path.join(gs.repos_dir, 'repo1'))
+    gs.save_data([{'key': 'authors', 'value': 0}], 'summary.json', 'repo1')
+
+    gs.run(stages=['activity', 'files-history'])
+
+    # repo1 is neither updated nor summarized, it has a clone and a summary
+    assert sorted(name for name, r in calls if r == 'repo1') == [
+        'activity', 'files-history']
+    assert sorted(name for name, r in calls if r == 'repo2') == [
+        'activity', 'files-history', 'summary', 'update']
+    for repo in ('repo1', 'repo2'):
+        assert gs.load_data('files-history.json', repo) == {'h': []}
+        for fname in ('tags.json', 'lines.json', 'authors.json'):
+            assert gs.load_data(fname, repo) is None
+    assert gs.load_data('summary.json', 'repo1') == [
+        {'key': 'authors', 'value': 1}]
+    assert {r['name']: r['HEAD'] for r in gs.load_data('repos.json')} == {
+        'repo1': 'h1', 'repo2': 'h'}
+    assert not gs.scheduler.failed
+
+    # the files history is walked on its own from the previous HEAD
+    calls.clear()
+    gs.config.force = False
+    files_history = mocker.spy(collectors, 'files_history')
+    gs.run(['repo1'], ['files-history'])
+    assert calls == [('files-history', 'repo1')]
+    assert files_history.call_args.args[1] == ('repo1', 'h', {'h': []})
+
+
+def test_run_names(stat, mocker):
     gs = stat['cls']
-    gs.update_repos()
+    update_repo = mocker.patch.object(
+        collectors, 'update_repo',
+        side_effect=lambda w, r: {'name': r[0], 'HEAD': 'h'} if r[0] == 'repo2'
+        else {}
+    )
+    gs.save_data([{'name': 'repo1', 'HEAD': 'h1'}], 'repos.json')
+    mocker.patch.object(gs, '_is_changed', return_value=False)
+
+    assert gs.run({'repo2', 'repo3'}) == {
+        'repo2': {'name': 'repo2', 'HEAD': 'h',
+                  'clone': 'https://a-git.repo/repo2'},
+    }
+    update_repo.assert_called_once_with(
+        gs.repos_dir, ('repo2', 'https://a-git.repo/repo2', False))
+    assert {r['name'] for r in gs.load_data('repos.json')} == {
+        'repo1', 'repo2'}
+
 
-    assert gs.repos == ['repo1', 'repo2']
+def test_warm(stat, mocker):
+    gs = stat['cls']
+    load_blame_cache = mocker.spy(gs, '_load_blame_cache')
+    with gs.warm():
+        with gs.pool() as first, gs.pool() as second:
+            assert first is second
+        assert first._state == 'RUN'
+        assert gs._blame_context()['cache'] is gs._blame_context()['cache']
+        assert gs.remote_refs({}) == {}
+    assert first._state != 'RUN'
+    assert load_blame_cache.call_count == 1
+    assert gs._blame_context()['cache'] is not None
+    assert load_blame_cache.call_count == 2
+
+
+def test_imap_metrics(stat):
+    gs = stat['cls']
 
-    collectors.update_repo = _tmp
+    with gs.metrics.stage('test'):
+        gs._stage = 'test'
+        results = list(gs.imap(dict, [{'repo': 'repo1'}, {'name': 'repo2'}]))
+
+    assert sorted(map(str, results)) == ["{'name': 'repo2'}",
+                                         "{'repo': 'repo1'}"]
+    data = gs.metrics.stages['test']
+    assert data['tasks'] == 2
+    assert set(data['repos']) == {'repo1', 'repo2'}
+    assert data['workers'] == gs.num_pools
+    assert 0 <= data['utilization'] <= 1
+
+
+def test_repo_origin(stat):
+    gs = stat['cls']
+    conf = {'clone': 'url'}
+    assert gs._repo_origin('repo1', conf) == ('repo1', 'url', False)
+    assert gs._repo_origin('repo1', {**conf, 'storage': 'mirror'}) == (
+        'repo1', 'url', True)
+
+    gs.config.config['GLOBAL']['storage'] = 'mirror'
+    assert gs._repo_origin('repo1', conf) == ('repo1', 'url', True)
+    assert gs._repo_origin('repo1', {**conf, 'storage': 'worktree'}) == (
+        'repo1', 'url', False)
 
 
 def test_summary(stat, mocker):
@@ -159,8 +345,7 @@ def test_summary(stat, mocker):
     ]
 
     gs = stat['cls']
-    gs.repos = ['repo1', 'repo2']
-    gs.repo_summary()
+    run_stages(gs, ['summary'])
 
     assert gs.load_data('summary.json', 'repo1') == 'data1'
     assert gs.load_data('summary.json', 'repo2') == 'data2'
@@ -169,30 +354,163 @@ def test_summary(stat, mocker):
 
 
 def test_activity(stat, mocker):
-    _tmp = collectors.activity
+    _tmp = collectors.activity_since
 
     data1 = {'by_authors': {'nasim': {}}}
     data2 = {'by_authors': {'someone': {}}}
-    collectors.activity = mocker.Mock()
-    collectors.activity.side_effect = [
-        {'repo': 'repo1', 'data': data1, 'revisions': ['r1', 'r2']},
-        {'repo': 'repo2', 'data': data2, 'revisions': ['r3']},
+    collectors.activity_since = mocker.Mock()
+    collectors.activity_since.side_effect = [
+        {'repo': 'repo1', 'data': data1, 'revisions': ['r1', 'r2'],
+         'HEAD': 'h1', 'since': None},
+        {'repo': 'repo2', 'data': data2, 'revisions': ['r3'],
+         'HEAD': 'h2', 'since': None},
     ]
 
     gs = stat['cls']
-    gs.repos = ['repo1', 'repo2']
     gs.save_data([{'key': 'authors', 'value': 0}], 'summary.json', 'repo1')
     gs.save_data([], 'summary.json', 'repo2')
-    revs = gs.repo_activity()
+    run_stages(gs, ['activity'])
 
     assert gs.load_data('activity.json', 'repo1') == data1
     assert gs.load_data('activity.json', 'repo2') == data2
+    assert gs.load_data('activity-state.json', 'repo1') == {'HEAD': 'h1'}
+    assert gs.load_data('activity-state.json', 'repo2') == {'HEAD': 'h2'}
     assert gs.load_data('summary.json', 'repo1') == [{'key': 'authors',
                                                       'value': 1}]
     assert gs.load_data('summary.json', 'repo2') == []
-    assert revs == {'repo1': ['r1', 'r2'], 'repo2': ['r3']}
+    collectors.activity_since.assert_any_call(
+        gs.repos_dir, ('repo1', None))
+
+    collectors.activity_since = _tmp
+
+
+def test_activity_incremental(stat, mocker):
+    _tmp = collectors.activity_since
+
+    old = {
+        'by_time': {'yearly': {'commits': {'2018': 2}}},
+        'hour_of_week': {'0': {'22': 2}},
+        'by_authors': {'nasim': {'yearly': {'commits': {'2018': 2}}}},
+        'authors_age': {
+            'nasim': {'first_commit': 1, 'last_commit': 2, 'days': 1},
+        },
+    }
+    delta = {
+        'by_time': {'yearly': {'commits': {2018: 1}}},
+        'hour_of_week': {1: {3: 1}},
+        'by_authors': {'someone': {'yearly': {'commits': {2018: 1}}}},
+        'authors_age': {
+            'someone': {'first_commit': 3, 'last_commit': 3, 'days': 0},
+        },
+    }
+    collectors.activity_since = mocker.Mock()
+    collectors.activity_since.side_effect = [
+        {'repo': 'repo1', 'data': delta, 'revisions': ['r3'],
+         'HEAD': 'h2', 'since': 'h1'},
+    ]
+
+    gs = stat['cls']
+    gs.config.force = False
+    gs.save_data(old, 'activity.json', 'repo1')
+    gs.save_data({'HEAD': 'h1'}, 'activity-state.json', 'repo1')
+    gs.save_data([{'key': 'authors', 'value': 1}], 'summary.json', 'repo1')
+
+    run_stages(gs, ['activity'], ['repo1'])
+    collectors.activity_since.assert_called_once_with(
+        gs.repos_dir, ('repo1', 'h1'))
+
+    assert gs.load_data('activity.json', 'repo1') == {
+        'by_time': {'yearly': {'commits': {'2018': 3}}},
+        'hour_of_week': {'0': {'22': 2}, '1': {'3': 1}},
+        'by_authors': {
+            'nasim': {'yearly': {'commits': {'2018': 2}}},
+            'someone': {'yearly': {'commits': {'2018': 1}}},
+        },
+        'authors_age': {
+            'nasim': {'first_commit': 1, 'last_commit': 2, 'days': 1},
+            'someone': {'first_commit': 3, 'last_commit': 3, 'days': 0},
+        },
+    }
+    assert gs.load_data('activity-state.json', 'repo1') == {'HEAD': 'h2'}
+    assert gs.load_data('summary.json', 'repo1') == [{'key': 'authors',
+                                                      'value': 2}]
+
+    collectors.activity_since = _tmp
+
+
+def test_activity_shards(stat, mocker):
+    series = {
+        'yearly': {'commits': {'2018': 2}},
+        'monthly': {'commits': {'2018-01': 2}},
+        'daily': {'commits': {'2018-01-01': 2}},
+    }
+    data = {
+        'by_time': {'yearly': {'commits': {'2018': 2}}},
+        'hour_of_week': {'0': {'22': 2}},
+        'by_authors': {'nasim': series},
+        'authors_age': {
+            'nasim': {'first_commit': 1, 'last_commit': 2, 'days': 1},
+        },
+    }
+    delta = {
+        'by_time': {'yearly': {'commits': {2018: 1}}},
+        'hour_of_week': {1: {3: 1}},
+        'by_authors': {'someone': {'yearly': {'commits': {2018: 1}}}},
+        'authors_age': {
+            'someone': {'first_commit': 3, 'last_commit': 3, 'days': 0},
+        },
+    }
+    mocker.patch.object(collectors, 'activity_since', side_effect=[
+        {'repo': 'repo1', 'data': data, 'revisions': [], 'HEAD': 'h1',
+         'since': None},
+        {'repo': 'repo1', 'data': delta, 'revisions': [], 'HEAD': 'h2',
+         'since': 'h1'},
+    ])
+
+    gs = stat['cls']
+    gs.config.config.set('GLOBAL', 'activity_shards', 'yes')
+    gs.config.force = False
+    nasim, someone = gitstats.author_id('nasim'), gitstats.author_id('someone')
+    gs.save_data([{'key': 'authors', 'value': 1}], 'summary.json', 'repo1')
+
+    run_stages(gs, ['activity'], ['repo1'])
+    assert gs.load_data('activity.json', 'repo1') == {
+        'by_time': data['by_time'],
+        'hour_of_week': data['hour_of_week'],
+        'authors_age': data['authors_age'],
+        'authors': {'nasim': nasim},
+    }
+    assert gs.load_data(f'{nasim}.json', 'repo1/authors') == series
+    assert gs.load_data('index.json', 'repo1/authors') == {
+        'nasim': {'yearly': series['yearly'], 'monthly': series['monthly']},
+    }
+
+    # only the shards of the new authors are read and written
+    load_data = mocker.spy(gs, 'load_data')
+    save_data = mocker.spy(gs, 'save_data')
+    run_stages(gs, ['activity'], ['repo1'])
+    loaded = [call.args[0] for call in load_data.call_args_list]
+    assert f'{nasim}.json' not in loaded
+    saved = [call.args[1] for call in save_data.call_args_list]
+    assert f'{someone}.json' in saved
+    assert f'{nasim}.json' not in saved
+
+    activity = gs.load_data('activity.json', 'repo1')
+    assert activity['authors'] == {'nasim': nasim, 'someone': someone}
+    assert activity['by_time'] == {'yearly': {'commits': {'2018': 3}}}
+    assert gs.load_data('index.json', 'repo1/authors') == {
+        'nasim': {'yearly': series['yearly'], 'monthly': series['monthly']},
+        'someone': {'yearly': {'commits': {'2018': 1}}},
+    }
+    assert gs.load_data('summary.json', 'repo1') == [{'key': 'authors',
+                                                      'value': 2}]
 
-    collectors.activity = _tmp
+    # merged back into activity.json when sharding is turned off
+    gs.config.config.set('GLOBAL', 'activity_shards', 'no')
+    assert gs._load_activity('repo1')['by_authors'] == {
+        'nasim': series,
+        'someone': {'yearly': {'commits': {'2018': 1}}},
+    }
 
 
 def test_repo_lines(stat, mocker):
@@ -200,170 +518,179 @@ def test_repo_lines(stat, mocker):
 
     collectors.count_lines = mocker.Mock()
     collectors.count_lines.side_effect = [
-        {'repo': 'repo1', 'data': 'data1'},
-        {'repo': 'repo2', 'data': 'data2'},
+        {'repo': 'repo1', 'data': 'data1',
+         'cache': {'hits': 1, 'misses': 2}},
+        {'repo': 'repo2', 'data': 'data2',
+         'cache': {'hits': 3, 'misses': 0}},
     ]
 
     gs = stat['cls']
-    gs.repos = ['repo1', 'repo2']
-    gs.repo_lines()
+    run_stages(gs, ['lines'])
 
     assert gs.load_data('lines.json', 'repo1') == 'data1'
     assert gs.load_data('lines.json', 'repo2') == 'data2'
+    assert gs.metrics.caches['lines'] == {'hits': 4, 'misses': 2}
 
     collectors.count_lines = _tmp
 
 
+def test_repo_lines_history(stat, mocker):
+    lines_history = mocker.patch.object(collectors, 'lines_history')
+    lines_history.side_effect = [
+        {'repo': 'repo1', 'data': 'data1', 'cache': {'hits': 1, 'misses': 2}},
+        {'repo': 'repo1', 'data': 'data2', 'cache': {'hits': 3, 'misses': 0}},
+    ]
+
+    gs = stat['cls']
+    gs.config.force = False
+    run_stages(gs, ['lines-history'], ['repo1'])
+    lines_history.assert_called_with(gs.repos_dir, ('repo1', None))
+    assert gs.load_data('lines-history.json', 'repo1') == 'data1'
+
+    # the saved history is passed to be extended
+    run_stages(gs, ['lines-history'], ['repo1'])
+    lines_history.assert_called_with(gs.repos_dir, ('repo1', 'data1'))
+    assert gs.load_data('lines-history.json', 'repo1') == 'data2'
+    assert gs.metrics.caches['lines-history'] == {'hits': 4, 'misses': 2}
+
+
 def test_repo_branches(stat, mocker):
-    _tmp1 = collectors.get_branches
-    _tmp2 = collectors.get_timestamp
+    _tmp = collectors.get_branches
 
     collectors.get_branches = mocker.Mock()
     collectors.get_branches.side_effect = [
-        {'repo': 'repo1', 'data': 'data1', 'branches': []},
-        {'repo': 'repo2', 'data': 'data2', 'branches': ['b1']},
-    ]
-
-    collectors.get_timestamp = mocker.Mock()
-    collectors.get_timestamp.side_effect = [
-        {'timestamp': 123456},
+        {'repo': 'repo1', 'branches': []},
+        {'repo': 'repo2', 'branches': [{'timestamp': 123456,
+                                        'revision': 'b1'}]},
     ]
 
     gs = stat['cls']
-    gs.repos = ['repo1', 'repo2']
-    gs.repo_branches()
+    run_stages(gs, ['branches'])
 
     assert gs.load_data('branches.json', 'repo1') == []
-    assert gs.load_data('branches.json', 'repo2') == [{'timestamp': 123456}]
+    assert gs.load_data('branches.json', 'repo2') == [{'timestamp': 123456,
+                                                       'revision': 'b1'}]
 
-    collectors.get_branches = _tmp1
-    collectors.get_timestamp = _tmp2
+    collectors.get_branches = _tmp
 
 
 def test_repo_file_history(stat, mocker):
-    _tmp = collectors.num_files
+    _tmp = collectors.files_history
 
-    collectors.num_files = mocker.Mock()
-    collectors.num_files.side_effect = [
-        {'data': 'data1'},
-        {'data': 'data2'},
+    collectors.files_history = mocker.Mock()
+    collectors.files_history.side_effect = [
+        {'repo': 'repo1', 'HEAD': 'h1', 'data': {'r1': 'data1'}},
+        {'repo': 'repo2', 'HEAD': 'h2', 'data': {'r2': 'data2'}},
     ]
 
-    revs = {
-        'repo1': {'revision': 'r1'},
-        'repo2': {'revision': 'r2'},
-    }
-
     gs = stat['cls']
-    gs.repos = ['repo1', 'repo2']
-    gs.repo_files_history(revs)
+    run_stages(gs, ['files-history'])
 
-    assert gs.load_data('files-history.json', 'repo1') == {'data': 'data1'}
-    assert gs.load_data('files-history.json', 'repo2') == {'data': 'data2'}
+    assert gs.load_data('files-history.json', 'repo1') == {'r1': 'data1'}
+    assert gs.load_data('files-history.json', 'repo2') == {'r2': 'data2'}
+    assert gs.load_data('files-history-state.json', 'repo1') == {
+        'HEAD': 'h1'}
+    collectors.files_history.assert_any_call(gs.repos_dir,
+                                             ('repo1', None, {}))
 
-    collectors.num_files = _tmp
+    collectors.files_history = _tmp
 
 
 def test_repo_file_history_cache(stat, mocker):
-    _tmp = collectors.num_files
+    _tmp = collectors.files_history
 
-    collectors.num_files = mocker.Mock()
-    collectors.num_files.side_effect = [
-        {'data': 'data'},
+    collectors.files_history = mocker.Mock()
+    collectors.files_history.side_effect = [
+        {'repo': 'repo2', 'HEAD': 'h2', 'data': {'r3': 'data'}},
     ]
 
     revs = {
         'repo1': [{'revision': 'r1'}],
-        'repo2': [{'revision': 'r2'}],
+        'repo2': [{'revision': 'r3'}],
     }
 
     fname = 'files-history.json'
     gs = stat['cls']
+    gs.config.force = False
 
-    gs.repos = ['repo1', 'repo2']
     gs.save_data({'r1': 'old_data'}, fname, 'repo1')
+    gs.save_data({'r2': 'old_data'}, fname, 'repo2')
+    gs.save_data({'HEAD': 'h1'}, 'files-history-state.json', 'repo2')
+    for repo in ('repo1', 'repo2'):
+        gs.save_data([], 'summary.json', repo)
+    mocker.patch.object(
+        collectors, 'activity_since', side_effect=lambda w, r: {
+            'repo': r[0], 'data': {'by_authors': {}},
+            'revisions': revs[r[0]], 'HEAD': 'h', 'since': None,
+        }
+    )
 
-    gs.repo_files_history(revs)
+    run_stages(gs, ['activity', 'files-history'])
 
     assert gs.load_data(fname, 'repo1') == {'r1': 'old_data'}
-    assert gs.load_data(fname, 'repo2') == {'data': 'data'}
+    assert gs.load_data(fname, 'repo2') == {'r2': 'old_data', 'r3': 'data'}
+    collectors.files_history.assert_called_once_with(
+        gs.repos_dir, ('repo2', 'h1', {'r2': 'old_data'}))
+
+    # the whole history is walked again if forced
+    gs.config.force = True
+    assert gs._files_history_state('repo2', revs['repo2']) == (
+        'repo2', None, {})
 
-    collectors.num_files = _tmp
+    collectors.files_history = _tmp
 
 
 def test_repo_tags(stat, mocker):
-    _tmp1 = collectors.get_tags
-    _tmp2 = collectors.get_timestamp
-    _tmp3 = utils.run_git
+    _tmp = collectors.get_tags
 
+    tags = [
+        {
+            'authors': [{'author': 'author1', 'commits': 15}],
+            'commits': 15,
+            'revision': 't2',
+            'tag': 'v2',
+            'timestamp': 234567,
+        },
+        {
+            'authors': [],
+            'commits': 0,
+            'revision': 't1',
+            'tag': 'v1',
+            'timestamp': 123456,
+        },
+    ]
     collectors.get_tags = mocker.Mock()
     collectors.get_tags.side_effect = [
         {'repo': 'repo1', 'tags': []},
-        {'repo': 'repo2', 'tags': [{'revision': 't1'}, {'revision': 't2'}]}
-    ]
-    collectors.get_timestamp = mocker.Mock()
-    collectors.get_timestamp.side_effect = [
-        {'revision': 't1', 'timestamp': 123456},
-        {'revision': 't2', 'timestamp': 234567},
-    ]
-    utils.run_git = mocker.Mock()
-    utils.run_git.side_effect = [
-        '15\tauthor1\n20\tauthor3',
-        '5\tauthor1\n10\tauthor2',
+        {'repo': 'repo2', 'tags': tags},
     ]
 
     fname = 'tags.json'
     gs = stat['cls']
 
-    gs.repos = ['repo1', 'repo2']
-
-    gs.repo_tags()
+    run_stages(gs, ['tags'])
 
     assert gs.load_data(fname, 'repo1') == []
-    assert gs.load_data(fname, 'repo2') == [
-        {
-            'authors': [
-                {'author': 'author1', 'commits': 15},
-                {'author': 'author3', 'commits': 20},
-            ],
-            'revision': 't2',
-            'timestamp': 234567,
-        },
-        {
-            'authors': [
-                {'author': 'author1', 'commits': 5},
-                {'author': 'author2', 'commits': 10},
-            ],
-            'revision': 't1',
-            'timestamp': 123456,
-        },
-    ]
+    assert gs.load_data(fname, 'repo2') == tags
 
-    collectors.get_tags = _tmp1
-    collectors.get_timestamp = _tmp2
-    utils.run_git = _tmp3
+    collectors.get_tags = _tmp
 
 
 def test_repo_blame(stat, mocker):
     _tmp1 = collectors.get_blame
-    _tmp2 = utils.run_git
 
     collectors.get_blame = mocker.Mock()
     collectors.get_blame.side_effect = [
         {'authors': {'author1': 10, 'author2': 20}, 'file': 'f1'},
         {'authors': {}, 'file': 'f2'},
     ]
-    utils.run_git = mocker.Mock()
-    utils.run_git.side_effect = [
-        '10644 blob rev1 f1',
-        '10644 blob rev2 f2',
-    ]
+    tree_index(mocker,
+               '10644 blob rev1\tf1\0',
+               '10644 blob rev2\tf2\0')
 
     gs = stat['cls']
 
-    gs.repos = ['repo1', 'repo2']
-
-    gs.repo_blame()
+    run_stages(gs, ['blame'])
 
     assert gs.load_data('files-authors.json', 'repo1') == {
         'f1': {
@@ -381,23 +708,267 @@ def test_repo_blame(stat, mocker):
     }
     assert gs.load_data('authors.json', 'repo2') == {'files': {}, 'lines': {}}
 
-    collectors.get_tags = _tmp1
-    utils.run_git = _tmp2
+    collectors.get_blame = _tmp1
+
+
+def test_repo_blame_shared_blob_cache(stat, mocker):
+    _tmp1 = collectors.get_blame
+
+    collectors.get_blame = mocker.Mock()
+    collectors.get_blame.side_effect = [
+        {'authors': {'author1': 10}, 'file': 'f1'},
+        {'authors': {'author2': 5}, 'file': 'f3'},
+    ]
+    tree_index(mocker,
+               '100644 blob rev1\tf1\0',
+               '100644 blob rev1\tmoved/f1\x00100644 blob rev3\tf3\0')
+
+    gs = stat['cls']
+    run_stages(gs, ['blame'])
+
+    assert collectors.get_blame.call_count == 2
+    assert gs.load_data('files-authors.json', 'repo2') == {
+        'moved/f1': {'authors': {'author1': 10}, 'revision': 'rev1'},
+        'f3': {'authors': {'author2': 5}, 'revision': 'rev3'},
+    }
+    assert gs.metrics.caches['blame-blob'] == {'hits': 1, 'misses': 2}
+
+    cache = utils.LRUCache(os.path.join(gs.cache_dir, 'blame.json'))
+    assert cache.get('rev1') == {'author1': 10}
+    assert cache.get('rev3') == {'author2': 5}
+
+    collectors.get_blame = _tmp1
+
+
+def test_repo_blame_not_shared(stat, mocker):
+    _tmp1 = collectors.get_blame
+
+    stat['cfg'].config['GLOBAL']['detect_move'] = 'repo1'
+    collectors.get_blame = mocker.Mock()
+    collectors.get_blame.side_effect = [
+        {'authors': {'author1': 10}, 'file': 'f1'},
+        {'authors': {}, 'file': 'f2', 'failed': True},
+        {'authors': {}, 'file': 'f3'},
+        {'authors': {'author2': 5}, 'file': 'f1'},
+        {'authors': {'author3': 1}, 'file': 'f2'},
+        {'authors': {}, 'file': 'f3'},
+    ]
+    tree_index(mocker,
+               '100644 blob rev1\tf1\0',
+               '100644 blob rev2\tf2\x00100644 blob rev3\tf3\0',
+               '100644 blob rev1\tf1\x00100644 blob rev2\tf2\x00'
+               '100644 blob rev3\tf3\0')
+
+    gs = stat['cls']
+    gs.config.config['REPOSITORIES']['repo3'] = 'clone: repo3'
+    run_stages(gs, ['blame'])
+    assert len(utils.LRUCache(os.path.join(gs.cache_dir, 'blame.json'))) == 0
+
+    run_stages(gs, ['blame'], ['repo3'])
+
+    assert collectors.get_blame.call_count == 6
+    assert gs.load_data('files-authors.json', 'repo3') == {
+        'f1': {'authors': {'author2': 5}, 'revision': 'rev1'},
+        'f2': {'authors': {'author3': 1}, 'revision': 'rev2'},
+        'f3': {'authors': {}, 'revision': 'rev3'},
+    }
+    cache = utils.LRUCache(os.path.join(gs.cache_dir, 'blame.json'))
+    assert cache.get('rev1') == {'author2': 5}
+    assert cache.get('rev2') == {'author3': 1}
+    assert 'rev3' not in cache
+
+    collectors.get_blame = _tmp1
+
+
+def test_repo_blame_tracked(stat, mocker):
+    get_blame = mocker.patch.object(collectors, 'get_blame')
+    get_blame.side_effect = [
+        {'authors': {'a': 1}, 'file': 'f3', 'runs': [[1, 'a']]},
+        {'authors': {}, 'file': 'f4'},
+    ]
+    tree_index(mocker, '100644 blob rev2\tf1\x00100644 blob rev3\tf3'
+                       '\x00100644 blob rev4\tf4')
+    update = mocker.patch.object(ownership, 'update')
+    update.return_value = {
+        'f1': [[1, 'a'], [1, 'b']],
+        'f2': None,
+        'f3': None,
+        'f4': [[5, 'b']],
+    }
+    cat = mocker.patch.object(utils, 'cat_file')
+    cat.return_value.read.return_value = ('rev', 'blob', b'x\ny\n')
+
+    gs = stat['cls']
+    gs.config.force = False
+    gs.save_data([{'name': 'repo1', 'HEAD': 'h2'}], 'repos.json')
+    gs.save_data({'HEAD': 'h1'}, 'files-authors-state.json', 'repo1')
+    gs.save_data({
+        'f1': {'authors': {'a': 1}, 'revision': 'rev1', 'runs': [[1, 'a']]},
+        'f2': {'authors': {'a': 1}, 'revision': 'rev1', 'runs': [[1, 'a']]},
+    }, 'files-authors.json', 'repo1')
+    run_stages(gs, ['blame'], ['repo1'])
+
+    update.assert_called_once_with(gs.repos_dir, 'repo1', 'h1', 'h2', {
+        'f1': [[1, 'a']], 'f2': [[1, 'a']],
+    })
+    assert sorted(c[0][-1] for c in get_blame.call_args_list) == ['f3', 'f4']
+    assert gs.load_data('files-authors.json', 'repo1') == {
+        'f1': {'authors': {'a': 1, 'b': 1}, 'revision': 'rev2',
+               'runs': [[1, 'a'], [1, 'b']]},
+        'f3': {'authors': {'a': 1}, 'revision': 'rev3', 'runs': [[1, 'a']]},
+        'f4': {'authors': {}, 'revision': 'rev4'},
+    }
+    assert gs.load_data('files-authors-state.json', 'repo1') == {
+        'HEAD': 'h2'}
+    assert gs.metrics.caches['blame-tracked'] == {'hits': 1, 'misses': 1}
+
+
+def test_repo_blame_resume(stat, mocker):
+    get_blame = mocker.patch.object(collectors, 'get_blame')
+    get_blame.side_effect = [
+        {'authors': {'author1': 10}, 'file': 'f1'},
+        RuntimeError,
+        {'authors': {'author2': 5}, 'file': 'f2'},
+    ]
+    tree_index(mocker, '100644 blob rev1 100000\tf1\x00'
+                       '100644 blob rev2 10\tf2')
+
+    gs = stat['cls']
+    gs.config.force = False
+    os.makedirs(os.path.join(gs.repos_dir, 'repo1'))
+    gs.save_data([{'name': 'repo1', 'HEAD': 'h'}], 'repos.json')
+    gs.run(['repo1'], ['blame'])
+    assert gs.scheduler.failed
+
+    journal = os.path.join(gs.data_dir, 'repo1', 'files-authors.journal')
+    assert gs.load_data('files-authors.json', 'repo1') is None
+    assert list(utils.Journal(journal)) == [
+        ['f1', {'authors': {'author1': 10}, 'revision': 'rev1'}],
+    ]
+
+    os.remove(os.path.join(gs.cache_dir, 'blame.json'))
+    run_stages(gs, ['blame'], ['repo1'])
+
+    assert get_blame.call_count == 3
+    assert get_blame.call_args[0][-1] == 'f2'
+    assert gs.load_data('files-authors.json', 'repo1') == {
+        'f1': {'authors': {'author1': 10}, 'revision': 'rev1'},
+        'f2': {'authors': {'author2': 5}, 'revision': 'rev2'},
+    }
+    assert not os.path.exists(journal)
+
+
+def test_repo_blame_resume_tracked(stat):
+    gs = stat['cls']
+    gs.config.force = False
+    path = os.path.join(gs.repos_dir, 'repo1')
+    utils.git(gs.repos_dir, '', 'init', '-q', path)
+    fpath = os.path.join(path, 'f')
+
+    def commit(author, lines):
+        with open(fpath, 'w') as fh:
+            fh.writelines(f'{line}\n' for line in lines)
+        utils.git(path, '', 'add', 'f')
+        utils.git(path, '', '-c', f'user.name={author}', '-c',
+                  'user.email=a@b', 'commit', '-q', '-m', author)
+        return (utils.git(path, '', 'rev-parse', 'HEAD'),
+                utils.git(path, '', 'rev-parse', 'HEAD:f'))
+
+    since, blob1 = commit('A', range(20))
+    head, blob2 = commit('B', ['top', *range(19)])
+    gs.save_data({'HEAD': since}, 'files-authors-state.json', 'repo1')
+    gs.save_data({'f': {'authors': {'A': 20}, 'revision': blob1,
+                        'runs': [[20, 'A']]}}, 'files-authors.json', 'repo1')
+    # blamed at the new HEAD by an interrupted run
+    entry = {'authors': {'B': 1, 'A': 19}, 'revision': blob2,
+             'runs': [[1, 'B'], [19, 'A']]}
+    journal = utils.Journal(os.path.join(gs.data_dir, 'repo1',
+                                         'files-authors.journal'))
+    journal.append(['f', entry])
+    journal.close()
+
+    blame = gs._prepare_blame('repo1', False, head, {}, set())
+    blame['journal'].close()
+
+    assert blame['authors'] == {'f': entry}
+    assert blame['files'] == {}
+
+
+def test_repo_blame_force(stat, mocker):
+    get_blame = mocker.patch.object(collectors, 'get_blame')
+    get_blame.side_effect = lambda workdir, *args: {
+        'authors': {'b': 1}, 'file': args[-1]}
+    tree_index(mocker, '100644 blob rev1\tf1\x00100644 blob rev2\tf2\x00'
+                       '100644 blob rev3\tf3')
+
+    gs = stat['cls']
+    gs.save_data({'f1': {'authors': {'a': 1}, 'revision': 'rev1'}},
+                 'files-authors.json', 'repo1')
+    journal = utils.Journal(os.path.join(gs.data_dir, 'repo1',
+                                         'files-authors.journal'))
+    journal.append(['f2', {'authors': {'a': 1}, 'revision': 'rev2'}])
+    journal.close()
+    cache = utils.LRUCache(os.path.join(gs.cache_dir, 'blame.json'))
+    cache.set('rev3', {'a': 1})
+    cache.save()
+
+    run_stages(gs, ['blame'], ['repo1'])
+
+    assert sorted(c[0][-1] for c in get_blame.call_args_list) == [
+        'f1', 'f2', 'f3']
+    assert gs.load_data('files-authors.json', 'repo1') == {
+        f'f{i}': {'authors': {'b': 1}, 'revision': f'rev{i}'}
+        for i in range(1, 4)
+    }
+    assert not os.path.exists(journal.path)
+
+
+def test_repo_blame_schedule(stat, mocker):
+    stat['cfg'].config['GLOBAL']['detect_move'] = 'repo2'
+    mocker.patch.object(gitstats, 'BLAME_SMALL_FILE', 100)
+    mocker.patch.object(gitstats, 'BLAME_BATCH_SIZE', 50)
+    get_blames = mocker.patch.object(collectors, 'get_blames')
+    get_blames.side_effect = lambda workdir, task: {
+        'repo': task[0],
+        'results': [{'file': f, 'authors': {f: 1}} for f in task[2]],
+    }
+    tree_index(mocker,
+               '100644 blob r1 10\ta\x00100644 blob r2 30\tb\x00'
+               '100644 blob r3 20\tc\x00100644 blob r4 500\td\x00'
+               '160000 commit r5 -\te',
+               '100644 blob r6 200\tf\x00100644 blob r1 10\tg',
+               '100644 blob r1 10\th\x00100644 blob r7 10\ti')
+
+    gs = stat['cls']
+    gs.config.config['REPOSITORIES']['repo3'] = 'clone: repo3'
+    run_stages(gs, ['blame'], ['repo1', 'repo2', 'repo3'])
+
+    assert [call[0][1] for call in get_blames.call_args_list] == [
+        ('repo2', True, ['f']),
+        ('repo1', False, ['d']),
+        ('repo2', True, ['g']),
+        ('repo1', False, ['a', 'b', 'c']),
+        ('repo3', False, ['i']),
+        ('repo1', False, ['e']),
+    ]
+    assert gs.load_data('files-authors.json', 'repo3') == {
+        'h': {'authors': {'a': 1}, 'revision': 'r1'},
+        'i': {'authors': {'i': 1}, 'revision': 'r7'},
+    }
+    assert gs.load_data('authors.json', 'repo2') == {
+        'files': {'f': 1, 'g': 1}, 'lines': {'f': 1, 'g': 1},
+    }
 
 
 def test_repo_blame_with_cache(stat, mocker):
     _tmp1 = collectors.get_blame
-    _tmp2 = utils.run_git
 
     collectors.get_blame = mocker.Mock()
     collectors.get_blame.side_effect = [
         {'authors': {'author1': 10, 'author2': 20}, 'file': 'f1'},
     ]
-    utils.run_git = mocker.Mock()
-    utils.run_git.side_effect = [
-        """10644 blob rev1 f1
-        '10644 blob rev2 f2"""
-    ]
+    tree_index(mocker,
+               '10644 blob rev1\tf1\x00100644 blob rev2\tf2')
 
     cache = {
         'f2': {
@@ -407,11 +978,10 @@ def test_repo_blame_with_cache(stat, mocker):
     }
 
     gs = stat['cls']
+    gs.config.force = False
     gs.save_data(cache, 'files-authors.json', 'repo1')
 
-    gs.repos = ['repo1']
-
-    gs.repo_blame()
+    run_stages(gs, ['blame'], ['repo1'])
 
     assert gs.load_data('files-authors.json', 'repo1') == {
         'f1': {
@@ -429,5 +999,4 @@ def test_repo_blame_with_cache(stat, mocker):
         'lines': {'author1': 40, 'author2': 20, 'author3': 10},
     }
 
-    collectors.get_tags = _tmp1
-    utils.run_git = _tmp2
+    collectors.get_blame = _tmp1
@@ -0,0 +1,140 @@
+from gitstats import loc, utils
+
+
+def commit(path, files):
+    for name, content in files.items():
+        fpath = path / name
+        fpath.parent.mkdir(parents=True, exist_ok=True)
+        fpath.write_bytes(content)
+    utils.git(str(path), '', 'add', '-A')
+    utils.git(str(path), '', '-c', 'user.name=a', '-c', 'user.email=a@b',
+              'commit', '-q', '-m', 'files')
+
+
+def test_language_of():
+    assert loc.language_of('src/app.py') == 'Python'
+    assert loc.language_of('a/B.TS') == 'TypeScript'
+    assert loc.language_of('Makefile') == 'make'
+    assert loc.language_of('docker/Dockerfile.dev') == 'Dockerfile'
+    assert loc.language_of('.py') is None
+    assert loc.language_of('README') is None
+    assert loc.language_of('data.bin') is None
+
+
+def test_language_of_shebang():
+    assert loc.language_of_shebang(b'#!/usr/bin/env python3\n') == 'Python'
+    assert loc.language_of_shebang(b'#!/bin/bash -e\necho') == \
+        'Bourne Again Shell'
+    assert loc.language_of_shebang(b'#!/usr/bin/env -S node') == 'JavaScript'
+    assert loc.language_of_shebang(b'#!/usr/bin/unknown\n') is None
+    assert loc.language_of_shebang(b'print(1)\n') is None
+
+
+def test_count():
+    assert loc.count(b'''#!/usr/bin/env python
+"""
+Docstring
+
+more
+"""
+import os  # comment
+
+# comment
+x = 1
+''', 'Python') == [2, 6, 2]
+
+    assert loc.count(b'''/* one */
+int a; /* two
+   three */
+/* four */ int b;
+  // five
+
+int c; // six
+''', 'C') == [1, 3, 3]
+
+    assert loc.count(b'{"a": 1}\n\n', 'JSON') == [1, 0, 1]
+    assert loc.count(b'no newline', 'Markdown') == [0, 0, 1]
+
+
+def test_count_lines(tmp_path, mocker):
+    repo = tmp_path / 'repo'
+    utils.git(str(tmp_path), '', 'init', '-q', 'repo')
+    commit(repo, {
+        'a.py': b'import os\n\n# comment\n',
+        'b/c.py': b'x = 1\n',
+        'same.py': b'x = 1\n',
+        'run': b'#!/bin/sh\necho 1\n',
+        'style.css': b'/* c */\na { }\n',
+        'image.png': b'\x89PNG\0\0',
+        'notes.txt': b'text\n',
+    })
+
+    lines, hits, misses = loc.count_revision(str(tmp_path), 'repo')
+    assert (hits, misses) == (0, 6)
+    assert lines['Python'] == {'nFiles': 3, 'blank': 1, 'comment': 1,
+                               'code': 3}
+    assert lines['Bourne Shell'] == {'nFiles': 1, 'blank': 0, 'comment': 1,
+                                     'code': 1}
+    assert lines['CSS'] == {'nFiles': 1, 'blank': 0, 'comment': 1,
+                            'code': 1}
+    assert lines['SUM'] == {'nFiles': 5, 'blank': 1, 'comment': 3,
+                            'code': 5}
+    assert lines['header']['n_files'] == 5
+    assert lines['header']['n_lines'] == 9
+    assert list(lines)[1] == 'Python'
+
+    # only the changed blobs are read again
+    commit(repo, {'a.py': b'import sys\n'})
+    read_blobs = mocker.patch.object(utils, 'read_blobs',
+                                     wraps=utils.read_blobs)
+    lines, hits, misses = loc.count_revision(str(tmp_path), 'repo')
+    assert (hits, misses) == (5, 1)
+    assert list(read_blobs.call_args.args[2]) == [
+        utils.git(str(repo), '', 'rev-parse', 'HEAD:a.py')]
+    assert lines['Python'] == {'nFiles': 3, 'blank': 0, 'comment': 0,
+                               'code': 3}
+
+    # the cache holds the blobs of the counted tree only
+    cache = loc.load_cache(loc.cache_path(str(tmp_path), 'repo'))
+    assert len(cache) == 6
+
+
+def test_count_trees(tmp_path, mocker):
+    repo = tmp_path / 'repo'
+    utils.git(str(tmp_path), '', 'init', '-q', 'repo')
+    commit(repo, {'a.py': b'x = 1\n', 'sub/b.py': b'# b\n', 'sub/c.js': b''})
+    first = utils.git(str(repo), '', 'rev-parse', 'HEAD')
+    commit(repo, {'a.py': b'x = 1\n\ny = 2\n'})
+
+    read_blobs = mocker.patch.object(utils, 'read_blobs',
+                                     wraps=utils.read_blobs)
+    cache, memo, blobs = {}, {}, set()
+    counts, misses = loc.count_trees(str(tmp_path), 'repo', [first], cache,
+                                     memo, blobs)
+    assert counts == [{'Python': [2, 0, 1, 1], 'JavaScript': [1, 0, 0, 0]}]
+    assert misses == 3
+    assert blobs == set(cache)
+
+    # the unchanged subtree and blobs are not read again
+    counts, misses = loc.count_trees(str(tmp_path), 'repo', ['HEAD'], cache,
+                                     memo)
+    assert counts == [{'Python': [2, 1, 1, 2], 'JavaScript': [1, 0, 0, 0]}]
+    assert misses == 1
+    assert list(read_blobs.call_args.args[2]) == [
+        utils.git(str(repo), '', 'rev-parse', 'HEAD:a.py')]
+
+    assert loc.tree_lines(counts[0]) == {
+        'Python': {'nFiles': 2, 'blank': 1, 'comment': 1, 'code': 2},
+        'JavaScript': {'nFiles': 1, 'blank': 0, 'comment': 0, 'code': 0},
+        'SUM': {'nFiles': 3, 'blank': 1, 'comment': 1, 'code': 2},
+    }
+
+
+def test_read_blobs(tmp_path):
+    repo = tmp_path / 'repo'
+    utils.git(str(tmp_path), '', 'init', '-q', 'repo')
+    commit(repo, {'a': b'first\n', 'b': b'\0second'})
+    assert list(utils.read_blobs(str(repo), '', ['HEAD:b', 'missing',
+                                                 'HEAD:a'])) == [
+        ('HEAD:b', b'\0second'), ('missing', None), ('HEAD:a', b'first\n'),
+    ]
@@ -1,10 +1,14 @@
 from tempfile import TemporaryDirectory, NamedTemporaryFile
 
+import pytest
+
 from . import __main__ as main
 
 
 def test_parse_command_args():
-    default_args = {'force': False, 'verbose': False, 'config_path': None}
+    default_args = {'force': False, 'verbose': False, 'config_path': None,
+                    'profile': False, 'daemon': False, 'repo': None,
+                    'stage': None}
 
     args = main.parse_command_args([])
     assert vars(args) == default_args
@@ -18,13 +22,29 @@ def test_parse_command_args():
     args = main.parse_command_args(['-c', '/tmp/conf.ini'])
     assert vars(args) == {**default_args, 'config_path': '/tmp/conf.ini'}
 
+    args = main.parse_command_args(['--profile'])
+    assert vars(args) == {**default_args, 'profile': True}
+
+    args = main.parse_command_args(['--daemon'])
+    assert vars(args) == {**default_args, 'daemon': True}
+
     args = main.parse_command_args(['-v', '-f'])
     assert vars(args) == {**default_args, 'force': True, 'verbose': True}
 
+    args = main.parse_command_args(['-r', 'foo,bar', '--repo', 'baz',
+                                    '--stage', 'activity, files-history'])
+    assert vars(args) == {**default_args, 'repo': ['foo', 'bar', 'baz'],
+                          'stage': ['activity', 'files-history']}
+
+    for argv in (['-s', 'activity,unknown'], ['-d', '-r', 'foo']):
+        with pytest.raises(SystemExit):
+            main.parse_command_args(argv)
+
 
 def test_main(mocker):
     gs = main.GitStats
     main.GitStats = mocker.Mock()
+    lower_priority = mocker.patch.object(main, 'lower_priority')
 
     with TemporaryDirectory() as tmpdir, NamedTemporaryFile() as tmp:
         with open(tmp.name, 'w') as fh:
@@ -38,6 +58,28 @@ def test_main(mocker):
 
         main.main(['-c', tmp.name])
 
-        main.GitStats().run.assert_called()
+        main.GitStats().run.assert_called_once_with(None, None)
+        lower_priority.assert_called_once_with()
 
     main.GitStats = gs
+
+
+def test_main_daemon(mocker):
+    mocker.patch.object(main, 'GitStats')
+    mocker.patch.object(main, 'lower_priority')
+    daemon = mocker.patch.object(main, 'Daemon')
+    daemon.return_value.serve.side_effect = KeyboardInterrupt
+    signal = mocker.patch.object(main.signal, 'signal')
+
+    with NamedTemporaryFile() as tmp:
+        main.main(['-c', tmp.name, '-d'])
+
+    main.GitStats().run.assert_not_called()
+    daemon.assert_called_once_with(main.GitStats())
+    daemon().serve.assert_called_once_with()
+    daemon().stop.assert_called_once_with()
+
+    # stopped on SIGTERM
+    assert signal.call_args.args[0] == main.signal.SIGTERM
+    signal.call_args.args[1]()
+    assert daemon().stop.call_count == 2
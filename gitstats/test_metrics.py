@@ -0,0 +1,67 @@
+import json
+import os
+import pstats
+from tempfile import TemporaryDirectory
+
+from . import metrics, utils
+
+
+def work(n):
+    utils.execute(['true'])
+    return sum(range(n))
+
+
+def test_measure():
+    result, sample = metrics.measure(work, False, 1000)
+    assert result == sum(range(1000))
+    assert sample['processes'] == 1
+    assert sample['wall'] >= 0 and sample['cpu'] >= 0
+    assert 'profile' not in sample
+
+    _, sample = metrics.measure(work, True, 10)
+    assert isinstance(sample['profile'], dict)
+
+
+def test_stage_and_task():
+    m = metrics.Metrics()
+    # measured in a pool worker
+    _, sample = metrics.measure(work, False, 10)
+
+    with m.stage('activity') as stage:
+        utils.execute(['true'])
+        m.task('activity', 'repo1', sample, workers=2)
+        m.task('activity', None, sample, workers=2)
+
+    assert stage['processes'] == 3
+    assert stage['tasks'] == 2
+    assert stage['workers'] == 2
+    assert stage['wall'] > 0
+    assert 0 <= stage['utilization'] <= 1
+    assert stage['repos']['repo1']['tasks'] == 1
+    assert stage['repos']['repo1']['processes'] == 1
+
+    m.cache('blame', hits=3)
+    m.cache('blame', misses=1)
+    assert m.data()['caches'] == {'blame': {'hits': 3, 'misses': 1}}
+
+
+def test_save():
+    with TemporaryDirectory() as d:
+        for _ in range(2):
+            m = metrics.Metrics(profile=True)
+            with m.stage('summary'):
+                _, sample = metrics.measure(work, True, 10)
+                m.task('summary', 'repo1', sample)
+            m.save(d)
+
+        with open(os.path.join(d, 'metrics.json')) as fh:
+            data = json.load(fh)
+        assert data['stages']['summary']['repos']['repo1']['tasks'] == 1
+
+        with open(os.path.join(d, 'metrics-history.json')) as fh:
+            history = json.load(fh)
+        assert len(history) == 2
+        assert 'repos' not in history[0]['stages']['summary']
+
+        stats = pstats.Stats(os.path.join(d, 'profile', 'summary.prof'))
+        assert any(func[2] == 'work' for func in stats.stats)
@@ -0,0 +1,88 @@
+from gitstats import benchmark, collectors, ownership, utils
+
+patch = b'''diff --git a.py a.py
+index 1..2 100644
+--- a.py
++++ a.py
+@@ -2 +1,0 @@ x
+--- not a header
+@@ -5,0 +5,2 @@ y
++++ not a header
++z
+\\ No newline at end of file
+diff --git old.py new.py
+similarity index 90%
+rename from old.py
+rename to new.py
+diff --git "sp ace\\t.py" "sp ace\\t.py"
+new file mode 100644
+--- /dev/null
++++ "sp ace\\t.py"
+@@ -0,0 +1 @@
++a
+diff --git gone.py gone.py
+deleted file mode 100644
+--- gone.py
++++ /dev/null
+@@ -1 +0,0 @@
+-a
+diff --git img.png img.png
+index 1..2 100644
+Binary files img.png and img.png differ
+'''
+
+
+def test_runs():
+    runs = ownership.runs_of(['a', 'a', 'b', 'a'])
+    assert runs == [[2, 'a'], [1, 'b'], [1, 'a']]
+    assert ownership.lines_of(runs) == ['a', 'a', 'b', 'a']
+    assert ownership.count_authors(runs) == {'a': 3, 'b': 1}
+
+
+def test_apply_hunks():
+    lines = ['a', 'b', 'c', 'd']
+    assert ownership.apply_hunks(lines, [(0, 0, 1), (2, 2, 1), (4, 0, 2)],
+                                 'x')
+    assert lines == ['x', 'a', 'x', 'd', 'x', 'x']
+    assert not ownership.apply_hunks(lines, [(6, 2, 0)], 'x')
+
+
+def test_parse_patch():
+    sections = list(ownership._parse_patch(patch))
+    assert [(s['old'], s['new'], s['hunks']) for s in sections] == [
+        ('a.py', 'a.py', [(2, 1, 0), (5, 0, 2)]),
+        ('old.py', 'new.py', []),
+        ('sp ace\t.py', 'sp ace\t.py', [(0, 0, 1)]),
+        ('gone.py', 'gone.py', [(1, 1, 0)]),
+        ('img.png', 'img.png', []),
+    ]
+    assert sections[2]['created'] and sections[3]['deleted']
+    assert sections[4]['binary']
+
+
+def test_update(tmp_path):
+    path = str(tmp_path / 'repo')
+    benchmark.generate_repo(path, commits=60, files=8, tags=0, branches=0,
+                            seed=3)
+    since = utils.git(path, '', 'rev-parse', 'HEAD~20')
+    head = utils.git(path, '', 'rev-parse', 'HEAD')
+
+    def blame(revision):
+        return {
+            fname: collectors.get_blame(path, '', False, fname)['runs']
+            for fname in utils.git(path, '', 'ls-tree', '-r', '-z',
+                                   '--name-only', revision).split('\0')
+            if fname
+        }
+
+    utils.git(path, '', 'checkout', '-q', since)
+    files = blame(since)
+    utils.git(path, '', 'checkout', '-q', 'master')
+    current = blame(head)
+
+    changed = ownership.update(path, '', since, head, files)
+    assert changed
+    for fname, runs in changed.items():
+        assert runs == current.get(fname)
+
+    assert ownership.update(path, '', head, since, current) is None
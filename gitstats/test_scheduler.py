@@ -0,0 +1,105 @@
+from multiprocessing.dummy import Pool
+
+import pytest
+
+from . import metrics, scheduler
+
+
+def square(x):
+    return x * x
+
+
+def fail(x):
+    raise RuntimeError(x)
+
+
+@pytest.fixture()
+def pool():
+    with Pool(2) as p:
+        yield p
+
+
+def test_deps(pool):
+    s = scheduler.Scheduler(pool, 2)
+    results = []
+
+    s.add('c', square, (3,), deps=['a', 'b'],
+          callback=lambda r: results.append(('c', r)))
+    s.add('a', square, (1,), callback=lambda r: results.append(('a', r)))
+    s.add('b', square, (2,), deps=['a'],
+          callback=lambda r: results.append(('b', r)))
+
+    assert s.run() == []
+    assert results == [('a', 1), ('b', 4), ('c', 9)]
+    assert s.done == {'a', 'b', 'c'}
+
+    with pytest.raises(ValueError):
+        s.add('a', square, (1,))
+
+
+def test_priority(pool):
+    s = scheduler.Scheduler(pool, 1)
+    order = []
+
+    def start():
+        for i, priority in enumerate([1, 3, 2]):
+            s.add(i, priority=priority, callback=lambda i=i: order.append(i))
+
+    s.add('start', callback=start)
+    s.run()
+
+    assert order == [1, 2, 0]
+
+
+def test_callback_adds_tasks(pool):
+    s = scheduler.Scheduler(pool, 2)
+    results = []
+
+    s.add('a', square, (2,), callback=lambda r: s.add(
+        'b', square, (r,), callback=results.append
+    ))
+    s.run()
+
+    assert results == [16]
+
+
+def test_failure(pool):
+    s = scheduler.Scheduler(pool, 2)
+    results = []
+
+    s.add('a', fail, ('a',))
+    s.add('b', square, (2,), deps=['a'], callback=results.append)
+    s.add('c', square, (3,), deps=['b'], callback=results.append)
+    s.add('d', square, (4,), callback=results.append)
+    s.add('e', square, (5,), callback=lambda r: 1 / 0)
+
+    assert s.run() == []
+    assert results == [16]
+    assert s.done == {'d'}
+    assert s.failed == {'a', 'b', 'c', 'e'}
+
+    # tasks depending on a failed task are skipped right away
+    s.add('f', square, (6,), deps=['a'], callback=results.append)
+    assert 'f' in s.failed
+
+
+def test_missing_deps(pool):
+    s = scheduler.Scheduler(pool, 2)
+    s.add('a', square, (1,), deps=['never'])
+    assert s.run() == ['a']
+
+
+def test_metrics(pool):
+    m = metrics.Metrics()
+    s = scheduler.Scheduler(pool, 2, m)
+
+    s.add('a', square, (2,), stage='one', repo='repo1')
+    s.add('b', square, (3,), stage='one', repo='repo2')
+    s.add('c', stage='two')
+    s.run()
+
+    assert m.stages['one']['tasks'] == 2
+    assert set(m.stages['one']['repos']) == {'repo1', 'repo2'}
+    assert m.stages['one']['workers'] == 2
+    assert 0 <= m.stages['one']['utilization'] <= 1
+    assert 'two' in m.stages
@@ -0,0 +1,96 @@
+import os
+import re
+
+from gitstats import benchmark, trees, utils
+
+
+def ls_tree(path):
+    files = {}
+    for line in utils.git(path, '', 'ls-tree', '-r', '-l', '-z',
+                          'HEAD').split('\0'):
+        if line:
+            meta, _, fname = line.partition('\t')
+            mode, _, blob, size = meta.split()
+            files[fname] = [mode, blob, int(size) if size.isdigit() else 0]
+    return files
+
+
+def shortstat(path):
+    output = utils.git(path, '', 'diff', '--shortstat',
+                       utils.empty_git_sha(path, ''), 'HEAD')
+    files, lines = re.search(r'(\d+) .*, (\d+) .*', output).groups()
+    return int(files), int(lines)
+
+
+def assert_index(index, path):
+    assert index.head == utils.git(path, '', 'rev-parse', 'HEAD')
+    assert {k: v[:3] for k, v in index.files.items()} == ls_tree(path)
+    assert (len(index), index.lines) == shortstat(path)
+    assert index.lines == sum(v[3] for v in index.files.values())
+
+
+def commit(path, files):
+    for name, content in files.items():
+        fpath = os.path.join(path, name)
+        if content is None:
+            os.remove(fpath)
+        elif isinstance(content, str):
+            os.remove(fpath)
+            os.symlink(content, fpath)
+        else:
+            with open(fpath, 'wb') as fh:
+                fh.write(content)
+    utils.git(path, '', 'add', '-A')
+    utils.git(path, '', '-c', 'user.name=a', '-c', 'user.email=a@b',
+              'commit', '-q', '-m', 'change')
+
+
+def test_index(tmp_path, mocker):
+    path = str(tmp_path / 'repo')
+    benchmark.generate_repo(path, commits=30, files=20, tags=0, branches=0)
+    utils.git(path, '', 'reset', '-q', '--hard')
+    workdir = str(tmp_path)
+
+    index = trees.load_index(workdir, 'repo')
+    assert_index(index, path)
+    loaded = trees.TreeIndex.load(trees.index_path(workdir, 'repo'))
+    assert loaded.files == index.files
+    assert not loaded.update(workdir, 'repo')
+
+    # updated from the changes only, binary files are counted when changed
+    names = sorted(index.files)
+    commit(path, {
+        names[0]: b'one\ntwo',
+        names[1]: None,
+        names[2]: b'\0binary\n',
+        'new.txt': b'a\nb\nc\n',
+    })
+    object_sizes = mocker.patch.object(utils, 'object_sizes',
+                                       wraps=utils.object_sizes)
+    index = trees.load_index(workdir, 'repo')
+    assert_index(index, path)
+    assert sorted(object_sizes.call_args.args[2]) == sorted(
+        utils.git(path, '', 'rev-parse', f'HEAD:{name}')
+        for name in (names[0], names[2], 'new.txt'))
+
+    commit(path, {names[2]: b'text again\n', 'new.txt': names[0]})
+    index = trees.load_index(workdir, 'repo')
+    assert_index(index, path)
+    assert index.files['new.txt'][0] == '120000'
+
+    # rebuilt when the indexed HEAD is gone
+    index.head = 'f' * 40
+    index.save(trees.index_path(workdir, 'repo'))
+    commit(path, {names[3]: b'changed\n'})
+    assert_index(trees.load_index(workdir, 'repo'), path)
+
+
+def test_load_invalid(tmp_path):
+    path = tmp_path / 'index'
+    assert len(trees.TreeIndex.load(str(path))) == 0
+
+    path.write_text('{"version": 0, "head": "a", "lines": 1, "files": {}}')
+    assert trees.TreeIndex.load(str(path)).head is None
+
+    path.write_text('{"version": 1')
+    assert trees.TreeIndex.load(str(path)).head is None
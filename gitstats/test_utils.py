@@ -1,9 +1,13 @@
+import gzip
 import json
 import os
 import shutil
 import subprocess
+import time
 import uuid
 
+import pytest
+
 from gitstats import utils
 
 
@@ -20,6 +24,151 @@ def test_run_git():
     assert utils.run_git('.', '.', 'status')
 
 
+def test_execute():
+    result = utils.execute(['cat'], input='a b')
+    assert isinstance(result, subprocess.CompletedProcess)
+    assert result.stdout == 'a b'
+    assert utils.execute(['cat'], input=b'\0', text=False).stdout == b'\0'
+
+    with pytest.raises(subprocess.CalledProcessError):
+        utils.execute(['false'])
+
+
+def test_execute_counts_bytes():
+    before = dict(utils.counters)
+    utils.execute(['cat'], input='\u00e9')
+    utils.execute(['cat'], input='\u00e9'.encode(), text=False)
+    assert utils.counters['processes'] - before['processes'] == 2
+    assert utils.counters['bytes_read'] - before['bytes_read'] == 4
+
+
+def test_git():
+    name = 'name with spaces; $(exit 1)'
+    assert utils.git('.', '.', 'rev-parse', '--sq-quote', name) == f"'{name}'"
+    assert utils.git('.', '.', 'rev-parse', 'HEAD', text=False).endswith(b'\n')
+
+
+def test_lower_priority(mocker):
+    nice = mocker.patch('os.nice')
+    nice.return_value = 0
+    utils.lower_priority()
+    nice.assert_called_with(utils.NICENESS)
+
+    nice.reset_mock()
+    nice.return_value = utils.NICENESS
+    utils.lower_priority()
+    nice.assert_called_once_with(0)
+
+
+def test_stream():
+    records = list(utils.stream(['printf', 'a\\0b\\0\\0c'], bufsize=1))
+    assert records == [b'a', b'b', b'c']
+    assert list(utils.stream(['cat'], sep=b'\n', input=b'x\ny\n')) == [
+        b'x', b'y']
+    # a separator split across reads
+    assert list(utils.stream(['cat'], sep=b'--', bufsize=3,
+                             input=b'ab--c----def-g--')) == [
+        b'ab', b'c', b'def-g']
+
+    # a huge record is read in linear time
+    start = time.perf_counter()
+    records = list(utils.stream(['head', '-c', str(32 << 20), '/dev/zero'],
+                                sep=b'\n'))
+    assert time.perf_counter() - start < 3
+    assert [len(r) for r in records] == [32 << 20]
+
+
+def test_stream_git():
+    records = list(utils.stream_git('.', '.', 'log', '-n2', '--format=%x00%H',
+                                    bufsize=7))
+    assert 1 <= len(records) <= 2
+    assert all(len(r.strip()) == 40 for r in records)
+
+
+def test_stream_git_on_exception():
+    with pytest.raises(subprocess.CalledProcessError):
+        list(utils.stream_git('.', '.', 'log', 'not-a-revision'))
+
+
+def test_cat_file():
+    cat = utils.cat_file('.', '.')
+    assert utils.cat_file('.', '.') is cat
+
+    head = utils.run_git('.', '.', 'rev-parse HEAD')
+    commit = cat.commit('HEAD')
+    assert commit['sha'] == head
+    assert commit['tree'] == utils.run_git('.', '.', 'rev-parse HEAD^{tree}')
+    assert commit['author'][1] == int(
+        utils.run_git('.', '.', 'log -n1 --format=%at'))
+
+    sha, kind, size = cat.info('HEAD:LICENSE.txt')
+    assert kind == 'blob'
+    with open('LICENSE.txt', 'rb') as fh:
+        content = fh.read()
+    assert cat.read(sha) == (sha, 'blob', content)
+    assert cat.size(sha) == size == len(content)
+
+    names = [name for _, name, _ in cat.tree('HEAD')]
+    assert 'LICENSE.txt' in names and 'gitstats' in names
+
+    with pytest.raises(KeyError):
+        cat.info('HEAD:does-not-exist')
+
+    utils.close_cat_files()
+    assert utils.cat_file('.', '.') is not cat
+    assert utils.cat_file('.', '.').size(sha) == size
+    utils.close_cat_files()
+
+
+def test_count_lines():
+    assert utils.count_lines(b'') == 0
+    assert utils.count_lines(b'a\nb') == 2
+    assert utils.count_lines(b'a\nb\n') == 2
+    assert not utils.is_binary(b'a\nb\n')
+    assert utils.is_binary(b'a\0\n')
+    assert not utils.is_binary(b'a' * utils.BINARY_CHECK_SIZE + b'\0')
+
+
+def test_lru_cache(tmp_path):
+    path = str(tmp_path / 'cache' / 'lru.json')
+    cache = utils.LRUCache(path, size=2)
+    assert len(cache) == 0
+    assert cache.get('a', 0) == 0
+
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert 'b' not in cache
+    assert 'a' in cache and 'c' in cache
+
+    cache.save()
+    cache = utils.LRUCache(path, size=2)
+    assert len(cache) == 2
+    cache.set('d', 4)
+    assert 'a' not in cache
+    assert cache.get('c') == 3
+    assert os.listdir(str(tmp_path / 'cache')) == ['lru.json']
+
+
+def test_journal(tmp_path):
+    path = str(tmp_path / 'data' / 'test.journal')
+    journal = utils.Journal(path)
+    assert list(journal) == []
+
+    journal.append(['a', {'b': 1}])
+    journal.append(['c', None])
+    journal.close()
+    with open(path, 'a') as fh:
+        fh.write('["d", {"e"')
+
+    assert list(utils.Journal(path)) == [['a', {'b': 1}], ['c', None]]
+
+    journal.clear()
+    assert not os.path.exists(path)
+    journal.clear()
+
+
 def test_empty_git_sha():
     sha = '4b825dc642cb6eb9a060e54bf8d69288fbee4904'
     assert utils.empty_git_sha('.', '.') == sha
@@ -40,3 +189,87 @@ def test_save_json():
     assert data == content
 
     shutil.rmtree(os.path.join(root, folders[0]))
+
+
+def test_compressor(tmp_path, mocker):
+    mocker.patch.object(utils, 'brotli', None)
+    path = tmp_path / 'data.json'
+    gz = tmp_path / 'data.json.gz'
+    path.write_text(json.dumps(list(range(1000))))
+
+    compressor = utils.Compressor()
+    assert compressor.compress(str(path))
+    assert gzip.decompress(gz.read_bytes()) == path.read_bytes()
+
+    # unchanged content is not compressed again
+    assert not compressor.compress(str(path))
+    assert (compressor.written, compressor.skipped) == (1, 1)
+
+    path.write_text(json.dumps(list(range(2000))))
+    with compressor:
+        compressor.add(str(path))
+    assert gzip.decompress(gz.read_bytes()) == path.read_bytes()
+    assert compressor.written == 2
+
+    # too small to be compressed, the stale companion is removed
+    path.write_text('[]')
+    assert not compressor.compress(str(path))
+    assert not gz.exists()
+
+
+@pytest.mark.skipif(utils.brotli is None, reason='needs brotli')
+def test_compressor_brotli(tmp_path):
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps(list(range(1000))))
+
+    assert utils.Compressor().compress(str(path))
+    assert utils.brotli.decompress(
+        (tmp_path / 'data.json.br').read_bytes()) == path.read_bytes()
+
+    # the brotli companion is written if missing
+    os.remove(tmp_path / 'data.json.br')
+    assert utils.Compressor().compress(str(path))
+
+
+def test_save_json_manifest(tmp_path):
+    root = str(tmp_path)
+    manifest = {}
+
+    path = utils.save_json([1], root, 'a.json', 'repo', manifest)
+    assert path == os.path.join(root, 'repo', 'a.json')
+    assert manifest == {'repo/a.json': utils.content_hash(b'[1]')}
+    assert not [f for f in os.listdir(os.path.dirname(path))
+                if f.endswith('.tmp')]
+
+    # unchanged content is not written again
+    mtime = os.stat(path).st_mtime_ns
+    assert utils.save_json([1], root, 'a.json', 'repo', manifest) is None
+    assert os.stat(path).st_mtime_ns == mtime
+
+    # unless the file has changed since
+    with open(path, 'w') as fh:
+        fh.write('[12]')
+    assert utils.save_json([1], root, 'a.json', 'repo', manifest) == path
+    with open(path) as fh:
+        assert json.load(fh) == [1]
+
+    assert utils.save_json([2], root, 'a.json', 'repo', manifest) == path
+    assert manifest == {'repo/a.json': utils.content_hash(b'[2]')}
+
+
+def test_cat_file_evicted(mocker):
+    mocker.patch.object(utils, 'CAT_FILES_SIZE', 2)
+    first = utils.cat_file('.', '.')
+    first.size('HEAD')
+    utils.cat_file('.', 'gitstats')
+    assert utils.cat_file('.', '.') is first
+    close = mocker.spy(utils.CatFile, 'close')
+
+    # the least recently used one is closed
+    utils.cat_file('.', 'ngapp')
+    assert close.call_args.args[0].path == os.path.join('.', 'gitstats')
+    assert len(utils._cat_files) == 2
+    utils.cat_file('.', 'gitstats')
+    assert close.call_args.args[0] is first
+    assert not first._procs
+    utils.close_cat_files()
@@ -0,0 +1,162 @@
+"""
+An index of the files at HEAD of a repo with their sizes and numbers of
+lines, persisted in its git folder and updated from the changes between the
+indexed and the current HEAD, so that the totals and the file list are known
+without listing or reading the whole tree again
+"""
+import json
+import os
+
+from . import utils
+
+VERSION = 1
+FILENAME = 'gitstats-tree'
+GITLINK = '160000'
+
+
+class TreeIndex:
+    """
+    The files of a tree as path to [mode, blob, size, lines], with the total
+    number of lines kept along. The lines are counted like `git diff
+    --numstat` does, binary files have none.
+    """
+    def __init__(self):
+        self.head = None
+        self.files = {}
+        self.lines = 0
+
+    def __len__(self):
+        return len(self.files)
+
+    def update(self, workdir, repo):
+        """
+        Update the index to the current HEAD of the repo from the output of
+        `git diff-tree` between the indexed HEAD and the current one, it is
+        built from the empty tree if there is no indexed HEAD or it is gone
+
+        :return: True if the index has changed
+        """
+        head = utils.git(workdir, repo, 'rev-parse', 'HEAD')
+        if head == self.head:
+            return False
+
+        base = self.head
+        if base:
+            try:
+                utils.git(workdir, repo, 'cat-file', '-e', base)
+            except Exception:
+                base = None
+        if not base:
+            self.__init__()
+            base = utils.empty_git_sha(workdir, repo)
+
+        changes, numstat = self._diff(workdir, repo, base, head)
+        binary = []
+        for path, change in changes.items():
+            old = self.files.pop(path, None)
+            old_lines = old[3] if old else 0
+            if change is None:
+                self.lines -= old_lines
+                continue
+
+            added, deleted = numstat.get(path, (0, 0))
+            if added is None:
+                binary.append(path)
+                lines = 0
+            else:
+                lines = old_lines + added - deleted
+            self.files[path] = [*change, 0, lines]
+            self.lines += lines - old_lines
+
+        blobs = [path for path, change in changes.items()
+                 if change and change[0] != GITLINK]
+        sizes = utils.object_sizes(workdir, repo,
+                                   [self.files[path][1] for path in blobs])
+        for path, (_, size) in zip(blobs, sizes):
+            self.files[path][2] = size or 0
+
+        # diff-tree has no line counts if either side is binary
+        contents = utils.read_blobs(workdir, repo,
+                                    [self.files[path][1] for path in binary])
+        for path, (_, content) in zip(binary, contents):
+            content = content or b''
+            lines = 0 if utils.is_binary(content) else \
+                utils.count_lines(content)
+            self.files[path][3] = lines
+            self.lines += lines
+
+        self.head = head
+        return True
+
+    @staticmethod
+    def _diff(workdir, repo, base, head):
+        """
+        :return: a tuple of the changed paths to [mode, blob], None if
+            deleted, and the changed paths to (added, deleted) lines, both
+            None for binary files
+        """
+        changes = {}
+        numstat = {}
+        records = utils.stream_git(workdir, repo, 'diff-tree', '-r', '-z',
+                                   '--raw', '--numstat', '--no-renames',
+                                   base, head)
+        for record in records:
+            if record.startswith(b':'):
+                _, mode, _, blob, status = record.decode().split()
+                path = next(records).decode('utf-8', 'surrogateescape')
+                changes[path] = None if status == 'D' else [mode, blob]
+                continue
+
+            added, deleted, path = record.decode(
+                'utf-8', 'surrogateescape').split('\t', 2)
+            # a type change is a deletion and an addition of the path
+            previous = numstat.get(path, (0, 0))
+            if added == '-' or previous[0] is None:
+                numstat[path] = (None, None)
+            else:
+                numstat[path] = (previous[0] + int(added),
+                                 previous[1] + int(deleted))
+        return changes, numstat
+
+    def save(self, path):
+        """
+        Write the index atomically as JSON
+        """
+        tmp = f'{path}.{os.getpid()}.tmp'
+        with open(tmp, 'w') as fh:
+            json.dump({'version': VERSION, 'head': self.head,
+                       'lines': self.lines, 'files': self.files}, fh)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        :return: the index saved at the path, empty if missing or unreadable
+        """
+        index = cls()
+        try:
+            with open(path) as fh:
+                data = json.load(fh)
+            if data['version'] != VERSION:
+                return index
+            index.head, index.lines, index.files = (
+                data['head'], data['lines'], data['files'])
+        except (OSError, ValueError, KeyError):
+            return cls()
+        return index
+
+
+def index_path(workdir, repo):
+    return utils.git_path(workdir, repo, FILENAME)
+
+
+def load_index(workdir, repo):
+    """
+    :return: the TreeIndex of a repo updated to its current HEAD, saved if
+        it has changed
+    """
+    path = index_path(workdir, repo)
+    index = TreeIndex.load(path)
+    if index.update(workdir, repo):
+        index.save(path)
+    return index
@@ -1,10 +1,37 @@
+import atexit
+import gzip
+import hashlib
 import json
+import logging
 import os
+import queue
+import struct
 import subprocess
+import threading
+import zlib
+from collections import OrderedDict
+from functools import partial
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+logger = logging.getLogger(__name__)
 
 HERE = os.path.dirname(os.path.abspath(__file__))
 PROJECT_DIR = os.path.dirname(HERE)
 
+# subprocesses spawned and bytes read from them by the current process
+counters = {'processes': 0, 'bytes_read': 0}
+
+
+def _count(output=b''):
+    if isinstance(output, str):
+        output = output.encode()
+    counters['processes'] += 1
+    counters['bytes_read'] += len(output or b'')
+
 
 def run(cmd, cwd=PROJECT_DIR):
     """
@@ -13,9 +40,11 @@ def run(cmd, cwd=PROJECT_DIR):
     :param cmd: shell command as string
     :return: subprocess.CompletedProcess
     """
-    return subprocess.run(f'nice -n 20 {cmd}', check=True, shell=True, cwd=cwd,
-                          stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                          universal_newlines=True)
+    result = subprocess.run(f'nice -n 20 {cmd}', check=True, shell=True,
+                            cwd=cwd, stdout=subprocess.PIPE,
+                            stderr=subprocess.PIPE, universal_newlines=True)
+    _count(result.stdout)
+    return result
 
 
 def run_git(workdir, repo, cmd):
@@ -31,15 +60,608 @@ def run_git(workdir, repo, cmd):
     return run(f'git {cmd}', os.path.join(workdir, repo)).stdout.strip()
 
 
+NICENESS = 19
+
+
+def lower_priority():
+    """
+    Lower the scheduling priority of the current process, like `nice -n 20`
+    does for a single command. It is called once at startup and as the
+    initializer of the worker pools, so that every subprocess inherits the
+    niceness without an extra `nice` process or a `preexec_fn` per command.
+    """
+    increment = NICENESS - os.nice(0)
+    if increment > 0:
+        os.nice(increment)
+
+
+def execute(argv, cwd=PROJECT_DIR, input=None, text=True):
+    """
+    Run a command given as a list of arguments without a shell
+
+    :param argv: the command and its arguments
+    :param input: optional str, or bytes if not `text`, for standard input
+    :param text: decode the output as text, raw bytes otherwise
+    :return: subprocess.CompletedProcess
+    """
+    result = subprocess.run(argv, check=True, cwd=cwd, input=input,
+                            stdin=None if input is not None
+                            else subprocess.DEVNULL,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                            universal_newlines=text)
+    _count(result.stdout)
+    return result
+
+
+def git(workdir, repo, *args, input=None, text=True):
+    """
+    Run a git command given as arguments in a repo inside the workdir
+
+    :param workdir: the working root folder full path
+    :param repo: the repo name residing inside the working folder
+    :param args: the git sub-command and its arguments, no shell quoting
+        is needed
+    :return: stripped git output as str, or raw bytes if not `text`
+    """
+    output = execute(['git', *args], os.path.join(workdir, repo),
+                     input=input, text=text).stdout
+    return output.strip() if text else output
+
+
+def stream(argv, cwd=PROJECT_DIR, sep=b'\0', bufsize=1 << 16, input=None):
+    """
+    Run a command given as a list of arguments and lazily yield its output as
+    raw bytes records split by `sep`, so that huge outputs are never held in
+    memory
+
+    :param argv: the command and its arguments
+    :param sep: the record separator
+    :param bufsize: the number of bytes to read from the pipe at a time
+    :param input: optional bytes written to the standard input of the command
+        before reading its output, e.g. revisions for `git log --stdin`
+
+    :return: generator of bytes records, empty records are skipped
+    """
+    proc = subprocess.Popen(argv, cwd=cwd,
+                            stdin=subprocess.DEVNULL if input is None
+                            else subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    _count()
+    finished = False
+    try:
+        if input is not None:
+            try:
+                proc.stdin.write(input)
+                proc.stdin.close()
+            except BrokenPipeError:
+                pass
+
+        # only the bytes appended are searched for `sep`, so that a huge
+        # record is not scanned again on every read
+        pending = bytearray()
+        for chunk in iter(partial(proc.stdout.read, bufsize), b''):
+            counters['bytes_read'] += len(chunk)
+            end = len(pending) - len(sep) + 1
+            pending += chunk
+            end = pending.find(sep, max(0, end))
+            pos = 0
+            while end >= 0:
+                if end > pos:
+                    yield bytes(pending[pos:end])
+                pos = end + len(sep)
+                end = pending.find(sep, pos)
+            del pending[:pos]
+        if pending:
+            yield bytes(pending)
+        finished = True
+    finally:
+        if not finished:
+            proc.kill()
+        proc.stdout.close()
+        returncode = proc.wait()
+        if finished and returncode:
+            raise subprocess.CalledProcessError(returncode, argv)
+
+
+def stream_git(workdir, repo, *args, **kwargs):
+    """
+    Stream the output records of a git command in a repo inside the workdir,
+    see stream() for the keyword arguments
+    """
+    return stream(['git', *args], os.path.join(workdir, repo), **kwargs)
+
+
+class CatFile:
+    """
+    Long-lived `git cat-file --batch` and `--batch-check` processes of a
+    repository, resolving any number of objects over one pipe each
+
+    Both processes are started lazily on first use. Objects are given as
+    anything `git rev-parse` understands, e.g. `HEAD:path` or `v1^{commit}`.
+    Missing objects raise KeyError.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._procs = {}
+        self._lock = threading.Lock()
+
+    def _request(self, mode, obj):
+        with self._lock:
+            proc = self._procs.get(mode)
+            if proc is None or proc.poll() is not None:
+                proc = self._procs[mode] = subprocess.Popen(
+                    ['git', 'cat-file', f'--{mode}'],
+                    cwd=self.path, stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+                )
+                _count()
+
+            proc.stdin.write(f'{obj}\n'.encode())
+            proc.stdin.flush()
+            header = proc.stdout.readline().decode()
+            counters['bytes_read'] += len(header)
+            if header.rstrip().rpartition(' ')[2] in ('', 'missing',
+                                                      'ambiguous'):
+                raise KeyError(obj)
+
+            sha, kind, size = header.split()
+            content = None
+            if mode == 'batch':
+                content = proc.stdout.read(int(size))
+                proc.stdout.read(1)
+                counters['bytes_read'] += len(content) + 1
+
+            return sha, kind, int(size), content
+
+    def info(self, obj):
+        """
+        :return: a tuple (sha, type, size) of the object
+        """
+        return self._request('batch-check', obj)[:3]
+
+    def size(self, obj):
+        return self.info(obj)[2]
+
+    def read(self, obj):
+        """
+        :return: a tuple (sha, type, content) of the object
+        """
+        sha, kind, _, content = self._request('batch', obj)
+        return sha, kind, content
+
+    def commit(self, obj):
+        """
+        Parse the headers of a commit, the peeled commit of a tag is used
+
+        :return: a dict with `tree`, `parents`, `author` and `committer`,
+            where the latter two are tuples (name, timestamp)
+        """
+        sha, _, content = self.read(f'{obj}^{{commit}}')
+        headers, _, message = content.decode('utf-8', 'replace'
+                                             ).partition('\n\n')
+        commit = {'sha': sha, 'parents': [], 'message': message}
+        for line in headers.splitlines():
+            key, _, value = line.partition(' ')
+            if key == 'tree':
+                commit['tree'] = value
+            elif key == 'parent':
+                commit['parents'].append(value)
+            elif key in ('author', 'committer'):
+                name, _, stamp = value.rpartition('> ')
+                commit[key] = (name.partition(' <')[0],
+                               int(stamp.split()[0]))
+        return commit
+
+    def tree(self, obj):
+        """
+        :return: list of (mode, name, sha) tuples of the tree entries, the
+            tree of a commit is listed for commits
+        """
+        _, _, content = self.read(f'{obj}^{{tree}}')
+
+        entries = []
+        pos = 0
+        while pos < len(content):
+            space = content.index(b' ', pos)
+            nul = content.index(b'\0', space)
+            entries.append((
+                content[pos:space].decode(),
+                content[space + 1:nul].decode('utf-8', 'surrogateescape'),
+                content[nul + 1:nul + 21].hex(),
+            ))
+            pos = nul + 21
+        return entries
+
+    def close(self):
+        with self._lock:
+            for proc in self._procs.values():
+                proc.stdin.close()
+                proc.wait()
+                proc.stdout.close()
+            self._procs = {}
+
+
+# blobs having a NUL byte in their first bytes are binary, as git decides
+BINARY_CHECK_SIZE = 8000
+
+
+def is_binary(content):
+    return b'\0' in content[:BINARY_CHECK_SIZE]
+
+
+def count_lines(content):
+    """
+    :return: the number of lines of a blob as git blames and diffs them, a
+        last line without a newline counts
+    """
+    if not content:
+        return 0
+    return content.count(b'\n') + (not content.endswith(b'\n'))
+
+
+def read_blobs(workdir, repo, objs):
+    """
+    Read many objects of a repo in bulk over one `git cat-file --batch`,
+    the object names are written from a thread while the contents are read,
+    so that only one object is held in memory at a time
+
+    :param objs: the object names
+    :return: generator of (obj, content) tuples in the given order, content
+        is None for missing objects
+    """
+    return _cat_file_batch(workdir, repo, objs, 'batch')
+
+
+def object_sizes(workdir, repo, objs):
+    """
+    The sizes of many objects of a repo over one `git cat-file
+    --batch-check`, see read_blobs()
+
+    :return: generator of (obj, size) tuples in the given order, size is
+        None for missing objects
+    """
+    return _cat_file_batch(workdir, repo, objs, 'batch-check')
+
+
+def _cat_file_batch(workdir, repo, objs, mode):
+    objs = list(objs)
+    proc = subprocess.Popen(['git', 'cat-file', f'--{mode}'],
+                            cwd=os.path.join(workdir, repo),
+                            stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                            stderr=subprocess.DEVNULL)
+    _count()
+
+    def write():
+        try:
+            for obj in objs:
+                proc.stdin.write(f'{obj}\n'.encode())
+            proc.stdin.close()
+        except (BrokenPipeError, ValueError):
+            pass
+
+    writer = threading.Thread(target=write, daemon=True)
+    writer.start()
+    try:
+        for obj in objs:
+            header = proc.stdout.readline().decode()
+            counters['bytes_read'] += len(header)
+            if header.rstrip().rpartition(' ')[2] in ('', 'missing',
+                                                      'ambiguous'):
+                yield obj, None
+                continue
+            size = int(header.split()[2])
+            if mode == 'batch-check':
+                yield obj, size
+                continue
+            content = proc.stdout.read(size)
+            proc.stdout.read(1)
+            counters['bytes_read'] += len(content) + 1
+            yield obj, content
+    finally:
+        proc.kill()
+        writer.join()
+        for pipe in (proc.stdin, proc.stdout):
+            try:
+                pipe.close()
+            except OSError:
+                pass
+        proc.wait()
+
+
+_cat_files = OrderedDict()
+_cat_files_pid = None
+# the CatFiles of at most this many repos are kept open per process, a warm
+# pool serving many repos would run out of file descriptors otherwise
+CAT_FILES_SIZE = 16
+
+
+def cat_file(workdir, repo):
+    """
+    The CatFile of a repo inside the workdir shared within the current
+    process. A forked pool worker starts its own processes instead of
+    talking over the pipes inherited from its parent. The least recently
+    used CatFiles are closed beyond CAT_FILES_SIZE repos.
+    """
+    global _cat_files_pid
+    if _cat_files_pid != os.getpid():
+        _cat_files.clear()
+        _cat_files_pid = os.getpid()
+
+    path = os.path.join(workdir, repo)
+    if path not in _cat_files:
+        _cat_files[path] = CatFile(path)
+        while len(_cat_files) > CAT_FILES_SIZE:
+            _cat_files.popitem(last=False)[1].close()
+    _cat_files.move_to_end(path)
+    return _cat_files[path]
+
+
+@atexit.register
+def close_cat_files():
+    """
+    Stop the cat-file processes of the current process. Pool workers that are
+    terminated without cleanup close their end of the pipes on exit, which
+    stops these processes as well.
+    """
+    if _cat_files_pid == os.getpid():
+        for cat in _cat_files.values():
+            cat.close()
+    _cat_files.clear()
+
+
+class LRUCache:
+    """
+    A key value store persisted as a JSON file holding at most `size`
+    entries, the least recently used entries are evicted first
+    """
+    def __init__(self, path, size=100000):
+        """
+        :param path: the JSON file, loaded if it exists
+        :param size: the maximum number of entries
+        """
+        self.path = path
+        self.size = size
+        try:
+            with open(path) as fh:
+                self._data = OrderedDict(json.load(fh))
+        except Exception:
+            self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        """
+        :return: the value of the key marked as recently used, or the default
+        """
+        if key not in self._data:
+            return default
+        self._data.move_to_end(key)
+        return self._data[key]
+
+    def set(self, key, value):
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.size:
+            self._data.popitem(last=False)
+
+    def save(self):
+        """
+        Write the entries in the order of use, replacing the file atomically
+        as the store may be shared
+        """
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        with open(tmp_path, 'w') as fh:
+            json.dump(list(self._data.items()), fh)
+        os.replace(tmp_path, self.path)
+
+
+class Journal:
+    """
+    An append-only file of JSON records, one per line. Every record is
+    flushed when appended, so the records survive an interrupted run.
+    """
+    def __init__(self, path):
+        self.path = path
+        self._fh = None
+
+    def __iter__(self):
+        """
+        Iterate the records, a partially written last record is skipped
+        """
+        try:
+            with open(self.path) as fh:
+                for line in fh:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        return
+        except FileNotFoundError:
+            return
+
+    def append(self, record):
+        if self._fh is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._fh = open(self.path, 'a')
+        self._fh.write(json.dumps(record) + '\n')
+        self._fh.flush()
+
+    def close(self):
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def clear(self):
+        """
+        Close and remove the journal once its records are compacted
+        """
+        self.close()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Compressor:
+    """
+    Write the precompressed companions of files in a background thread, a
+    `.gz` and a `.br` if brotli is installed, for web servers serving them
+    as they are, e.g. nginx with `gzip_static`. The companions of a file are
+    only written again if its content has changed, those of files too small
+    to be worth compressing are removed.
+    """
+    min_size = 1024
+    brotli_quality = 9
+
+    def __init__(self):
+        self.written = 0
+        self.skipped = 0
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, path):
+        """
+        Compress a file in the background, or right away if not started
+        """
+        if self._thread is None:
+            self.compress(path)
+        else:
+            self._queue.put(path)
+
+    def close(self):
+        """
+        Wait for the queued files to be compressed
+        """
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        for path in iter(self._queue.get, None):
+            try:
+                self.compress(path)
+            except Exception:
+                logger.exception(f'failed to compress {path}')
+
+    def compress(self, path):
+        """
+        :return: True if the companions were written
+        """
+        with open(path, 'rb') as fh:
+            data = fh.read()
+
+        companions = {path + '.gz': lambda: gzip.compress(data, 9, mtime=0)}
+        if brotli is not None:
+            companions[path + '.br'] = lambda: brotli.compress(
+                data, quality=self.brotli_quality)
+
+        if len(data) < self.min_size:
+            for companion in companions:
+                if os.path.exists(companion):
+                    os.remove(companion)
+            return False
+
+        if _gzip_of(path + '.gz', data) and all(
+            os.path.exists(companion) for companion in companions
+        ):
+            self.skipped += 1
+            return False
+
+        for companion, compress in companions.items():
+            tmp = f'{companion}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as fh:
+                fh.write(compress())
+            os.replace(tmp, companion)
+        self.written += 1
+        return True
+
+
+def _gzip_of(path, data):
+    """
+    Whether a gzip file has the data, by the CRC-32 and size in its trailer
+    """
+    try:
+        with open(path, 'rb') as fh:
+            fh.seek(-8, os.SEEK_END)
+            trailer = fh.read(8)
+    except OSError:
+        return False
+    return struct.unpack('<II', trailer) == (zlib.crc32(data),
+                                             len(data) & 0xffffffff)
+
+
+def is_bare(workdir, repo):
+    """
+    Whether a repo inside the workdir is a bare mirror without a working tree
+    """
+    path = os.path.join(workdir, repo)
+    return (not os.path.exists(os.path.join(path, '.git')) and
+            os.path.isfile(os.path.join(path, 'HEAD')))
+
+
+def git_path(workdir, repo, name):
+    """
+    The path of a file in the git folder of a repo, of a clone or a bare
+    mirror, where the indexes and caches of a repo are kept
+    """
+    path = os.path.join(workdir, repo)
+    if not is_bare(workdir, repo):
+        path = os.path.join(path, '.git')
+    return os.path.join(path, name)
+
+
 def empty_git_sha(workdir, repo):
-    return run_git(workdir, repo, 'mktree < /dev/null')
+    return git(workdir, repo, 'mktree', input='')
+
+
+MANIFEST = 'manifest.json'
+
 
+def content_hash(content):
+    return hashlib.sha256(content).hexdigest()[:16]
 
-def save_json(data, root, fname, folders=''):
+
+def save_json(data, root, fname, folders='', manifest=None):
+    """
+    Write data as a JSON file atomically, readers never see a partially
+    written file
+
+    :param manifest: optional dict of the paths relative to the root to the
+        hash of their content, updated. A file is not written again if the
+        hash of its content is unchanged.
+    :return: the path of the file, None if unchanged
+    """
     if isinstance(folders, list):
         folders = '/'.join(folders)
     folders = folders.strip('/')
-    os.makedirs(os.path.join(root, folders), exist_ok=True)
     fpath = os.path.join(root, folders, fname)
-    with open(fpath, 'w') as fh:
-        json.dump(data, fh)
+    content = json.dumps(data).encode()
+
+    if manifest is not None:
+        name = os.path.relpath(fpath, root)
+        digest = content_hash(content)
+        # the size catches files written after the manifest was saved
+        if (manifest.get(name) == digest and os.path.isfile(fpath) and
+                os.path.getsize(fpath) == len(content)):
+            return None
+        manifest[name] = digest
+
+    os.makedirs(os.path.join(root, folders), exist_ok=True)
+    tmp = f'{fpath}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(content)
+    os.replace(tmp, fpath)
+    return fpath
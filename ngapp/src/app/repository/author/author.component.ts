@@ -54,7 +54,7 @@ export class AuthorComponent implements OnInit, OnDestroy {
     this.author = author;
     this.subscriptions.add(
       this.repoService
-        .getRepoActivity(name)
+        .getAuthorActivity(name, author)
         .subscribe((data) => this.setRepoActivity(data)),
     );
     this.subscriptions.add(
@@ -49,7 +49,7 @@ export class AuthorsComponent implements OnInit {
   getRepo({ name }: any) {
     this.repo = name;
     this.subscription = this.repoService
-      .getRepoActivity(name)
+      .getAuthorsActivity(name)
       .subscribe((data) => this.setRepoActivity(data));
   }
 
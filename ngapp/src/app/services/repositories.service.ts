@@ -1,20 +1,48 @@
 import { Injectable } from '@angular/core';
 import { HttpClient } from '@angular/common/http';
 
+import { Observable, of } from 'rxjs';
+import { catchError, map, shareReplay, switchMap } from 'rxjs/operators';
+
+// content hashes of the data files by their path, written by the generator
+type Manifest = { [path: string]: string };
+
 @Injectable({
   providedIn: 'root',
 })
 export class RepositoriesService {
   endpoint = '/workdir/data/';
+  manifest: Observable<Manifest> | null = null;
 
   constructor(public http: HttpClient) {}
 
-  get(path: string) {
-    return this.http.get(`${this.endpoint}${path}`);
+  loadManifest(refresh = false) {
+    if (refresh || !this.manifest) {
+      this.manifest = this.http
+        .get<Manifest>(`${this.endpoint}manifest.json`)
+        .pipe(
+          catchError(() => of({} as Manifest)),
+          shareReplay(1),
+        );
+    }
+    return this.manifest;
+  }
+
+  // the content hash busts the long-lived cache of a changed file
+  url(path: string, manifest: Manifest) {
+    const hash = manifest[path];
+    return `${this.endpoint}${path}${hash ? `?v=${hash}` : ''}`;
+  }
+
+  get(path: string, refresh = false) {
+    return this.loadManifest(refresh).pipe(
+      switchMap((manifest) => this.http.get(this.url(path, manifest))),
+    );
   }
 
   getRepositories() {
-    return this.get('repos.json');
+    // polled, the manifest is reloaded along
+    return this.get('repos.json', true);
   }
 
   getRepoSummary(name: string) {
@@ -25,6 +53,33 @@ export class RepositoriesService {
     return this.get(`${name}/activity.json`);
   }
 
+  // sharded activity leaves the series of the authors out of activity.json,
+  // the yearly, monthly and weekly series of all are in authors/index.json
+  getAuthorsActivity(name: string) {
+    return this.getRepoActivity(name).pipe(
+      switchMap((data: any) =>
+        data.by_authors
+          ? of(data)
+          : this.get(`${name}/authors/index.json`).pipe(
+              map((by_authors) => ({ ...data, by_authors })),
+            ),
+      ),
+    );
+  }
+
+  // and the full series of an author in authors/<id>.json
+  getAuthorActivity(name: string, author: string) {
+    return this.getRepoActivity(name).pipe(
+      switchMap((data: any) =>
+        data.by_authors
+          ? of(data)
+          : this.get(`${name}/authors/${data.authors[author]}.json`).pipe(
+              map((series) => ({ ...data, by_authors: { [author]: series } })),
+            ),
+      ),
+    );
+  }
+
   getLines(name: string) {
     return this.get(`${name}/lines.json`);
   }